@@ -1,22 +1,33 @@
 import os
 import pickle
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask import Flask, render_template, request, redirect, url_for, session, make_response, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
-import json
-from .db import get_db, close_db
+from .db import get_db, get_client, close_db
 from .admin import admin_bp
-from .stats import record_event
+from .stats import record_event, record_view, recompute_popularity, sync_item_scores, check_decay_epoch, STATS_SYNC_SEC
+from .catalog import get_catalog
+from .style_index import get_style_index
+from .feed import feed_page, card, style_label, FeedCursorError, FEED_PAGE_SIZE
+from .uniques import viewer_id, set_viewer_cookie
+from .background import get_background
+from .user_cache import get_user_cache
+from .file_cache import JsonFileCache
+from .refresh import Refresher, register_refresher
+from .ranking_engine import get_ranking_engine
+from .guest_cookies import guest_history, guest_bookmarks, set_guest_history, set_guest_bookmarks, HISTORY_COOKIE
+from .history import recent_history as recent_history_entries, compact_history, save_history, sweep_history_tombstones, migrate_guest_history, HISTORY_MAX_ENTRIES
 from firebase_admin import firestore
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import threading
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from itsdangerous import URLSafeTimedSerializer
 import time
-from .open_meteo import fetch_nagoya_weather
+from .open_meteo import fetch_weather, WeatherFetchError, LOCATIONS, DEFAULT_LOCATION
 from .wiki_trends import build_wiki_trend_payload
 
 load_dotenv()
@@ -26,6 +37,8 @@ app.secret_key = "your_secret_key" # In production, use env var
 serializer = URLSafeTimedSerializer(app.secret_key)
 
 app.register_blueprint(admin_bp, url_prefix="/admin")
+# Anonymous viewer id cookie (unique viewer counting)
+app.after_request(set_viewer_cookie)
 
 # Template Filter for datetime formatting
 @app.template_filter("fmt_dt")
@@ -39,6 +52,9 @@ def fmt_dt(v):
         return v.strftime("%Y/%m/%d %H:%M")
     return str(v)
 
+# Style badge of an item card: same text as feed.card() gives the lazily loaded pages
+app.add_template_filter(style_label, "style_label")
+
 # ... CACHE logic ...
 
 def send_reset_email(to_email, token):
@@ -156,61 +172,93 @@ def reset_password(token):
 
 # Path to cache file in instance directory
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Created on first write (atomic_write_json), not at import
 INSTANCE_DIR = os.path.join(os.path.dirname(BASE_DIR), 'instance')
-if not os.path.exists(INSTANCE_DIR):
-    os.makedirs(INSTANCE_DIR)
 
 # --- Weather Cache & Logic ---
 WEATHER_CACHE_FILE = os.path.join(INSTANCE_DIR, "weather_cache.json")
 WEATHER_TTL_SEC = 60 * 60  # 1 hour
 
-def load_weather_cache():
-    try:
-        if os.path.exists(WEATHER_CACHE_FILE):
-            with open(WEATHER_CACHE_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return None
+# Parsed once per process and re-read only when the file changes (app/file_cache.py)
+weather_file = JsonFileCache(WEATHER_CACHE_FILE)
+
+def load_weather_cache(copy=False):
+    """
+    {"locations": {location key: weather payload}} (a pre-multi-location file is read as Nagoya's).
+    Shared between requests: pass copy=True to get a payload that may be modified.
+    """
+    data = weather_file.load(copy=copy)
+    if data is not None and "locations" not in data:
+        data = {"locations": {"nagoya": data}}
+    return data
 
 def save_weather_cache(payload):
     try:
-        with open(WEATHER_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False)
+        weather_file.save(payload)
     except Exception as e:
         print(f"Error saving weather cache: {e}")
 
-def update_weather_cache(force=False):
-    # Check TTL
-    if not force and os.path.exists(WEATHER_CACHE_FILE):
-        try:
-            age = time.time() - os.path.getmtime(WEATHER_CACHE_FILE)
-            if age < WEATHER_TTL_SEC:
-                return
-        except:
-            pass
+def load_weather(location_key):
+    """Cached weather payload of one location, or None."""
+    return ((load_weather_cache() or {}).get("locations") or {}).get(location_key)
+
+def _weather_due(entries, now):
+    # Each location has its own TTL
+    return [loc for key, loc in LOCATIONS.items()
+            if now - (entries.get(key) or {}).get("fetched_at", 0) >= WEATHER_TTL_SEC]
 
+def _fetch_weather_cache():
+    # Only missing / expired locations (all of them when forced), in one batched Open-Meteo request
+    cache = load_weather_cache(copy=True) or {"locations": {}}
+    entries = cache["locations"]
+    now = time.time()
+    due = _weather_due(entries, now) or list(LOCATIONS.values())
+
+    print(f"Updating weather data ({len(due)} locations)...")
     try:
-        print("Updating weather data...")
-        payload = fetch_nagoya_weather()
+        fetched, error = fetch_weather(due), None
+    except WeatherFetchError as e:
+        # Save the locations that did arrive; the rest stay due for the retry
+        fetched, error = e.results, e
+    for key, payload in fetched.items():
         payload["ok"] = True
-        save_weather_cache(payload)
-        print("Weather data updated successfully.")
-    except Exception as e:
-        print(f"Error updating weather data: {e}")
-        old = load_weather_cache()
-        if old:
+        payload["fetched_at"] = now
+        entries[key] = payload
+    if fetched:
+        save_weather_cache(cache)
+    if error is not None:
+        raise error
+    print("Weather data updated successfully.")
+
+def _weather_failed(e):
+    # Retries exhausted: keep serving the previous data of the due locations, marked stale
+    print(f"Error updating weather data: {e}")
+    cache = load_weather_cache(copy=True) or {"locations": {}}
+    entries = cache["locations"]
+    for loc in _weather_due(entries, time.time()):
+        old = entries.get(loc["key"])
+        if old and old.get("current_temp") is not None:
             old["ok"] = True
             old["stale"] = True
             old["error"] = str(e)
-            save_weather_cache(old)
         else:
-            save_weather_cache({
+            entries[loc["key"]] = {
                 "ok": False,
                 "source": "Open-Meteo",
-                "location": {"name": "Nagoya"},
+                "location": {"key": loc["key"], "name": loc["name"]},
                 "error": str(e),
-            })
+            }
+    save_weather_cache(cache)
+
+# Single-flight, retried, circuit-broken refresh (app/refresh.py)
+weather_refresher = register_refresher(Refresher(
+    "weather", _fetch_weather_cache,
+    is_fresh=lambda: not _weather_due((load_weather_cache() or {}).get("locations", {}), time.time()),
+    on_failure=_weather_failed))
+
+def update_weather_cache(force=False):
+    """Refreshes expired locations; joins a refresh already running instead of fetching twice."""
+    weather_refresher.refresh(force=force)
 
 # --- Wiki Trends Cache & Logic ---
 WIKI_CACHE_FILE = os.path.join(INSTANCE_DIR, "wiki_trend_cache.json")
@@ -222,161 +270,144 @@ WIKI_STARTUP_MAX_AGE_SEC = 24 * 60 * 60  # 1 day
 # However, we keep it temporarily or rely on DB. 
 # The user wants DB only.
 
-def load_wiki_cache():
-    try:
-        with open(WIKI_CACHE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return None
+wiki_file = JsonFileCache(WIKI_CACHE_FILE)
+
+def load_wiki_cache(copy=False):
+    """Shared between requests: pass copy=True to get a payload that may be modified."""
+    return wiki_file.load(copy=copy)
 
 def save_wiki_cache(payload):
     try:
-        with open(WIKI_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False)
+        wiki_file.save(payload)
     except Exception as e:
         print(f"Error saving wiki cache: {e}")
 
-def update_wiki_cache(force=False):
-    # Check TTL
-    if not force and os.path.exists(WIKI_CACHE_FILE):
-        try:
-            age = time.time() - os.path.getmtime(WIKI_CACHE_FILE)
-            if age < WIKI_TTL_SEC:
-                return
-        except:
-            pass
-
-    try:
-        print("Updating wiki trends data (DB-Driven)...")
-        # Need a DB connection. Since this runs in scheduler (thread), 'g' is not available.
-        # We can use firestore.client() if app is initialized, or get_db() if context pushed.
-        # Assuming app is initialized globally in this file.
-        # Ideally: with app.app_context(): db = get_db()
-        # But 'app' might be defined later. 'firestore.client()' works if firebase_admin is initialized.
-        
-        # Use get_db() which handles initialization safely
-        db = get_db()
-
-        # 1. Aggregate Tags from Items
-        # NOTE: With large datasets, avoid reading all. For now (demonstration/MVP), reading all items is accepted.
-        items_ref = db.collection('items').stream()
-        tag_counts = {}
-        for doc in items_ref:
-            # Assuming 'styles' is list or CSV string
-            data = doc.to_dict()
-            styles = data.get('styles')
-            if not styles:
-                continue
-            
-            if isinstance(styles, str):
-                tags = [s.strip() for s in styles.split(',')]
-            elif isinstance(styles, list):
-                tags = [str(s).strip() for s in styles]
-            else:
-                continue
-            
-            for t in tags:
-                if t:
-                    tag_counts[t] = tag_counts.get(t, 0) + 1
-        
-        # Sort by count desc and take top 20
-        sorted_tags = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)
-        top_tags = [t[0] for t in sorted_tags[:20]]
-        print(f"Top tags from DB: {top_tags}")
-
-        # 2. Fetch Mapping
-        # Fetch all enabled mappings (assuming map size is small)
-        map_docs = db.collection('style_wiki_map').where('is_enabled', '==', True).stream()
-        mapping_dict = {} # Label -> Article
-        
-        # Helper to normalize for matching (simple lowercase check)
-        # Firestore keys are case sensitive. Our seed normalized to Japanese label as key.
-        # We will load all into memory.
-        for d in map_docs:
-            data = d.to_dict()
-            label = d.id # The Tag Name
-            article = data.get('wiki_article')
-            lang = data.get('lang', 'en') # Default to English
-            
-            if label and article:
-                mapping_dict[label] = {"article": article, "lang": lang}
-        
-        # 3. Intersect
-        target_mapping = {}
-        for tag in top_tags:
-            # Try direct match
-            if tag in mapping_dict:
-                target_mapping[tag] = mapping_dict[tag]
-            else:
-                # Optional: Try fuzzy or case insensitive? 
-                # For now, strict match per design requirement A.
-                pass
-        
-        if not target_mapping:
-            print("No matching wiki articles found for top tags. Fallback to full map or empty?")
-            # Fallback: If intersection is empty, maybe use top mapped items regardless of popularity?
-            # Or just use the top mapped items from the map itself if items are empty?
-            # Let's trust the logic: if no items match, trend is empty.
-            if not top_tags and mapping_dict:
-                 # Cold start fallback: use all mapped
-                 target_mapping = mapping_dict
+def _fetch_wiki_cache():
+    print("Updating wiki trends data (DB-Driven)...")
+    # Runs in scheduler / refresh threads, where 'g' is not available:
+    # get_client() is the Firestore client usable outside of a request
+    db = get_client()
+
+    # 1. Aggregate Tags from Items (in-memory catalog, no collection read)
+    tag_counts = {}
+    for data in get_catalog().snapshot():
+        for t in data.get('style_tags', ()):
+            tag_counts[t] = tag_counts.get(t, 0) + 1
+    
+    # Sort by count desc and take top 20
+    sorted_tags = sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)
+    top_tags = [t[0] for t in sorted_tags[:20]]
+    print(f"Top tags from DB: {top_tags}")
+
+    # 2. Fetch Mapping
+    # Fetch all enabled mappings (assuming map size is small)
+    map_docs = db.collection('style_wiki_map').where('is_enabled', '==', True).stream()
+    mapping_dict = {} # Label -> Article
+    
+    # Helper to normalize for matching (simple lowercase check)
+    # Firestore keys are case sensitive. Our seed normalized to Japanese label as key.
+    # We will load all into memory.
+    for d in map_docs:
+        data = d.to_dict()
+        label = d.id # The Tag Name
+        article = data.get('wiki_article')
+        lang = data.get('lang', 'en') # Default to English
         
-        print(f"Target Mapping for API: {target_mapping.keys()}")
-
-        # 4. Build Payload
-        payload = build_wiki_trend_payload(target_mapping)
-        payload["ok"] = True
-        save_wiki_cache(payload)
-        print("Wiki trends updated successfully.")
-
-    except Exception as e:
-        print(f"Error updating wiki trends: {e}")
-        # logic for stale fall back
-        old = load_wiki_cache()
-        if old:
-            old["ok"] = False # Mark as failed/stale
-            old["stale"] = True
-            old["error"] = str(e)
-            save_wiki_cache(old)
-            print("Fallback to stale wiki data.")
+        if label and article:
+            mapping_dict[label] = {"article": article, "lang": lang}
+    
+    # 3. Intersect
+    target_mapping = {}
+    for tag in top_tags:
+        # Try direct match
+        if tag in mapping_dict:
+            target_mapping[tag] = mapping_dict[tag]
         else:
-            save_wiki_cache({"ok": False, "error": str(e), "source": "Wikimedia Pageviews"})
-
-def is_cache_stale(path, max_age_sec):
-    if not os.path.exists(path):
-        return True
-    try:
-        age = time.time() - os.path.getmtime(path)
-        return age >= max_age_sec
-    except Exception:
-        return True
+            # Optional: Try fuzzy or case insensitive? 
+            # For now, strict match per design requirement A.
+            pass
+    
+    if not target_mapping:
+        print("No matching wiki articles found for top tags. Fallback to full map or empty?")
+        # Fallback: If intersection is empty, maybe use top mapped items regardless of popularity?
+        # Or just use the top mapped items from the map itself if items are empty?
+        # Let's trust the logic: if no items match, trend is empty.
+        if not top_tags and mapping_dict:
+             # Cold start fallback: use all mapped
+             target_mapping = mapping_dict
+    
+    print(f"Target Mapping for API: {target_mapping.keys()}")
+
+    # 4. Build Payload
+    payload = build_wiki_trend_payload(target_mapping)
+    payload["ok"] = True
+    save_wiki_cache(payload)
+    print("Wiki trends updated successfully.")
+
+def _wiki_fresh():
+    # Only a successful refresh writes the file, so its age is the age of the data
+    age = wiki_file.age()
+    return age is not None and age < WIKI_TTL_SEC
+
+# A failed refresh leaves the file alone (it stays stale, so retries / the breaker apply);
+# readers learn about the failure from wiki_refresher.error(), see load_wiki()
+wiki_refresher = register_refresher(Refresher("wiki", _fetch_wiki_cache, is_fresh=_wiki_fresh))
+
+def load_wiki():
+    """Wiki trends for display: the cached payload, marked stale while refreshes are failing."""
+    wiki = load_wiki_cache() or {"ok": False, "source": "Wikimedia Pageviews"}
+    error = wiki_refresher.error()
+    if error:
+        wiki = dict(wiki, stale=True, error=error)
+    return wiki
 
-# Initialize Scheduler
-scheduler = BackgroundScheduler()
-scheduler.start()
+def update_wiki_cache(force=False):
+    """Refreshes the wiki trends if older than WIKI_TTL_SEC; joins a refresh already running."""
+    wiki_refresher.refresh(force=force)
 
-# Add weather update to scheduler
-scheduler.add_job(func=update_weather_cache, trigger="interval", minutes=60)
-# Add wiki update to scheduler
-scheduler.add_job(func=update_wiki_cache, trigger="interval", hours=6)
+def is_cache_stale(cache, max_age_sec):
+    age = cache.age()
+    return age is None or age >= max_age_sec
 
-# Run weather initially if needed
-if not os.path.exists(WEATHER_CACHE_FILE):
-    try:
-        update_weather_cache(force=True)
-    except:
-        pass
-
-# Run wiki initially if needed
-if is_cache_stale(WIKI_CACHE_FILE, WIKI_STARTUP_MAX_AGE_SEC):
-    # Run in background via thread or just sync for simple start?
-    # Sync for demo so data appears immediately
-    try:
-        print("Initial Wiki Trends update...")
-        with app.app_context():
-            update_wiki_cache(force=True)
-    except Exception as e:
-        print(f"Initial Wiki Update failed: {e}")
+# Scheduler and startup refreshes run only in the serving process: importing the package
+# (scripts, CLI commands, tests) must not start jobs or fetch anything.
+scheduler = BackgroundScheduler()
+_background_jobs_lock = threading.Lock()
+
+def start_background_jobs():
+    """Starts the scheduler and the startup refreshes (call once from the server entry point)."""
+    # Refuses to run with a decay time base past its bound (see app/stats.py)
+    check_decay_epoch()
+    with _background_jobs_lock:
+        if scheduler.running:
+            return
+        scheduler.start()
+        # Shut down the scheduler when exiting the app
+        atexit.register(lambda: scheduler.shutdown())
+
+    # Add weather update to scheduler
+    scheduler.add_job(func=update_weather_cache, trigger="interval", minutes=60)
+    # Add wiki update to scheduler
+    scheduler.add_job(func=update_wiki_cache, trigger="interval", hours=6)
+    # Recompute popularity_score for the whole catalog (once just after midnight, plus a catch-up
+    # run at startup in case the server was down at midnight; it is skipped if today's run finished,
+    # and only one process at a time runs it, see RECOMPUTE_LEASE_SEC)
+    scheduler.add_job(func=recompute_popularity, trigger="cron", hour=0, minute=0, second=30)
+    scheduler.add_job(func=recompute_popularity, next_run_time=datetime.now())
+    # Trim users' history to HISTORY_MAX_ENTRIES (nightly)
+    scheduler.add_job(func=compact_history, trigger="cron", hour=3, minute=0)
+    # Remove history entries of deleted items
+    scheduler.add_job(func=sweep_history_tombstones, trigger="interval", minutes=10)
+    # Copy scores from item_stats (and roll up counter shards) onto the items
+    scheduler.add_job(func=sync_item_scores, trigger="interval", seconds=STATS_SYNC_SEC)
+    # Warn ahead of the decay_score bound (DECAY_REBASE_WARN_DAYS)
+    scheduler.add_job(func=check_decay_epoch, trigger="cron", hour=4, minute=0)
+
+    # Initial weather / wiki refresh in the background (missing or expired data):
+    # the app starts serving at once, readers see the previous cache until it lands
+    weather_refresher.revalidate()
+    if is_cache_stale(wiki_file, WIKI_STARTUP_MAX_AGE_SEC):
+        wiki_refresher.revalidate()
 
 def build_weather_rules(weather):
     fired = []
@@ -418,47 +449,6 @@ def build_weather_rules(weather):
 
     return score_w, fired
 
-def score_item_by_weather(item, w_scores):
-    # Normalize tags/styles to check against rules
-    # styles is csv string or list
-    raw_styles = item.get("styles")
-    tags = set()
-    if raw_styles:
-        if isinstance(raw_styles, str):
-            tags.update([s.strip().lower() for s in raw_styles.split(',')])
-        elif isinstance(raw_styles, list):
-            tags.update([str(s).lower() for s in raw_styles])
-    
-    # Also check 'category' or 'name' if tags are missing, 
-    # but for now let's stick to styles tags mapping or loose matching
-    # Map Japanese keywords to internal keys if needed, OR just match keys if they exist in tags
-    # Let's add basic mapping for demo if tags are Japanese
-    # This is a heuristic mapping
-    # Ensure all components are strings before concatenation
-    name_str = str(item.get("name") or "")
-    cat_str = str(item.get("category") or "")
-    style_str = str(item.get("styles") or "")
-    
-    text_to_check = (name_str + " " + cat_str + " " + style_str).lower()
-    
-    s = 0
-    # Simple keyword matching for demo
-    if w_scores["waterproof"] > 0 and any(x in text_to_check for x in ["防水", "撥水", "ナイロン", "waterproof", "rain"]):
-        s += w_scores["waterproof"]
-    if w_scores["outer"] > 0 and any(x in text_to_check for x in ["コート", "ダウン", "ジャケット", "アウター", "outer", "jacket"]):
-        s += w_scores["outer"]
-    if w_scores["windproof"] > 0 and any(x in text_to_check for x in ["防風", "ウィンド", "wind", "レザー"]):
-        s += w_scores["windproof"]
-    if w_scores["layering"] > 0 and any(x in text_to_check for x in ["カーディガン", "ベスト", "シャツ", "layer", "cardigan"]):
-        s += w_scores["layering"]
-    if w_scores["breathable"] > 0 and any(x in text_to_check for x in ["リネン", "麻", "メッシュ", "半袖", "breathable", "cool"]):
-        s += w_scores["breathable"]
-        
-    return s
-
-# Shut down the scheduler when exiting the app
-atexit.register(lambda: scheduler.shutdown())
-
 @app.route('/')
 def index():
     return redirect(url_for('home'))
@@ -500,44 +490,20 @@ def login():
             p_styles = user.get("preferred_styles", "")
             styles = p_styles.split(",") if p_styles else []
             session["user_styles"] = styles
+            session["weather_location"] = user.get("weather_location") or DEFAULT_LOCATION
+            # Start the session from fresh cached bookmarks / history
+            get_user_cache().invalidate(user_id)
 
-            # Migrate anonymous history
-            anon = request.cookies.get("anon_history")
-            if anon:
-                try:
-                    entries = json.loads(anon)
-                    batch = db.batch()
-                    history_ref = db.collection('users').document(user_id).collection('history')
-                    
-                    for e in entries:
-                        item_id = str(e.get("item_id") or "").strip()
-                        viewed_at_raw = e.get("viewed_at")
-                        
-                        if not item_id:
-                            continue
-
-                        # Cookie ISO format -> datetime or ServerTimestamp
-                        dt = None
-                        if viewed_at_raw:
-                            try:
-                                dt = datetime.fromisoformat(viewed_at_raw)
-                            except Exception:
-                                dt = None
-                                
-                        doc_ref = history_ref.document(item_id)
-                        batch.set(doc_ref, {
-                            "item_id": item_id,
-                            "viewed_at": dt if dt else datetime.now()
-                        }, merge=True)
-                        
-                    batch.commit()
-                except Exception as e:
-                    import traceback
-                    traceback.print_exc()
-                    print(f"Error migrating history: {e}")
+            # Migrate anonymous history after the response (background job, chunked)
+            if request.cookies.get(HISTORY_COOKIE):
+                entries = guest_history()
+                queued = not entries or get_background().submit(
+                    "history_migration", migrate_guest_history, user_id, entries)
 
                 resp = make_response(redirect(url_for("home")))
-                resp.delete_cookie("anon_history")
+                if queued:
+                    # Keep the cookie if the job was dropped (queue full): retried at the next login
+                    resp.delete_cookie(HISTORY_COOKIE)
                 return resp
 
             return redirect(url_for("home"))
@@ -593,6 +559,25 @@ def logout():
 # ------------------------
 # Home
 # ------------------------
+def user_bookmarks(db, user_id):
+    """{item_id: saved_at} of the user's bookmarks (per-user cache, see app/user_cache.py)."""
+    def load():
+        b_ref = db.collection('users').document(user_id).collection('bookmarks')
+        return {b.id: str((b.to_dict() or {}).get('saved_at') or "") for b in b_ref.select(['saved_at']).stream()}
+    return get_user_cache().get(user_id, "bookmarks", load)
+
+
+# Recent history ids kept per user (a few extra cover deleted items)
+RECENT_HISTORY_IDS = 20
+
+
+def user_recent_history(db, user_id):
+    """[item_id] of the user's latest views, newest first (per-user cache)."""
+    def load():
+        return [str(hd.get('item_id') or "") for hd in recent_history_entries(db, user_id, RECENT_HISTORY_IDS)]
+    return get_user_cache().get(user_id, "history", load)
+
+
 @app.route('/home')
 def home():
     if not session.get("logged_in"):
@@ -600,81 +585,24 @@ def home():
 
     styles = session.get("user_styles", [])
     db = get_db()
-    items_ref = db.collection('items')
     
-    # Firestore doesn't support multiple "array-contains" OR queries easily without multiple queries.
-    # For now, we will fetch all items and filter in Python if styles are present, 
-    # OR if the dataset is small. Or we can just show all.
-    # Let's try basic filtering or just fetch all for MVP migration.
-    
-    docs = items_ref.stream()
-    items = []
-    existing_styles = set()
+    # Items come from the in-process catalog snapshot (kept live by a Firestore listener),
+    # so a page view no longer reads the whole collection.
+    catalog = get_catalog().snapshot()
 
-    # 1. Fetch all items once and store in a dictionary for fast lookup
-    all_items_map = {}
+    # 1. Read-only id -> item mapping for fast lookup
+    all_items_map = catalog.items
     search_query = request.args.get('search')
-    
-    for doc in docs:
-        d = doc.to_dict()
-        d['id'] = doc.id
-        all_items_map[str(doc.id)] = d
-        
-        # Collect styles for the UI filter list
-        raw_styles = d.get('styles')
-        if raw_styles:
-            if isinstance(raw_styles, str):
-                parts = [s.strip() for s in raw_styles.split(',') if s.strip()]
-                existing_styles.update(parts)
-            elif isinstance(raw_styles, list):
-                existing_styles.update([s for s in raw_styles if s])
-
-        # Filter Logic
-        # Priority 1: Search Query (from Trends page or elsewhere)
-        if search_query:
-            q = search_query.lower()
-            # Check name
-            if q in d.get('name', '').lower():
-                 items.append(d)
-                 continue
-            # Check category
-            if q in d.get('category', '').lower():
-                 items.append(d)
-                 continue
-            # Check styles
-            s_val = d.get('styles')
-            if isinstance(s_val, list):
-                if any(q in s.lower() for s in s_val):
-                    items.append(d)
-                    continue
-            elif isinstance(s_val, str):
-                if q in s_val.lower():
-                    items.append(d)
-                    continue
-            
-            # If search query exists and no match, skip this item
-            continue
-
-        # Priority 2: Style Filter (if no search query)
-        if styles:
-            item_styles = d.get('styles', "")
-            if item_styles:
-                # check if any user style is in item styles
-                if any(s in item_styles for s in styles):
-                    items.append(d)
-                else:
-                    pass 
-            else:
-                pass
-        else:
-            items.append(d)
-    
+
     # Filter available styles based on what is actually in DB
-    available_styles_list = sorted(list(existing_styles))
-    
-    # Sort items by popularity_score (descending), then by name
-    # Items without popularity_score will be treated as 0
-    items.sort(key=lambda x: (x.get('popularity_score') or 0, x.get('name', '')), reverse=True)
+    available_styles_list = get_style_index().styles()
+
+    # Only the first page is rendered here; later pages are lazy-loaded from /home/feed.
+    # Priority 1: Search Query (from Trends page or elsewhere): posting-list intersection,
+    # ranked by match quality then popularity.
+    # Priority 2: Style Filter: union of the style posting lists, already sorted by
+    # popularity_score (descending), then by name; no styles -> every item in that order.
+    items, next_cursor = feed_page(app.secret_key, styles=styles, search_query=search_query)
     
     # Recent history
     recent_history = []
@@ -683,64 +611,35 @@ def home():
 
     if user_id:
         try:
-            # Fetch History
-            history_ref = db.collection('users').document(user_id).collection('history')
-            # Fetch ALL history to ensure we sort correctly in Python.
-            # Firestore sort is unreliable with mixed types (String/Timestamp), and limit() without sort
-            # arbitrarily cuts off documents by ID, hiding recently viewed items.
-            h_docs = history_ref.stream() 
-            
-            # Helper to parse time for sorting
-            def parse_time(val):
-                if not val: return datetime.min
-                if hasattr(val, 'to_datetime'): return val.to_datetime().replace(tzinfo=None)
-                if isinstance(val, datetime): return val.replace(tzinfo=None)
-                try: return datetime.fromisoformat(str(val)).replace(tzinfo=None)
-                except: return datetime.min
-
-            # Load into list and sort python-side
-            loaded_history = []
-            for h in h_docs:
-                hd = h.to_dict()
-                loaded_history.append(hd)
-            
-            # Sort desc
-            loaded_history.sort(key=lambda x: parse_time(x.get('viewed_at')), reverse=True)
-
-            seen_item_ids = set()
-            for hd in loaded_history:
-                item_id = str(hd.get('item_id') or "")
-                if item_id in all_items_map and item_id not in seen_item_ids:
+            # History and bookmark ids come from the per-user cache (no reads on a warm cache)
+            for item_id in user_recent_history(db, user_id):
+                if item_id in all_items_map:
                     recent_history.append(all_items_map[item_id])
-                    seen_item_ids.add(item_id)
                 if len(recent_history) >= 10:
                     break
-            
-            # 2. Fetch Bookmarks
-            bookmark_ref = db.collection('users').document(user_id).collection('bookmarks')
-            b_docs = bookmark_ref.order_by('saved_at', direction=firestore.Query.DESCENDING).limit(10).stream()
-            for b in b_docs:
-                item_id = str(b.id)
+
+            # 2. Bookmarks, newest saved first
+            bookmarks = user_bookmarks(db, user_id)
+            for item_id in sorted(bookmarks, key=bookmarks.get, reverse=True):
                 if item_id in all_items_map:
                     saved_items.append(all_items_map[item_id])
+                if len(saved_items) >= 10:
+                    break
         except Exception as e:
             print(f"Error fetching history/bookmarks: {e}")
     else:
         # For guests (Cookies)
         try:
             # History from cookie
-            anon_h = json.loads(request.cookies.get("anon_history", "[]"))
             seen_h = set()
-            for entry in anon_h:
-                iid = entry.get("item_id")
+            for iid, _ in guest_history():
                 if iid in all_items_map and iid not in seen_h:
                     recent_history.append(all_items_map[iid])
                     seen_h.add(iid)
                 if len(recent_history) >= 10: break
 
             # Bookmarks from cookie
-            anon_b = json.loads(request.cookies.get("bookmarks", "[]"))
-            for iid in reversed(anon_b): # Show newest first if stored as list
+            for iid in reversed(guest_bookmarks()): # Show newest first if stored as list
                 if iid in all_items_map:
                     saved_items.append(all_items_map[iid])
                 if len(saved_items) >= 10: break
@@ -750,28 +649,65 @@ def home():
     return render_template("home.html", 
                            current_styles=styles, 
                            items=items, 
+                           next_cursor=next_cursor,
+                           search_query=search_query or "",
                            recent_history=recent_history, 
                            saved_items=saved_items,
                            available_styles=available_styles_list)
 
+@app.route('/home/feed')
+def home_feed():
+    """Next page of home items as JSON (cards only), for infinite scroll."""
+    if not session.get("logged_in"):
+        return jsonify({"error": "Login required"}), 401
+
+    try:
+        items, next_cursor = feed_page(app.secret_key,
+                                       styles=session.get("user_styles", []),
+                                       search_query=request.args.get('search'),
+                                       cursor=request.args.get('cursor'),
+                                       limit=request.args.get('limit', FEED_PAGE_SIZE, type=int))
+    except FeedCursorError:
+        return jsonify({"error": "invalid cursor"}), 400
+
+    return jsonify({"items": [card(it) for it in items], "next_cursor": next_cursor})
+
 # ------------------------
 # Detail
 # ------------------------
 @app.route('/detail/<item_id>') # Changed to string ID
 def detail(item_id):
     db = get_db()
-    item_ref = db.collection('items').document(str(item_id))
-    doc = item_ref.get()
-    
-    if not doc.exists:
-        return "Item not found", 404
-        
-    item = doc.to_dict()
-    item['id'] = doc.id
+    user_id = session.get("user_id") if session.get("logged_in") else None
+
+    # Item from the in-memory catalog, bookmark state from the per-user cache
+    item = get_catalog().snapshot().get(item_id)
+    if item is not None:
+        item = dict(item)
+    else:
+        # Not in the catalog (yet)
+        doc = db.collection('items').document(str(item_id)).get()
+        if not doc.exists:
+            return "Item not found", 404
+        item = doc.to_dict()
+        item['id'] = doc.id
+
+    is_bookmarked = False
+    if user_id:
+        try:
+            is_bookmarked = str(item_id) in user_bookmarks(db, user_id)
+        except Exception as e:
+            print(f"Error fetching bookmarks: {e}")
+
+    # View event and history are fire-and-forget: written by background workers
+    background = get_background()
+    background.submit("view", record_view, item_id, viewer_id())
+    if user_id:
+        background.submit("history", save_history, user_id, str(item_id), datetime.now(timezone.utc), item)
+        # The cached recent history sees the view now, not after the background write
+        get_user_cache().update(user_id, "history",
+                                lambda ids: ([str(item_id)] + [i for i in ids if i != str(item_id)])[:RECENT_HISTORY_IDS])
 
-    # Record View Event
-    record_event(item_id, 'views')
-    
     # Fetch shops (assuming separate collection or subcollection? Original had many-to-many)
     # Since we are migrating, let's just assume shops are not fully migrated or simplistic.
     # We can fake it or query a shops collection if we migrate that too.
@@ -781,51 +717,16 @@ def detail(item_id):
     if item.get("shop_url"):
         shops.append({"name": "Official Shop", "site_url": item.get("shop_url")})
 
-    # Log history
-    if session.get("logged_in") and session.get("user_id"):
-        try:
-            # Use item_id as document ID to prevent duplicates
-            h_ref = db.collection('users').document(session["user_id"]).collection('history').document(str(item_id))
-            h_ref.set({
-                "item_id": str(item_id),
-                "viewed_at": datetime.now()
-            }, merge=True)
-            print(f"DEBUG: Saved history for {item_id}")
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            print(f"Error saving history: {e}")
-
-    # Check if bookmarked
-    is_bookmarked = False
-    if session.get("logged_in") and session.get("user_id"):
-        try:
-            bookmark_doc = db.collection('users').document(session["user_id"]).collection('bookmarks').document(str(item_id)).get()
-            is_bookmarked = bookmark_doc.exists
-        except:
-            pass
-    else:
+    if not session.get("logged_in"):
         # Check from cookie for guests
-        try:
-            bookmarks = json.loads(request.cookies.get("bookmarks", "[]"))
-            is_bookmarked = item_id in bookmarks
-        except:
-            pass
+        is_bookmarked = item_id in guest_bookmarks()
+
+        # Anon history cookie: this item moves to the front
+        entries = [e for e in guest_history() if e[0] != item_id]
+        entries.insert(0, (item_id, int(time.time())))
 
-    # Anon history cookie
-    if not session.get("logged_in"):
-        try:
-            anon = request.cookies.get("anon_history")
-            arr = json.loads(anon) if anon else []
-        except:
-            arr = []
-        
-        arr = [e for e in arr if e.get("item_id") != item_id]
-        arr.insert(0, {"item_id": item_id, "viewed_at": datetime.now().isoformat()})
-        arr = arr[:20]
-        
         resp = make_response(render_template("detail.html", item=item, shops=shops, is_bookmarked=is_bookmarked))
-        resp.set_cookie("anon_history", json.dumps(arr, ensure_ascii=False), max_age=30*24*3600, httponly=True)
+        set_guest_history(resp, entries)
         return resp
 
     return render_template("detail.html", item=item, shops=shops, is_bookmarked=is_bookmarked)
@@ -858,23 +759,24 @@ def item_save(item_id):
     if session.get("logged_in") and session.get("user_id"):
         user_id = session["user_id"]
         bookmark_ref = db.collection('users').document(user_id).collection('bookmarks').document(str(item_id))
-        doc = bookmark_ref.get()
-        if doc.exists:
+        cache = get_user_cache()
+        # Current state from the per-user bookmark cache (no document read per toggle)
+        if str(item_id) in user_bookmarks(db, user_id):
             bookmark_ref.delete()
+            cache.update(user_id, "bookmarks",
+                         lambda b: {k: v for k, v in b.items() if k != str(item_id)})
             record_event(item_id, 'saves', amount=-1)
             is_bookmarked = False
         else:
-            bookmark_ref.set({"saved_at": datetime.now().isoformat()})
+            saved_at = datetime.now().isoformat()
+            bookmark_ref.set({"saved_at": saved_at})
+            cache.update(user_id, "bookmarks", lambda b: {**b, str(item_id): saved_at})
             record_event(item_id, 'saves', amount=1)
             is_bookmarked = True
         return jsonify({"status": "ok", "is_bookmarked": is_bookmarked})
     else:
         # For guests using cookies
-        try:
-            bookmarks = json.loads(request.cookies.get("bookmarks", "[]"))
-        except:
-            bookmarks = []
-            
+        bookmarks = guest_bookmarks()
         if item_id in bookmarks:
             bookmarks.remove(item_id)
             record_event(item_id, 'saves', amount=-1)
@@ -885,7 +787,7 @@ def item_save(item_id):
             is_bookmarked = True
             
         resp = jsonify({"status": "ok", "is_bookmarked": is_bookmarked})
-        resp.set_cookie("bookmarks", json.dumps(bookmarks), max_age=30*24*3600, httponly=True)
+        set_guest_bookmarks(resp, bookmarks)
         return resp
 
 @app.route('/history')
@@ -897,46 +799,27 @@ def history():
     user_id = session["user_id"]
     rows = []
     try:
-        h_ref = db.collection('users').document(user_id).collection('history')
-        # Fetch up to 50 recent items
-        h_docs = list(h_ref.order_by('viewed_at', direction=firestore.Query.DESCENDING).limit(50).stream())
-        
-        item_ids = []
-        history_map = {} # item_id -> viewed_at
-
-        for h in h_docs:
-            hd = h.to_dict()
+        # One ordered, limited query: each entry carries the item snapshot it needs
+        # (history is capped at HISTORY_MAX_ENTRIES; deleted items are swept by tombstones)
+        snapshot = get_catalog().snapshot()
+        for hd in recent_history_entries(db, user_id, HISTORY_MAX_ENTRIES):
             item_id = str(hd.get('item_id') or "").strip()
             if not item_id:
-               continue
-            
-            # If duplicates somehow exist in query results (unlikely with docID=itemID but good safety)
-            if item_id not in history_map:
-                item_ids.append(item_id)
-                history_map[item_id] = hd.get('viewed_at')
-
-        if item_ids:
-            # Batch fetch items
-            # Create references
-            # Note: Firestore 'IN' query is limited to 10 or 30. get_all is better for batch retrieval by ID.
-            item_refs = [db.collection('items').document(iid) for iid in item_ids]
-            item_docs = db.get_all(item_refs)
-            
-            for doc in item_docs:
-                if doc.exists:
-                    iid = doc.id
-                    i_data = doc.to_dict()
-                    rows.append({
-                        "id": iid, # Using item_id as row id
-                        "item_id": iid,
-                        "viewed_at": history_map.get(iid),
-                        "name": i_data.get('name'),
-                        "price": i_data.get('price'),
-                        "image_url": i_data.get('image_url')
-                    })
-            
-            # Sort again by viewed_at because get_all might not preserve order
-            rows.sort(key=lambda x: x['viewed_at'] if x['viewed_at'] else datetime.min, reverse=True)
+                continue
+            i_data = hd.get('item')
+            if i_data is None:
+                # Entry written before snapshots were stored
+                i_data = snapshot.get(item_id)
+                if i_data is None:
+                    continue
+            rows.append({
+                "id": item_id, # Using item_id as row id
+                "item_id": item_id,
+                "viewed_at": hd.get('viewed_at'),
+                "name": i_data.get('name'),
+                "price": i_data.get('price'),
+                "image_url": i_data.get('image_url')
+            })
 
     except Exception as e:
         import traceback
@@ -976,34 +859,17 @@ def trends():
     trend_list = [d.to_dict() for d in docs]
 
     # Wiki Trends
-    wiki = load_wiki_cache() or {"ok": False}
+    wiki = load_wiki()
+    wiki_refresher.revalidate()
     
     # Enrich Wiki Trends with actual items
     if wiki.get("ok") and wiki.get("trends"):
-        # Fetch a pool of items (limit to prevent scale issues, e.g. 300 recent)
-        items_ref = db.collection('items').limit(300)
-        i_docs = items_ref.stream()
-        item_pool = []
-        for d in i_docs:
-            dic = d.to_dict()
-            dic['id'] = d.id
-            # Normalize styles for matching
-            styles = dic.get('styles')
-            tags = set()
-            if isinstance(styles, str):
-                tags.update([s.strip() for s in styles.split(',')])
-            elif isinstance(styles, list):
-                tags.update([str(s).strip() for s in styles])
-            dic['_tags'] = tags
-            item_pool.append(dic)
-            
-        # Attach items to each trend
+        engine = get_ranking_engine()
+        # The cached payload is shared between requests: enrich shallow copies
+        wiki = dict(wiki, trends=[dict(tr) for tr in wiki["trends"]])
+        # Attach items to each trend: the 20 most popular items tagged with its label (exact match)
         for tr in wiki["trends"]:
-            label = tr.get("label")
-            # Find items containing this label (exact match on tag)
-            matched = [it for it in item_pool if label in it['_tags']]
-            # Take top 20
-            tr["trend_items"] = matched[:20]
+            tr["trend_items"] = engine.style_top(tr.get("label"), 20)
 
         # Filter out trends with no items
         wiki["trends"] = [tr for tr in wiki["trends"] if tr.get("trend_items")]
@@ -1014,59 +880,55 @@ def trends():
 def weather():
     if not session.get("logged_in"):
         return redirect(url_for("login"))
-        
-    db = get_db()
     
-    # Weather Logic
-    weather_data = load_weather_cache() or {}
+    # Weather Logic: forecast of the user's location (see /weather/location)
+    location_key = session.get("weather_location")
+    if location_key not in LOCATIONS:
+        location_key = DEFAULT_LOCATION
+    weather_data = load_weather(location_key) or {}
     if not weather_data:
-        weather_data = {"ok": False, "error": "weather cache missing"}
+        weather_data = {"ok": False, "error": "weather cache missing",
+                        "location": {"key": location_key, "name": LOCATIONS[location_key]["name"]}}
+    # Stale-while-revalidate: expired (or missing) locations are fetched in the background
+    weather_refresher.revalidate()
     
     w_scores, fired_rules = build_weather_rules(weather_data if weather_data.get("ok") else {})
     
-    # Fetch Items for Recommendation
-    items_ref = db.collection('items')
-    i_docs = items_ref.stream()
-    all_items = []
-    for d in i_docs:
-        dic = d.to_dict()
-        dic['id'] = d.id
-        all_items.append(dic)
-        
-    # Score items
+    # Score items: weather rule weights on each item's weather tag bitmask, plus the user's
+    # preferred styles and popularity, computed over the catalog columns (app/ranking_engine.py)
     weather_recommended = []
     if w_scores and any(v > 0 for v in w_scores.values()):
-        scored = []
-        for it in all_items:
-            # Ensure all components are strings before concatenation
-            name_str = str(it.get("name") or "")
-            cat_str = str(it.get("category") or "")
-            style_str = str(it.get("styles") or "")
-            
-            text_to_check = (name_str + " " + cat_str + " " + style_str).lower()
-            
-            s = 0
-            if w_scores["waterproof"] > 0 and any(x in text_to_check for x in ["防水", "撥水", "ナイロン", "waterproof", "rain"]):
-                s += w_scores["waterproof"]
-            if w_scores["outer"] > 0 and any(x in text_to_check for x in ["コート", "ダウン", "ジャケット", "アウター", "outer", "jacket"]):
-                s += w_scores["outer"]
-            if w_scores["windproof"] > 0 and any(x in text_to_check for x in ["防風", "ウィンド", "wind", "レザー"]):
-                s += w_scores["windproof"]
-            if w_scores["layering"] > 0 and any(x in text_to_check for x in ["カーディガン", "ベスト", "シャツ", "layer", "cardigan"]):
-                s += w_scores["layering"]
-            if w_scores["breathable"] > 0 and any(x in text_to_check for x in ["リネン", "麻", "メッシュ", "半袖", "breathable", "cool"]):
-                s += w_scores["breathable"]
-            
-            scored.append((s, it))
-        # Sort by score desc
-        scored.sort(key=lambda x: x[0], reverse=True)
-        # Take top 10 if score > 0
-        weather_recommended = [it for score, it in scored if score > 0][:10]
+        weather_recommended = get_ranking_engine().top(10, weather_weights=w_scores,
+                                                       styles=session.get("user_styles", []),
+                                                       require_weather=True)
 
     return render_template("weather.html", 
                            weather=weather_data,
                            weather_rules=fired_rules,
-                           weather_recommended=weather_recommended)
+                           weather_recommended=weather_recommended,
+                           locations=list(LOCATIONS.values()),
+                           current_location=location_key)
+
+@app.route('/weather/location', methods=['POST'])
+def update_weather_location():
+    if not session.get("logged_in"):
+        return redirect(url_for("login"))
+
+    location_key = request.form.get("location", "")
+    if location_key not in LOCATIONS:
+        return redirect(url_for("weather"))
+
+    try:
+        db = get_db()
+        db.collection('users').document(session["user_id"]).update({
+            "weather_location": location_key,
+            "updated_at": datetime.now().isoformat()
+        })
+    except Exception as e:
+        print(f"Error saving weather location: {e}")
+    session["weather_location"] = location_key
+    return redirect(url_for("weather"))
 
 if __name__ == '__main__':
+    start_background_jobs()
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -3,7 +3,15 @@ import json
 from flask import Blueprint, current_app, g, redirect, render_template, request, url_for, flash, session, abort, jsonify
 from werkzeug.security import generate_password_hash
 from .db import get_db
-from .stats import get_popularity_summary
+from .stats import get_popularity_summary, get_event_buffer, get_event_log, get_unique_viewers, decay_days_left, DECAY_EPOCH, STATS_COLLECTION, SHARD_COLLECTION
+from .catalog import get_catalog
+from .ranking_engine import get_ranking_engine
+from .item_fields import derived_fields
+from .background import get_background
+from .user_cache import get_user_cache
+from .refresh import refresh_metrics
+from .history import item_snapshot, refresh_history_snapshots, add_tombstone, migration_metrics
+from .guest_cookies import cookie_metrics
 import requests
 import os
 from firebase_admin import firestore
@@ -12,32 +20,21 @@ admin_bp = Blueprint("admin", __name__)
 
 API_LIMIT = 100
 
-def get_all_unique_categories(db):
-    """Firestoreの全アイテムから一意なカテゴリリストを取得する"""
-    items = db.collection('items').stream()
+def get_all_unique_categories():
+    """カタログ（メモリ上のスナップショット）から一意なカテゴリリストを取得する"""
     categories = set()
-    for doc in items:
-        cat = doc.to_dict().get('category')
+    for item in get_catalog().snapshot():
+        cat = item.get('category')
         if cat:
             categories.add(cat)
     return sorted(list(categories))
 
-def get_all_unique_styles(db):
-    """Fetch all unique styles from items."""
-    items_ref = db.collection('items')
-    # Optimization: If items many, this is slow. For now it's fine.
-    docs = items_ref.stream()
+def get_all_unique_styles():
+    """Fetch all unique styles from the in-process item catalog."""
     existing_styles = set()
     
-    for doc in docs:
-        d = doc.to_dict()
-        raw_styles = d.get('styles')
-        if raw_styles:
-            if isinstance(raw_styles, str):
-                parts = [s.strip() for s in raw_styles.split(',') if s.strip()]
-                existing_styles.update(parts)
-            elif isinstance(raw_styles, list):
-                existing_styles.update([s for s in raw_styles if s])
+    for d in get_catalog().snapshot():
+        existing_styles.update(d.get('style_tags', ()))
     
     return sorted(list(existing_styles))
 
@@ -239,10 +236,14 @@ def admin_items():
                 "styles": request.form.get("styles", "").strip() or None,
                 "colors": request.form.get("colors", "").strip() or None,
                 "popularity_score": 0,
-                "stats": {},
+                "decay_score": 0,
                 "created_at": datetime.now().date().isoformat()
             }
-            items_ref.add(new_item)
+            # Canonical style_tags / search_text so readers never re-parse styles
+            new_item.update(derived_fields(new_item))
+            _, new_ref = items_ref.add(new_item)
+            # Make the new item visible in this process right away (the listener confirms it later)
+            get_catalog().upsert(new_ref.id, new_item)
             flash("item を追加しました", "success")
             return redirect(url_for("admin.admin_items"))
 
@@ -277,11 +278,16 @@ def admin_items():
     for d in docs:
         i = d.to_dict()
         i['id'] = d.id
-        i['stats_summary'] = get_popularity_summary(i)
         items.append(i)
+
+    # Event counts live in item_stats; one batched read for the page
+    stats_refs = [db.collection(STATS_COLLECTION).document(i['id']) for i in items]
+    stats_docs = {s.id: s.to_dict() for s in db.get_all(stats_refs) if s.exists} if stats_refs else {}
+    for i in items:
+        i['stats_summary'] = get_popularity_summary(stats_docs.get(i['id']) or i)
         
-    available_styles = get_all_unique_styles(db)
-    available_categories = get_all_unique_categories(db)
+    available_styles = get_all_unique_styles()
+    available_categories = get_all_unique_categories()
     return render_template("admin/items_list.html", 
                            items=items, 
                            page=page, 
@@ -314,7 +320,7 @@ def admin_item_edit(item_id):
         if not name:
             flash("name は必須です", "error")
         else:
-            item_ref.update({
+            updates = {
                 "name": name,
                 "image_url": request.form.get("image_url", "").strip() or None,
                 "shop_url": request.form.get("shop_url", "").strip() or None,
@@ -323,11 +329,17 @@ def admin_item_edit(item_id):
                 "styles": request.form.get("styles", "").strip() or None,
                 "colors": request.form.get("colors", "").strip() or None,
                 "popularity_score": int(request.form.get("popularity_score", 0))
-            })
+            }
+            updates.update(derived_fields(updates))
+            item_ref.update(updates)
+            get_catalog().upsert(item_id, {**item, **updates})
+            if item_snapshot(item) != item_snapshot(updates):
+                # History rows show a copy of name / price / image
+                get_background().submit("history_refresh", refresh_history_snapshots, str(item_id), updates)
             flash("item を更新しました", "success")
             return redirect(url_for("admin.admin_items"))
 
-    available_styles = get_all_unique_styles(db)
+    available_styles = get_all_unique_styles()
     return render_template("admin/item_edit.html", item=item, available_styles=available_styles)
 
 @admin_bp.route("/items/<item_id>/delete", methods=["POST"])
@@ -369,6 +381,12 @@ def admin_item_delete(item_id):
         print(f"Error logging item delete: {e}")
 
     db.collection('items').document(str(item_id)).delete()
+    stats_ref = db.collection(STATS_COLLECTION).document(str(item_id))
+    for shard in stats_ref.collection(SHARD_COLLECTION).stream():
+        shard.reference.delete()
+    stats_ref.delete()
+    add_tombstone(db, item_id)
+    get_catalog().remove(item_id)
     flash("item ???????", "success")
     return redirect(url_for("admin.admin_items"))
 
@@ -427,7 +445,7 @@ def admin_users():
         u['delete_count'] = delete_counts.get(d.id, 0)
         users.append(u)
         
-    available_styles = get_all_unique_styles(db)
+    available_styles = get_all_unique_styles()
     return render_template("admin/users_list.html", users=users, available_styles=available_styles)
 
 @admin_bp.route("/users/<user_id>/edit", methods=["GET", "POST"])
@@ -470,6 +488,27 @@ def admin_user_delete(user_id):
     flash("user を削除しました", "success")
     return redirect(url_for("admin.admin_users"))
 
+@admin_bp.route("/catalog/metrics")
+def catalog_metrics():
+    """Snapshot size/age of the in-process item catalog."""
+    metrics = get_catalog().metrics()
+    metrics["ranking_engine"] = get_ranking_engine().metrics()
+    return jsonify(metrics)
+
+@admin_bp.route("/events/metrics")
+def event_metrics():
+    """Pending/flushed counts of the view/click/save write-behind buffer, the local event log, the view filter and guest cookie truncation."""
+    metrics = get_event_buffer().metrics()
+    metrics["event_log"] = get_event_log().metrics()
+    metrics["unique_viewers"] = get_unique_viewers().metrics()
+    metrics["background"] = get_background().metrics()
+    metrics["history_migration"] = migration_metrics()
+    metrics["guest_cookies"] = cookie_metrics()
+    metrics["user_cache"] = get_user_cache().metrics()
+    metrics["refresh"] = refresh_metrics()
+    metrics["decay"] = {"epoch": DECAY_EPOCH, "days_left": round(decay_days_left(), 1)}
+    return jsonify(metrics)
+
 @admin_bp.route("/explanation")
 def admin_explanation():
     return render_template("admin/explanation.html")
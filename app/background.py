@@ -0,0 +1,105 @@
+import atexit
+import os
+import queue
+import threading
+import time
+
+# Fire-and-forget work taken off the request thread (history writes, view events)
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 4))
+BACKGROUND_QUEUE_SIZE = int(os.environ.get("BACKGROUND_QUEUE_SIZE", 1000))
+
+
+class BackgroundExecutor:
+    """
+    Fixed pool of worker threads reading a bounded queue.
+    submit() never blocks: when the queue is full the task is dropped and counted
+    (backpressure shows up in metrics() instead of in request latency).
+    Tasks must not touch flask.g / request; pass plain values in.
+    """
+
+    def __init__(self, workers=4, max_queue=1000):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._max_queue = max_queue
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._run, name=f"background-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+        self.submitted = {}   # task name -> count
+        self.dropped = {}
+        self.failed = {}
+        self.completed = 0
+        self.last_error = None
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Queues fn(*args, **kwargs). Returns False if it was dropped (queue full)."""
+        try:
+            self._queue.put_nowait((name, fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self.dropped[name] = self.dropped.get(name, 0) + 1
+            return False
+        with self._lock:
+            self.submitted[name] = self.submitted.get(name, 0) + 1
+        return True
+
+    def shutdown(self, timeout=5.0):
+        """Waits (up to timeout seconds) for queued tasks, then stops the workers."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for _ in self._threads:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self._max_queue,
+                "workers": len(self._threads),
+                "submitted": dict(self.submitted),
+                "completed": self.completed,
+                "dropped": dict(self.dropped),
+                "failed": dict(self.failed),
+                "last_error": self.last_error,
+            }
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            if task is None:
+                self._queue.task_done()
+                return
+            name, fn, args, kwargs = task
+            try:
+                fn(*args, **kwargs)
+                with self._lock:
+                    self.completed += 1
+            except Exception as e:
+                with self._lock:
+                    self.failed[name] = self.failed.get(name, 0) + 1
+                    self.last_error = f"{name}: {e}"
+                print(f"[Background] {name} failed: {e}")
+            finally:
+                self._queue.task_done()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_background():
+    """Process-wide BackgroundExecutor (drained at exit)."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                executor = BackgroundExecutor(BACKGROUND_WORKERS, BACKGROUND_QUEUE_SIZE)
+                atexit.register(executor.shutdown)
+                _executor = executor
+    return _executor
@@ -0,0 +1,271 @@
+import os
+import threading
+import time
+from types import MappingProxyType
+
+from .db import get_client
+from .item_fields import derived_fields, has_derived_fields
+
+# How often the polling fallback re-reads the collection (and how often the
+# listener watchdog checks that the Firestore watch stream is still alive).
+CATALOG_POLL_SEC = int(os.environ.get("CATALOG_POLL_SEC", 60))
+# Set CATALOG_LISTENER=0 to skip on_snapshot and always use polling.
+CATALOG_USE_LISTENER = os.environ.get("CATALOG_LISTENER", "1") != "0"
+
+
+def _freeze(value):
+    """Recursively turn dicts/lists into read-only equivalents."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of the items collection at one point in time.
+    Iterating yields read-only item mappings (each has an 'id' key).
+    """
+    __slots__ = ("items", "version", "created_at")
+
+    def __init__(self, items, version):
+        self.items = MappingProxyType(items)
+        self.version = version
+        self.created_at = time.time()
+
+    def get(self, item_id):
+        return self.items.get(str(item_id))
+
+    def __iter__(self):
+        return iter(self.items.values())
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item_id):
+        return str(item_id) in self.items
+
+
+class ItemCatalog:
+    """
+    Process-wide copy of the items collection.
+    Loaded once, then kept current by an on_snapshot listener
+    (or a polling loop if the listener cannot be used).
+    """
+
+    def __init__(self, client_factory=get_client, collection="items",
+                 poll_sec=CATALOG_POLL_SEC, use_listener=CATALOG_USE_LISTENER):
+        self._client_factory = client_factory
+        self._collection = collection
+        self._poll_sec = poll_sec
+        self._use_listener = use_listener
+
+        self._lock = threading.RLock()
+        self._snapshot = CatalogSnapshot({}, 0)
+        self._listeners = []
+        self._started = False
+        self._stop = threading.Event()
+        self._watch = None
+        self._thread = None
+
+        self.mode = "idle"
+        self.full_loads = 0
+        self.changes_applied = 0
+        self.last_sync_at = None
+        self.last_error = None
+
+    # --- read side ---
+
+    def snapshot(self):
+        """Current snapshot. The first call loads the collection synchronously."""
+        if not self._started:
+            self.start()
+        return self._snapshot
+
+    def add_listener(self, fn):
+        """
+        fn(snapshot, changed_ids, removed_ids) is called after every applied change.
+        It is also called once immediately so derived indexes can build from the current state.
+        """
+        with self._lock:
+            self._listeners.append(fn)
+            snap = self._snapshot
+            fn(snap, set(snap.items.keys()), set())
+
+    def metrics(self):
+        snap = self._snapshot
+        now = time.time()
+        return {
+            "mode": self.mode,
+            "size": len(snap),
+            "version": snap.version,
+            "age_sec": round(now - snap.created_at, 3),
+            "last_sync_age_sec": round(now - self.last_sync_at, 3) if self.last_sync_at else None,
+            "full_loads": self.full_loads,
+            "changes_applied": self.changes_applied,
+            "last_error": self.last_error,
+        }
+
+    # --- write side ---
+
+    def upsert(self, item_id, data):
+        """Apply a local write immediately (the listener will confirm it later)."""
+        self._apply({str(item_id): data}, set())
+
+    def remove(self, item_id):
+        self._apply({}, {str(item_id)})
+
+    # --- lifecycle ---
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            try:
+                self.reload()
+            except Exception as e:
+                # The background thread keeps retrying the first load (with backoff)
+                print(f"[Catalog] Initial load failed, retrying in background: {e}")
+                self.last_error = str(e)
+                self.mode = "loading"
+            else:
+                self._start_watch()
+
+            self._thread = threading.Thread(target=self._run, name="item-catalog", daemon=True)
+            self._thread.start()
+
+    def is_loaded(self):
+        """True once the collection has been read at least once."""
+        return self.full_loads > 0
+
+    def stop(self):
+        self._stop.set()
+        if self._watch is not None:
+            try:
+                self._watch.unsubscribe()
+            except Exception:
+                pass
+            self._watch = None
+
+    def reload(self):
+        """Full re-read of the collection; only actual differences are applied."""
+        docs = {doc.id: doc.to_dict() or {} for doc in self._collection_ref().stream()}
+        self._apply(docs, set(), full=True)
+        self.full_loads += 1
+
+    # --- internals ---
+
+    def _collection_ref(self):
+        return self._client_factory().collection(self._collection)
+
+    def _start_watch(self):
+        if self._use_listener:
+            try:
+                self._watch = self._collection_ref().on_snapshot(self._on_snapshot)
+                self.mode = "listener"
+            except Exception as e:
+                print(f"[Catalog] on_snapshot unavailable, falling back to polling: {e}")
+                self.last_error = str(e)
+                self.mode = "polling"
+        else:
+            self.mode = "polling"
+
+    def _load_until_ready(self):
+        """First load after a failed start(): retried with exponential backoff (capped at poll_sec)."""
+        delay = min(1.0, self._poll_sec)
+        while not self._stop.wait(delay):
+            try:
+                self.reload()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[Catalog] Initial load failed, retrying in {delay:.0f}s: {e}")
+                delay = min(delay * 2, self._poll_sec)
+                continue
+            with self._lock:
+                self._start_watch()
+            return True
+        return False
+
+    def _run(self):
+        if self.mode == "loading" and not self._load_until_ready():
+            return
+        while not self._stop.wait(self._poll_sec):
+            try:
+                if self.mode == "listener":
+                    # Watchdog: the watch stream closes itself on unrecoverable errors.
+                    if self._watch is not None and not getattr(self._watch, "is_active", True):
+                        print("[Catalog] Listener stopped, switching to polling")
+                        self.mode = "polling"
+                        self._watch = None
+                        self.reload()
+                else:
+                    self.reload()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[Catalog] Refresh failed: {e}")
+
+    def _on_snapshot(self, docs, changes, read_time):
+        upserts = {}
+        removals = set()
+        for change in changes:
+            doc = change.document
+            if change.type.name == "REMOVED":
+                removals.add(doc.id)
+            else:
+                upserts[doc.id] = doc.to_dict() or {}
+        try:
+            self._apply(upserts, removals)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"[Catalog] Failed to apply listener changes: {e}")
+
+    def _apply(self, upserts, removals, full=False):
+        with self._lock:
+            current = self._snapshot.items
+            items = dict(current)
+            changed = set()
+
+            for item_id, data in upserts.items():
+                data = dict(data)
+                data["id"] = item_id
+                if not has_derived_fields(data):
+                    # Documents not yet backfilled: derive in memory once, at ingest
+                    data.update(derived_fields(data))
+                frozen = _freeze(data)
+                if current.get(item_id) != frozen:
+                    items[item_id] = frozen
+                    changed.add(item_id)
+
+            if full:
+                removals = set(removals) | (set(current.keys()) - set(upserts.keys()))
+            removed = {item_id for item_id in removals if item_id in items}
+            for item_id in removed:
+                del items[item_id]
+
+            self.last_sync_at = time.time()
+            if not changed and not removed:
+                return
+
+            self._snapshot = CatalogSnapshot(items, self._snapshot.version + 1)
+            self.changes_applied += len(changed) + len(removed)
+            for fn in self._listeners:
+                try:
+                    fn(self._snapshot, changed, removed)
+                except Exception as e:
+                    print(f"[Catalog] Listener {fn} failed: {e}")
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Process-wide ItemCatalog, created on first use."""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = ItemCatalog()
+    return _catalog
@@ -9,14 +9,19 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CRED_PATH = os.path.join(BASE_DIR, "config", "serviceAccountKey.json")
 
+def get_client():
+    """
+    Firestore client usable outside of a request (scheduler jobs, listener threads).
+    """
+    # Check if already initialized to avoid "app already exists" error
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(CRED_PATH)
+        firebase_admin.initialize_app(cred)
+    return firestore.client()
+
 def get_db():
     if 'db' not in g:
-        # Check if already initialized to avoid "app already exists" error
-        if not firebase_admin._apps:
-            cred = credentials.Certificate(CRED_PATH)
-            firebase_admin.initialize_app(cred)
-        
-        g.db = firestore.client()
+        g.db = get_client()
     
     return g.db
 
@@ -0,0 +1,256 @@
+import glob
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl  # POSIX only; used to keep spool segments owned by one process
+except ImportError:  # Windows dev environment
+    fcntl = None
+
+
+def _try_lock(f):
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class EventBuffer:
+    """
+    Write-behind buffer for counter events.
+
+    add() aggregates increments per (item_id, event_type, day) in memory and appends
+    the raw event to a local spool file, so the request path never waits on Firestore.
+    A background thread hands the aggregated counts to flush_fn every flush_sec seconds
+    (or sooner once flush_keys distinct keys are pending). Spool segments are deleted only
+    after flush_fn succeeds; segments left behind by a crashed process are replayed on start.
+
+    A flush seals the active spool (a new one is opened first) and sends its counts. If that
+    fails, the sealed counts are retried as they are and new events keep going to the one
+    active spool; it is sealed again only after the retry succeeded.
+    """
+
+    def __init__(self, flush_fn, spool_dir, flush_sec=5.0, flush_keys=500, max_keys=10000):
+        self._flush_fn = flush_fn
+        self._spool_dir = spool_dir
+        self._flush_sec = flush_sec
+        self._flush_keys = flush_keys
+        self._max_keys = max_keys
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._counts = {}       # (item_id, event_type, day) -> amount, events in the active spool
+        self._sealed = {}       # counts of _segments, waiting for a successful flush
+        self._segments = []     # paths of sealed (closed) spool segments
+        self._spool = None      # (path, file) currently appended to
+        self._thread = None
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.spool_errors = 0
+        self.flushed_keys = 0
+        self.flush_failures = 0
+        self.last_flush_at = None
+        self.last_error = None
+
+    # --- lifecycle ---
+
+    def start(self):
+        os.makedirs(self._spool_dir, exist_ok=True)
+        with self._lock:
+            self._replay()
+            self._spool = self._open_spool()
+        self._thread = threading.Thread(target=self._run, name="event-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Final flush (called at exit)."""
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    # --- request path ---
+
+    def add(self, item_id, event_type, amount, day):
+        """Non-blocking enqueue. Returns False if the event was dropped (buffer full)."""
+        key = (str(item_id), event_type, day)
+        with self._lock:
+            if key not in self._counts and len(self._counts) >= self._max_keys:
+                self.dropped += 1
+                return False
+            if self._spool is not None:
+                f = self._spool[1]
+                try:
+                    f.write((json.dumps([key[0], event_type, day, amount], ensure_ascii=False) + "\n").encode("utf-8"))
+                    f.flush()
+                except OSError as e:
+                    # Disk full / read-only: never fail the request over it. The event is still
+                    # counted and flushed; only its crash-safety copy is missing.
+                    self.spool_errors += 1
+                    self.last_error = str(e)
+                    if self.spool_errors == 1 or self.spool_errors % 1000 == 0:
+                        print(f"[EventBuffer] Spool write failed ({self.spool_errors} so far): {e}")
+            self._counts[key] = self._counts.get(key, 0) + amount
+            self.enqueued += 1
+            pending = len(self._counts)
+        if pending >= self._flush_keys:
+            self._wake.set()
+        return True
+
+    # --- flushing ---
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                if not self._sealed and not self._segments:
+                    if not self._counts:
+                        return
+                    # Nothing waiting for a retry: seal the active spool. The new spool is
+                    # opened before anything is swapped, so a failure here loses nothing.
+                    spool = self._open_spool()
+                    old, self._spool = self._spool, spool
+                    self._sealed, self._counts = self._counts, {}
+                    if old is not None:
+                        self._seal(old)
+                counts, segments = self._sealed, list(self._segments)
+
+            try:
+                if counts:
+                    self._flush_fn(counts)
+            except Exception as e:
+                # Keep the sealed counts (and their segments) for the next attempt
+                self.flush_failures += 1
+                self.last_error = str(e)
+                print(f"[EventBuffer] Flush failed, will retry: {e}")
+                return
+
+            with self._lock:
+                self._sealed = {}
+                self._segments = self._segments[len(segments):]
+            for path in segments:
+                self._discard_segment(path)
+            self.flushed_keys += len(counts)
+            self.last_flush_at = time.time()
+
+    def metrics(self):
+        with self._lock:
+            pending = len(self._counts)
+            sealed = len(self._sealed)
+        return {
+            "pending_keys": pending,
+            "sealed_keys": sealed,
+            "sealed_segments": len(self._segments),
+            "max_keys": self._max_keys,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "spool_errors": self.spool_errors,
+            "flushed_keys": self.flushed_keys,
+            "flush_failures": self.flush_failures,
+            "last_flush_age_sec": round(time.time() - self.last_flush_at, 3) if self.last_flush_at else None,
+            "last_error": self.last_error,
+        }
+
+    # --- internals ---
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._flush_sec)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[EventBuffer] Unexpected flush error: {e}")
+
+    def _open_spool(self):
+        path = os.path.join(self._spool_dir, f"events-{os.getpid()}-{time.time_ns()}.log")
+        f = open(path, "ab")
+        _try_lock(f)
+        return path, f
+
+    def _seal(self, spool):
+        """Makes the spool durable and closes it; its path stays in _segments until flushed."""
+        path, f = spool
+        try:
+            os.fsync(f.fileno())
+        except OSError:
+            pass
+        f.close()
+        self._segments.append(path)
+
+    def _replay(self):
+        """Load segments left by processes that died before flushing them."""
+        for path in sorted(glob.glob(os.path.join(self._spool_dir, "events-*.log"))):
+            if _owner_alive(path):
+                # Active spool or sealed segment of a live process
+                continue
+            try:
+                f = open(path, "rb")
+            except OSError:
+                continue
+            try:
+                if not _try_lock(f) or not _same_file(path, f):
+                    # Being replayed by another process starting at the same time
+                    continue
+                replayed = 0
+                for line in f:
+                    try:
+                        item_id, event_type, day, amount = json.loads(line)
+                    except ValueError:
+                        # torn last line from a crash
+                        continue
+                    key = (item_id, event_type, day)
+                    self._sealed[key] = self._sealed.get(key, 0) + amount
+                    replayed += 1
+                # Take the segment over (still locked) so no other process replays it again
+                owned = os.path.join(self._spool_dir, f"events-{os.getpid()}-{time.time_ns()}.log")
+                os.replace(path, owned)
+            except OSError as e:
+                print(f"[EventBuffer] Could not replay spool segment {path}: {e}")
+                continue
+            finally:
+                f.close()
+            self._segments.append(owned)
+            if replayed:
+                print(f"[EventBuffer] Replayed {replayed} events from {os.path.basename(path)}")
+
+    def _discard_segment(self, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"[EventBuffer] Could not remove spool segment {path}: {e}")
+
+
+def _owner_alive(path):
+    """True if the pid in events-<pid>-<ns>.log is this process or another running one."""
+    try:
+        pid = int(os.path.basename(path).split("-")[1])
+    except (IndexError, ValueError):
+        return False
+    if pid == os.getpid():
+        return True
+    if fcntl is None:
+        # os.kill(pid, 0) would terminate the process on Windows; single-process dev server there
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user (EPERM)
+        return True
+    return True
+
+
+def _same_file(path, f):
+    try:
+        return os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+    except OSError:
+        return False
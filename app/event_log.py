@@ -0,0 +1,111 @@
+import glob
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+# Default log directory (app/stats.py writes it, scripts/aggregate_event_log.py reads it)
+EVENT_LOG_DIR = os.environ.get("EVENT_LOG_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "event_log")
+
+
+def _segment_day(path):
+    """YYYYMMDD from an events-YYYYMMDD-<pid>-<n>.jsonl name -> date (None if not a segment)."""
+    try:
+        return datetime.strptime(os.path.basename(path).split("-")[1], "%Y%m%d").date()
+    except (IndexError, ValueError):
+        return None
+
+
+def list_segments(log_dir, since=None, until=None):
+    """Segment paths in time order, optionally limited to days since..until (dates, inclusive)."""
+    out = []
+    for path in sorted(glob.glob(os.path.join(log_dir, "events-*.jsonl"))):
+        day = _segment_day(path)
+        if day is None:
+            continue
+        if since is not None and day < since:
+            continue
+        if until is not None and day > until:
+            continue
+        out.append(path)
+    return out
+
+
+def iter_events(paths):
+    """Streams (ts, item_id, event_type, amount) from segments; a torn last line is skipped."""
+    for path in paths:
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    ts, item_id, event_type, amount = json.loads(line)
+                except ValueError:
+                    continue
+                yield ts, item_id, event_type, amount
+
+
+class EventLog:
+    """
+    Append-only local log of raw events, one compact JSON list per line:
+    [epoch seconds, item_id, event_type, amount].
+
+    Each process appends to its own segment (events-YYYYMMDD-<pid>-<n>.jsonl), so writers
+    never interleave; a new segment starts every day and whenever the current one reaches
+    max_bytes. Lines are handed to the OS on every append (no fsync).
+    Segments older than retention_days are deleted on rotation (0 = keep everything).
+    """
+
+    def __init__(self, log_dir, max_bytes=64 * 1024 * 1024, retention_days=0):
+        self._log_dir = log_dir
+        self._max_bytes = max_bytes
+        self._retention_days = retention_days
+        self._lock = threading.Lock()
+        self._file = None
+        self._day = None
+        self._size = 0
+
+        self.appended = 0
+        self.errors = 0
+
+    def append(self, item_id, event_type, amount=1, ts=None):
+        ts = ts if ts is not None else time.time()
+        line = (json.dumps([round(ts, 3), str(item_id), event_type, amount],
+                           ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        try:
+            with self._lock:
+                day = date.fromtimestamp(ts)
+                if self._file is None or day != self._day or self._size >= self._max_bytes:
+                    self._rotate(day)
+                self._file.write(line)
+                self._file.flush()
+                self._size += len(line)
+                self.appended += 1
+        except OSError as e:
+            # The log is for offline analysis; never fail the request over it
+            self.errors += 1
+            print(f"[EventLog] Append failed: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def metrics(self):
+        return {"appended": self.appended, "errors": self.errors, "segment_bytes": self._size}
+
+    def _rotate(self, day):
+        if self._file is not None:
+            self._file.close()
+        os.makedirs(self._log_dir, exist_ok=True)
+        name = f"events-{day.strftime('%Y%m%d')}-{os.getpid()}-{time.time_ns()}.jsonl"
+        self._file = open(os.path.join(self._log_dir, name), "ab")
+        self._day = day
+        self._size = 0
+        if self._retention_days > 0:
+            for path in list_segments(self._log_dir, until=day - timedelta(days=self._retention_days)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
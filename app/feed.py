@@ -0,0 +1,98 @@
+from itsdangerous import URLSafeSerializer, BadSignature
+
+from .catalog import get_catalog
+from .item_fields import normalize_styles
+from .search_index import get_search_index
+from .ranking import rank_key
+from .style_index import get_style_index
+
+FEED_PAGE_SIZE = 24
+FEED_MAX_PAGE_SIZE = 100
+
+
+class FeedCursorError(ValueError):
+    pass
+
+
+def style_label(item):
+    """Style badge text of an item card: its style_tags joined (the same for both home.html paths)."""
+    tags = item.get("style_tags")
+    if tags is None:
+        tags = normalize_styles(item.get("styles"))
+    return ",".join(str(t) for t in tags)
+
+
+def card(item):
+    """Only the fields an item card on home.html needs."""
+    return {
+        "id": item["id"],
+        "name": item.get("name"),
+        "price": item.get("price"),
+        "image_url": item.get("image_url"),
+        "styles": style_label(item),
+    }
+
+
+def _serializer(secret_key):
+    return URLSafeSerializer(secret_key, salt="home-feed-cursor")
+
+
+def encode_cursor(secret_key, mode, key):
+    return _serializer(secret_key).dumps([mode, list(key)])
+
+
+def decode_cursor(secret_key, token):
+    """-> (mode, rank key). Raises FeedCursorError for tampered or malformed cursors."""
+    try:
+        mode, key = _serializer(secret_key).loads(token)
+        return mode, tuple(key)
+    except (BadSignature, TypeError, ValueError) as e:
+        raise FeedCursorError(str(e))
+
+
+def _first_below(ranked, key):
+    """Index of the first entry ranked below key in a best-first [(key, item)] list."""
+    lo, hi = 0, len(ranked)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ranked[mid][0] < key:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+def feed_page(secret_key, styles=None, search_query=None, cursor=None, limit=FEED_PAGE_SIZE):
+    """
+    One page of the home feed -> (items, next_cursor or None).
+    Non-search feeds are keyset-paginated on rank_key (score, name, id);
+    search results on (match tier, score, name, id).
+    """
+    limit = max(1, min(int(limit or FEED_PAGE_SIZE), FEED_MAX_PAGE_SIZE))
+    mode = "search" if search_query else "styles"
+    after = None
+    if cursor:
+        cursor_mode, after = decode_cursor(secret_key, cursor)
+        if cursor_mode != mode:
+            raise FeedCursorError("cursor does not belong to this feed")
+
+    snapshot = get_catalog().snapshot()
+
+    if search_query:
+        ranked = get_search_index().ranked(search_query, snapshot)
+        start = _first_below(ranked, after) if after is not None else 0
+        page = ranked[start:start + limit + 1]
+        items = [item for _, item in page]
+        keys = [key for key, _ in page]
+    else:
+        ids = get_style_index().feed(styles, limit=limit + 1, after=after)
+        items = [snapshot.get(iid) for iid in ids]
+        items = [it for it in items if it is not None]
+        keys = [rank_key(it) for it in items]
+
+    # One extra row tells whether another page exists
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(secret_key, mode, keys[limit - 1])
+    return items, next_cursor
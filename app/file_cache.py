@@ -0,0 +1,103 @@
+import copy
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def atomic_write_json(path, payload):
+    """
+    Writes payload as JSON to a temp file in the same directory, fsyncs it and renames it
+    over path. Readers (in any process) see either the old file or the new one, never a torn one.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates 0600 files; keep the usual permissions of the cache files
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    try:
+        # Make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass   # not supported on every platform (e.g. Windows)
+
+
+class JsonFileCache:
+    """
+    A JSON file kept parsed in memory. load() costs one stat() per call and re-reads the
+    file only when its (mtime, inode, size) changed, so a file rewritten by another worker
+    process (atomic rename -> new inode) is picked up on that worker's next read.
+
+    The returned payload is shared by every caller: treat it as read-only, or ask for
+    load(copy=True) before modifying it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._key = None
+        self._payload = None
+
+        self.loads = 0
+        self.hits = 0
+
+    def load(self, copy=False):
+        """Parsed payload, or None if the file is missing or unreadable."""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        key = (st.st_mtime_ns, st.st_ino, st.st_size)
+        with self._lock:
+            if key == self._key:
+                self.hits += 1
+                payload = self._payload
+            else:
+                try:
+                    with open(self.path, "r", encoding="utf-8") as f:
+                        payload = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                self._key, self._payload = key, payload
+                self.loads += 1
+        return _copy(payload) if copy else payload
+
+    def save(self, payload):
+        atomic_write_json(self.path, payload)
+        st = os.stat(self.path)
+        with self._lock:
+            # Our own write: keep a private copy so later changes by the caller don't leak in
+            self._key = (st.st_mtime_ns, st.st_ino, st.st_size)
+            self._payload = _copy(payload)
+
+    def age(self):
+        """Seconds since the file was last written, or None if it does not exist."""
+        try:
+            return max(0.0, time.time() - os.stat(self.path).st_mtime)
+        except OSError:
+            return None
+
+    def metrics(self):
+        with self._lock:
+            return {"path": self.path, "loads": self.loads, "hits": self.hits}
+
+
+def _copy(payload):
+    return copy.deepcopy(payload)
@@ -0,0 +1,300 @@
+import base64
+import hashlib
+import hmac
+import json
+import re
+import threading
+from datetime import datetime
+
+from flask import current_app, g, request
+
+# Guest (not logged in) history and bookmarks live in cookies.
+#
+# Format v1: base64url( payload | HMAC-SHA256(payload)[:8] ), no padding.
+#   payload = version (1 byte) | kind (b"h" / b"b") | varint count | entries
+#   item id = one tag/length byte, then
+#               0x00-0x7f  that many UTF-8 bytes (any id)
+#               0x80       15 bytes: a 20-character Firestore auto id packed as a base62 number
+#               0x81       varint: a decimal id without leading zeros
+#               0x82       varint length, then that many UTF-8 bytes (ids longer than 127 bytes)
+#   history entry  = item id | varint seconds (first: epoch seconds of the newest view,
+#                    then zigzag deltas to the previous entry, newest first)
+#   bookmark entry = item id (oldest first, as appended)
+# A 20-entry history of auto ids is ~500 bytes instead of ~1.5 KB of JSON. Cookies that fail the
+# signature are ignored; JSON cookies from before v1 are still read (and rewritten on the next update).
+# Entries that do not fit in GUEST_COOKIE_MAX_BYTES are dropped oldest first; the encoders return
+# how many were kept, and set_guest_history / set_guest_bookmarks log and count the drops.
+
+HISTORY_COOKIE = "anon_history"
+BOOKMARKS_COOKIE = "bookmarks"
+GUEST_HISTORY_MAX = 20
+GUEST_BOOKMARKS_MAX = 100
+# Encoded value limit (browsers allow ~4096 bytes per cookie including name and attributes)
+GUEST_COOKIE_MAX_BYTES = 3000
+COOKIE_MAX_AGE = 30 * 24 * 3600
+
+VERSION = 1
+MAC_BYTES = 8
+_AUTO_ID = re.compile(r"[0-9A-Za-z]{20}")
+_BASE62 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+_BASE62_INDEX = {c: i for i, c in enumerate(_BASE62)}
+
+# Entries dropped because a cookie would not fit GUEST_COOKIE_MAX_BYTES (see cookie_metrics)
+_metrics_lock = threading.Lock()
+_metrics = {
+    "history_truncated": 0,
+    "bookmarks_truncated": 0,
+    "entries_dropped": 0,
+}
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        b = self.data[self.pos]
+        self.pos += 1
+        return b
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise ValueError("truncated")
+        out = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return out
+
+    def varint(self):
+        shift = result = 0
+        while True:
+            b = self.byte()
+            result |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return result
+            shift += 7
+            if shift > 63:
+                raise ValueError("varint too long")
+
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def _unzigzag(n):
+    return n // 2 if not n & 1 else -(n + 1) // 2
+
+
+def _pack_id(item_id):
+    if _AUTO_ID.fullmatch(item_id):
+        n = 0
+        for c in item_id:
+            n = n * 62 + _BASE62_INDEX[c]
+        return b"\x80" + n.to_bytes(15, "big")
+    if item_id.isdigit() and item_id.isascii() and (item_id == "0" or item_id[0] != "0"):
+        return b"\x81" + _varint(int(item_id))
+    raw = item_id.encode("utf-8")
+    if len(raw) > 0x7F:
+        return b"\x82" + _varint(len(raw)) + raw
+    return bytes([len(raw)]) + raw
+
+
+def _unpack_id(r):
+    tag = r.byte()
+    if tag == 0x80:
+        n = int.from_bytes(r.take(15), "big")
+        chars = []
+        for _ in range(20):
+            n, d = divmod(n, 62)
+            chars.append(_BASE62[d])
+        return "".join(reversed(chars))
+    if tag == 0x81:
+        return str(r.varint())
+    if tag == 0x82:
+        return r.take(r.varint()).decode("utf-8")
+    if tag > 0x7F:
+        raise ValueError("bad id tag")
+    return r.take(tag).decode("utf-8")
+
+
+def _mac(secret, payload):
+    key = hashlib.sha256(f"guest-cookie:{secret}".encode("utf-8")).digest()
+    return hmac.new(key, payload, hashlib.sha256).digest()[:MAC_BYTES]
+
+
+def _seal(secret, kind, body):
+    payload = bytes([VERSION]) + kind + body
+    return base64.urlsafe_b64encode(payload + _mac(secret, payload)).rstrip(b"=").decode("ascii")
+
+
+def _open(secret, kind, token):
+    """-> _Reader positioned after the header, or None if the token is not a valid v1 cookie of this kind."""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        return None
+    payload, mac = raw[:-MAC_BYTES], raw[-MAC_BYTES:]
+    if len(payload) < 2 or not hmac.compare_digest(mac, _mac(secret, payload)):
+        return None
+    if payload[0] != VERSION or payload[1:2] != kind:
+        return None
+    r = _Reader(payload)
+    r.pos = 2
+    return r
+
+
+def encode_history(secret, entries):
+    """
+    entries: [(item_id, epoch seconds)] newest first -> (cookie value, number of entries kept).
+    At most GUEST_HISTORY_MAX entries; the oldest are dropped until the value fits GUEST_COOKIE_MAX_BYTES.
+    """
+    entries = list(entries)[:GUEST_HISTORY_MAX]
+    while True:
+        body = bytearray(_varint(len(entries)))
+        prev = None
+        for item_id, ts in entries:
+            ts = int(ts)
+            body += _pack_id(item_id)
+            body += _varint(ts) if prev is None else _varint(_zigzag(prev - ts))
+            prev = ts
+        token = _seal(secret, b"h", bytes(body))
+        if len(token) <= GUEST_COOKIE_MAX_BYTES or not entries:
+            return token, len(entries)
+        entries = entries[:-1]
+
+
+def decode_history(secret, token):
+    r = _open(secret, b"h", token)
+    if r is None:
+        return []
+    try:
+        out = []
+        prev = None
+        for _ in range(min(r.varint(), GUEST_HISTORY_MAX)):
+            item_id = _unpack_id(r)
+            ts = r.varint() if prev is None else prev - _unzigzag(r.varint())
+            out.append((item_id, ts))
+            prev = ts
+        return out
+    except (IndexError, ValueError, UnicodeDecodeError):
+        return []
+
+
+def encode_bookmarks(secret, item_ids):
+    """
+    item_ids oldest first -> (cookie value, number of ids kept). The newest GUEST_BOOKMARKS_MAX are
+    kept, fewer (oldest dropped first) if the value would not fit GUEST_COOKIE_MAX_BYTES.
+    """
+    item_ids = list(item_ids)[-GUEST_BOOKMARKS_MAX:]
+    while True:
+        body = bytearray(_varint(len(item_ids)))
+        for item_id in item_ids:
+            body += _pack_id(item_id)
+        token = _seal(secret, b"b", bytes(body))
+        if len(token) <= GUEST_COOKIE_MAX_BYTES or not item_ids:
+            return token, len(item_ids)
+        item_ids = item_ids[1:]
+
+
+def decode_bookmarks(secret, token):
+    r = _open(secret, b"b", token)
+    if r is None:
+        return []
+    try:
+        return [_unpack_id(r) for _ in range(min(r.varint(), GUEST_BOOKMARKS_MAX))]
+    except (IndexError, ValueError, UnicodeDecodeError):
+        return []
+
+
+def _legacy_history(value):
+    """Pre-v1 JSON: [{"item_id", "viewed_at" (ISO)}]"""
+    out = []
+    for e in json.loads(value):
+        item_id = str(e.get("item_id") or "").strip()
+        if not item_id:
+            continue
+        try:
+            ts = datetime.fromisoformat(e.get("viewed_at")).timestamp()
+        except (TypeError, ValueError):
+            ts = datetime.now().timestamp()
+        out.append((item_id, int(ts)))
+    return out[:GUEST_HISTORY_MAX]
+
+
+def _legacy_bookmarks(value):
+    """Pre-v1 JSON: ["item_id", ...]"""
+    return [str(i) for i in json.loads(value) if i][-GUEST_BOOKMARKS_MAX:]
+
+
+# --- per-request access (decoded once, cached on g) ---
+
+def _cached(name, decode, legacy):
+    cache = g.setdefault("guest_cookies", {})
+    if name not in cache:
+        value = request.cookies.get(name)
+        entries = []
+        if value:
+            try:
+                entries = legacy(value) if value.startswith("[") else decode(current_app.secret_key, value)
+            except (ValueError, TypeError, AttributeError):
+                entries = []
+        cache[name] = entries
+    return cache[name]
+
+
+def guest_history():
+    """[(item_id, epoch seconds)] newest first, from the guest history cookie."""
+    return list(_cached(HISTORY_COOKIE, decode_history, _legacy_history))
+
+
+def guest_bookmarks():
+    """[item_id] oldest first, from the guest bookmarks cookie."""
+    return list(_cached(BOOKMARKS_COOKIE, decode_bookmarks, _legacy_bookmarks))
+
+
+def _note_truncated(kind, wanted, kept):
+    with _metrics_lock:
+        _metrics[f"{kind}_truncated"] += 1
+        _metrics["entries_dropped"] += wanted - kept
+    print(f"[GuestCookies] {kind} cookie over {GUEST_COOKIE_MAX_BYTES} bytes: kept {kept} of {wanted} entries")
+
+
+def cookie_metrics():
+    with _metrics_lock:
+        return dict(_metrics)
+
+
+def set_guest_history(response, entries):
+    """Writes the guest history cookie. -> number of entries kept (newest first)."""
+    entries = list(entries)[:GUEST_HISTORY_MAX]
+    token, kept = encode_history(current_app.secret_key, entries)
+    if kept < len(entries):
+        _note_truncated("history", len(entries), kept)
+        entries = entries[:kept]
+    g.setdefault("guest_cookies", {})[HISTORY_COOKIE] = entries
+    response.set_cookie(HISTORY_COOKIE, token, max_age=COOKIE_MAX_AGE, httponly=True, samesite="Lax")
+    return kept
+
+
+def set_guest_bookmarks(response, item_ids):
+    """Writes the guest bookmarks cookie. -> number of ids kept (the newest)."""
+    item_ids = list(item_ids)[-GUEST_BOOKMARKS_MAX:]
+    token, kept = encode_bookmarks(current_app.secret_key, item_ids)
+    if kept < len(item_ids):
+        _note_truncated("bookmarks", len(item_ids), kept)
+        item_ids = item_ids[len(item_ids) - kept:]
+    g.setdefault("guest_cookies", {})[BOOKMARKS_COOKIE] = item_ids
+    response.set_cookie(BOOKMARKS_COOKIE, token, max_age=COOKIE_MAX_AGE, httponly=True, samesite="Lax")
+    return kept
@@ -0,0 +1,260 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+
+from .db import get_client
+from .catalog import get_catalog
+from .user_cache import get_user_cache
+from .stats import BatchWriter, MAX_BATCH_WRITES, JOB_LEASE_SEC, _lease_owner, _take_lease, _release_lease
+
+# users/<id>/history keeps at most this many entries (compact_history trims the oldest)
+HISTORY_MAX_ENTRIES = int(os.environ.get("HISTORY_MAX_ENTRIES", 50))
+
+# Deleted items waiting for their history entries to be swept (see sweep_history_tombstones)
+TOMBSTONE_COLLECTION = "item_tombstones"
+
+# Item fields copied into each history entry, so /history needs no item reads
+SNAPSHOT_FIELDS = ("name", "price", "image_url")
+
+# Sorts after every real view
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_timestamp(val):
+    """
+    viewed_at as an aware datetime. Older entries hold ISO strings (from the anonymous
+    history cookie) or Firestore Timestamps; returns None if it cannot be read.
+    viewed_at is always written in UTC; legacy server-local strings are converted by
+    scripts/migrate_history_timestamps.py.
+    """
+    if not val:
+        return None
+    if hasattr(val, 'to_datetime'):
+        val = val.to_datetime()
+    elif not isinstance(val, datetime):
+        try:
+            val = datetime.fromisoformat(str(val))
+        except ValueError:
+            return None
+    if val.tzinfo is None:
+        val = val.replace(tzinfo=timezone.utc)
+    return val
+
+
+def item_snapshot(item):
+    """The part of an item a history row shows."""
+    return {k: item.get(k) for k in SNAPSHOT_FIELDS}
+
+
+def save_history(user_id, item_id, viewed_at, item):
+    """Upserts the user's history entry for item_id with an item snapshot (background worker: no g / request)."""
+    try:
+        # Use item_id as document ID to prevent duplicates
+        h_ref = get_client().collection('users').document(user_id).collection('history').document(item_id)
+        h_ref.set({
+            "item_id": item_id,
+            "viewed_at": viewed_at,
+            "item": item_snapshot(item)
+        }, merge=True)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        print(f"Error saving history: {e}")
+
+
+# Guest history copied into user accounts at login (see migrate_guest_history)
+_migration_lock = threading.Lock()
+_migration_metrics = {
+    "jobs": 0,
+    "entries": 0,
+    "written": 0,
+    "kept_newer": 0,
+    "failures": 0,
+    "last_error": None,
+}
+
+
+def migrate_guest_history(user_id, entries):
+    """
+    Background job run after login: merges the guest history cookie entries
+    [(item_id, epoch seconds)] into users/<id>/history.
+    Duplicates collapse to their latest view; an existing entry is only overwritten
+    if the guest view is newer. Reads and writes go in chunks of MAX_BATCH_WRITES.
+    """
+    latest = {}
+    for item_id, ts in entries:
+        if item_id and ts > latest.get(item_id, float("-inf")):
+            latest[item_id] = ts
+
+    db = get_client()
+    history_ref = db.collection('users').document(user_id).collection('history')
+    snapshot = get_catalog().snapshot()
+    writer = BatchWriter(db)
+    kept = 0
+    try:
+        item_ids = list(latest)
+        for i in range(0, len(item_ids), MAX_BATCH_WRITES):
+            chunk = item_ids[i:i + MAX_BATCH_WRITES]
+            existing = {d.id: (d.to_dict() or {}).get('viewed_at')
+                        for d in db.get_all([history_ref.document(iid) for iid in chunk], field_paths=['viewed_at'])
+                        if d.exists}
+            for item_id in chunk:
+                viewed_at = datetime.fromtimestamp(latest[item_id], timezone.utc)
+                current = to_timestamp(existing.get(item_id))
+                if current is not None and current >= viewed_at:
+                    kept += 1
+                    continue
+                entry = {"item_id": item_id, "viewed_at": viewed_at}
+                item = snapshot.get(item_id)
+                if item is not None:
+                    entry["item"] = item_snapshot(item)
+                writer.set(history_ref.document(item_id), entry)
+        writer.commit()
+        if writer.written:
+            get_user_cache().invalidate(user_id, "history")
+    except Exception as e:
+        with _migration_lock:
+            _migration_metrics["failures"] += 1
+            _migration_metrics["last_error"] = str(e)
+        raise
+    finally:
+        with _migration_lock:
+            _migration_metrics["jobs"] += 1
+            _migration_metrics["entries"] += len(entries)
+            _migration_metrics["written"] += writer.written
+            _migration_metrics["kept_newer"] += kept
+
+
+def migration_metrics():
+    with _migration_lock:
+        return dict(_migration_metrics)
+
+
+def _entries_for_item(db, item_id):
+    # Needs the single-field index on history.item_id enabled for collection-group queries
+    return db.collection_group('history').where('item_id', '==', str(item_id)).select([]).stream()
+
+
+def refresh_history_snapshots(item_id, item, db=None):
+    """After an admin edit: rewrites the item snapshot in every history entry of item_id."""
+    db = db or get_client()
+    snapshot = item_snapshot(item)
+    writer = BatchWriter(db)
+    for h in _entries_for_item(db, item_id):
+        writer.update(h.reference, {"item": snapshot})
+    writer.commit()
+    if writer.written:
+        print(f"History snapshots refreshed for {item_id}: {writer.written}")
+
+
+def add_tombstone(db, item_id):
+    """Marks a deleted item so sweep_history_tombstones() removes its history entries."""
+    db.collection(TOMBSTONE_COLLECTION).document(str(item_id)).set({
+        "deleted_at": firestore.SERVER_TIMESTAMP
+    })
+
+
+def sweep_history_tombstones(db=None):
+    """
+    Periodic job: deletes the history entries of every tombstoned (deleted) item, then the tombstone.
+    A tombstone stays until its sweep finished, so an interrupted sweep is simply redone.
+    Runs under the job_leases/sweep_history_tombstones lease, renewed after every tombstone.
+    """
+    db = db or get_client()
+    owner = _lease_owner()
+    if _take_lease(db, "sweep_history_tombstones", owner, JOB_LEASE_SEC) is None:
+        return  # another process is sweeping
+    swept = 0
+    try:
+        for tomb in db.collection(TOMBSTONE_COLLECTION).stream():
+            writer = BatchWriter(db)
+            try:
+                for h in _entries_for_item(db, tomb.id):
+                    writer.delete(h.reference)
+                writer.commit()
+                tomb.reference.delete()
+            except Exception as e:
+                print(f"Error sweeping history of {tomb.id}: {e}")
+            swept += writer.written
+            if _take_lease(db, "sweep_history_tombstones", owner, JOB_LEASE_SEC) is None:
+                print(f"History tombstone sweep lease lost after {tomb.id}, stopping")
+                break
+    finally:
+        _release_lease(db, "sweep_history_tombstones", owner)
+    if swept:
+        print(f"History tombstone sweep: deleted {swept} entries")
+
+
+def recent_history(db, user_id, limit):
+    """The user's latest history entries (dicts with item_id / viewed_at), newest first."""
+    h_ref = db.collection('users').document(user_id).collection('history')
+    query = h_ref.order_by('viewed_at', direction=firestore.Query.DESCENDING).limit(limit)
+    return [h.to_dict() for h in query.stream()]
+
+
+def _trim(db, h_ref, keep):
+    """Deletes the oldest entries beyond `keep`. -> number deleted"""
+    # Count and delete over the same ordered query: entries without viewed_at are left out of
+    # both (scripts/migrate_history_timestamps.py gives them one), so nothing newer is over-deleted
+    by_age = h_ref.order_by('viewed_at')
+    excess = by_age.count().get()[0][0].value - keep
+    writer = BatchWriter(db)
+    while excess > 0:
+        docs = list(by_age.limit(min(excess, MAX_BATCH_WRITES)).select([]).stream())
+        if not docs:
+            break
+        for d in docs:
+            writer.delete(d.reference)
+        # Commit before the next page: it is read with the same query
+        writer.commit()
+        excess -= len(docs)
+    return writer.written
+
+
+def compact_history(db=None, keep=None):
+    """
+    Periodic job: trims every users/<id>/history that grew beyond HISTORY_MAX_ENTRIES,
+    oldest views first. After the first run only users with new views are looked at.
+    Runs under the job_leases/compact_history lease (renewed after every user), which also
+    keeps the watermark (compacted_until) of the last finished run.
+    """
+    db = db or get_client()
+    keep = keep or HISTORY_MAX_ENTRIES
+    owner = _lease_owner()
+    lease = _take_lease(db, "compact_history", owner, JOB_LEASE_SEC)
+    if lease is None:
+        print("History compaction is running elsewhere, skipped")
+        return
+    state = None
+    try:
+        state = _compact_history(db, keep, owner, lease.get("compacted_until"))
+    finally:
+        _release_lease(db, "compact_history", owner, state)
+
+
+def _compact_history(db, keep, owner, compacted_until):
+    """-> the lease state to keep, or None if the run did not finish"""
+    started = datetime.now(timezone.utc) - timedelta(seconds=5)
+
+    if compacted_until is None:
+        user_ids = [u.id for u in db.collection('users').select([]).stream()]
+    else:
+        recent = db.collection_group('history').where('viewed_at', '>', compacted_until)
+        user_ids = {h.reference.parent.parent.id for h in recent.select([]).stream()}
+
+    deleted = 0
+    for user_id in user_ids:
+        try:
+            deleted += _trim(db, db.collection('users').document(user_id).collection('history'), keep)
+        except Exception as e:
+            print(f"Error compacting history for {user_id}: {e}")
+        if _take_lease(db, "compact_history", owner, JOB_LEASE_SEC) is None:
+            # Another process took over; it starts again from the old watermark
+            print(f"History compaction lease lost after {user_id}, stopping")
+            return None
+
+    if deleted:
+        print(f"History compaction: deleted {deleted} entries")
+    return {"compacted_until": started}
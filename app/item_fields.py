@@ -0,0 +1,48 @@
+# Derived item fields written at create/edit time (and by scripts/backfill_item_fields.py).
+#   style_tags:  canonical style list (the raw `styles` field is a CSV string or a list)
+#   search_text: lowercased "name category tags..." used for keyword matching
+#   weather_mask / weather_tags: weather tags matched in search_text (see app/weather_tags.py)
+
+from .weather_tags import weather_mask, tags_from_mask
+
+
+def normalize_styles(value):
+    """CSV string ("A, B、C") or list -> ordered list of unique, stripped tags."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        parts = value.replace("、", ",").split(",")
+    elif isinstance(value, (list, tuple)):
+        parts = value
+    else:
+        return []
+
+    tags = []
+    for p in parts:
+        tag = str(p).strip()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def build_search_text(item, style_tags):
+    parts = [str(item.get("name") or ""), str(item.get("category") or "")]
+    parts.extend(style_tags)
+    return " ".join(p for p in parts if p).lower()
+
+
+def derived_fields(item):
+    """Fields to store alongside name/category/styles."""
+    style_tags = normalize_styles(item.get("styles"))
+    search_text = build_search_text(item, style_tags)
+    mask = weather_mask(search_text)
+    return {
+        "style_tags": style_tags,
+        "search_text": search_text,
+        "weather_mask": mask,
+        "weather_tags": tags_from_mask(mask),
+    }
+
+
+def has_derived_fields(item):
+    return "style_tags" in item and "search_text" in item and "weather_mask" in item
@@ -1,39 +1,95 @@
-
+import json
+import os
 import requests
 from datetime import datetime, timezone
 
+# Forecast endpoint (overridable, e.g. a local stub server in development)
+OPEN_METEO_URL = os.environ.get("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+
 NAGOYA_LAT = 35.183334
 NAGOYA_LON = 136.899994
 
-def fetch_nagoya_weather():
-    """
-    Open-Meteo Forecast API から名古屋の天気を取得し、
-    UI/推薦に必要な最小要素をまとめて返す。
-    """
-    url = "https://api.open-meteo.com/v1/forecast"
-    params = {
-        "latitude": NAGOYA_LAT,
-        "longitude": NAGOYA_LON,
-        "timezone": "Asia/Tokyo",
-        "current": "temperature_2m",
-        "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,windspeed_10m_max",
-        "forecast_days": 1,
-    }
+# 天気を取得する地点。WEATHER_LOCATIONS に JSON で上書きできる:
+#   [{"key": "sendai", "name": "Sendai", "lat": 38.268, "lon": 140.870}, ...]
+DEFAULT_LOCATIONS = [
+    {"key": "sapporo", "name": "Sapporo", "lat": 43.064, "lon": 141.347},
+    {"key": "sendai", "name": "Sendai", "lat": 38.268, "lon": 140.870},
+    {"key": "tokyo", "name": "Tokyo", "lat": 35.690, "lon": 139.692},
+    {"key": "nagoya", "name": "Nagoya", "lat": NAGOYA_LAT, "lon": NAGOYA_LON},
+    {"key": "osaka", "name": "Osaka", "lat": 34.694, "lon": 135.502},
+    {"key": "hiroshima", "name": "Hiroshima", "lat": 34.385, "lon": 132.455},
+    {"key": "fukuoka", "name": "Fukuoka", "lat": 33.590, "lon": 130.402},
+    {"key": "naha", "name": "Naha", "lat": 26.212, "lon": 127.681},
+]
+LOCATIONS = {loc["key"]: loc for loc in json.loads(os.environ.get("WEATHER_LOCATIONS") or "null") or DEFAULT_LOCATIONS}
+# Location used for guests and users without a preference
+DEFAULT_LOCATION = os.environ.get("WEATHER_DEFAULT_LOCATION", "nagoya")
+if DEFAULT_LOCATION not in LOCATIONS:
+    DEFAULT_LOCATION = next(iter(LOCATIONS))
+
+# Coordinates per request (Open-Meteo takes comma-separated lists; keeps the URL short)
+MAX_LOCATIONS_PER_REQUEST = 50
+
+
+class WeatherFetchError(Exception):
+    """Some requests failed. results holds the locations that were fetched anyway."""
 
-    r = requests.get(url, params=params, timeout=8)
-    r.raise_for_status()
-    data = r.json()
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
 
+
+def _summary(loc, data):
     # daily は当日 index=0
     d0 = (data.get("daily") or {})
-    out = {
+    return {
         "source": "Open-Meteo",
         "updated_at": datetime.now(timezone.utc).isoformat(),
-        "location": {"name": "Nagoya", "lat": NAGOYA_LAT, "lon": NAGOYA_LON},
+        "location": {"key": loc["key"], "name": loc["name"], "lat": loc["lat"], "lon": loc["lon"]},
         "current_temp": (data.get("current") or {}).get("temperature_2m"),
         "today_max": (d0.get("temperature_2m_max") or [None])[0],
         "today_min": (d0.get("temperature_2m_min") or [None])[0],
         "precip_prob_max": (d0.get("precipitation_probability_max") or [None])[0],
         "wind_max": (d0.get("windspeed_10m_max") or [None])[0],
     }
+
+
+def fetch_weather(locations):
+    """
+    Open-Meteo Forecast API から複数地点の天気をまとめて取得し (地点ごとに 1 リクエストではなく
+    MAX_LOCATIONS_PER_REQUEST 地点ずつ 1 リクエスト)、UI/推薦に必要な最小要素を返す。
+    locations: [{"key", "name", "lat", "lon"}] -> {key: summary}
+    一部のリクエストが失敗した場合は、取得できた分を results に持つ WeatherFetchError を送出する。
+    """
+    out = {}
+    failed = []
+    for i in range(0, len(locations), MAX_LOCATIONS_PER_REQUEST):
+        chunk = locations[i:i + MAX_LOCATIONS_PER_REQUEST]
+        params = {
+            "latitude": ",".join(str(loc["lat"]) for loc in chunk),
+            "longitude": ",".join(str(loc["lon"]) for loc in chunk),
+            "timezone": "Asia/Tokyo",
+            "current": "temperature_2m",
+            "daily": "temperature_2m_max,temperature_2m_min,precipitation_probability_max,windspeed_10m_max",
+            "forecast_days": 1,
+        }
+
+        try:
+            r = requests.get(OPEN_METEO_URL, params=params, timeout=8)
+            r.raise_for_status()
+            data = r.json()
+            # One coordinate -> one object, several -> a list in request order
+            results = data if isinstance(data, list) else [data]
+            if len(results) != len(chunk):
+                raise ValueError(f"Open-Meteo returned {len(results)} results for {len(chunk)} locations")
+        except (requests.RequestException, ValueError) as e:
+            # Keep the other chunks: only these locations stay due
+            failed.append((chunk, e))
+            continue
+        for loc, d in zip(chunk, results):
+            out[loc["key"]] = _summary(loc, d)
+
+    if failed:
+        n = sum(len(chunk) for chunk, _ in failed)
+        raise WeatherFetchError(f"{n} of {len(locations)} locations failed: {failed[0][1]}", out)
     return out
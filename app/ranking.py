@@ -0,0 +1,98 @@
+import heapq
+import os
+from bisect import bisect_left, insort
+
+# Which score popularity ranking uses:
+#   "window": popularity_score, the weighted 7-day event totals (default)
+#   "decay":  the exponentially decayed score (decay_score, see app/stats.py)
+RANKING_MODE = os.environ.get("RANKING_MODE", "window")
+
+
+def rank_score(item):
+    """Popularity value items are ranked on under RANKING_MODE."""
+    if RANKING_MODE == "decay":
+        # Forward-decayed values share one time base, so they compare directly
+        return item.get("decay_score") or 0
+    return item.get("popularity_score") or 0
+
+
+def rank_key(item):
+    """
+    Ascending sort key for popularity ranking.
+    Iterated in reverse it gives score desc, then name desc (the original
+    `sort(key=(popularity_score, name), reverse=True)` order), with id as the final tie-break.
+    """
+    return (rank_score(item), item.get("name") or "", item["id"])
+
+
+class PopularityOrder:
+    """
+    Items kept in rank_key order, maintained incrementally (O(log N) search per change).
+    Reading the best K costs O(K) instead of sorting the whole list per request.
+    Not thread-safe on its own; owners guard it with their lock.
+    """
+
+    def __init__(self):
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        insort(self._keys, key)
+
+    def discard(self, key):
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def iter_desc(self, after=None):
+        """Keys best-first, starting just below `after` (a rank key) if given."""
+        keys = self._keys
+        start = bisect_left(keys, after) if after is not None else len(keys)
+        for i in range(start - 1, -1, -1):
+            yield keys[i]
+
+    def top(self, k, after=None):
+        out = []
+        for key in self.iter_desc(after):
+            if len(out) >= k:
+                break
+            out.append(key)
+        return out
+
+
+def merge_desc(orders, limit=None, after=None):
+    """
+    Union of several PopularityOrders, best-first and de-duplicated -> [rank key].
+    Stops after `limit` keys, so a page costs O(K log M) for M orders.
+    """
+    streams = [o.iter_desc(after) for o in orders]
+    if not streams:
+        return []
+    merged = streams[0] if len(streams) == 1 else heapq.merge(*streams, reverse=True)
+
+    out = []
+    last = None
+    for key in merged:
+        if key == last:
+            # same item present in several orders
+            continue
+        last = key
+        out.append(key)
+        if limit is not None and len(out) >= limit:
+            break
+    return out
+
+
+def top_k(items, score_fn, k, above=None):
+    """
+    Best k items for an ad-hoc scorer (no PopularityOrder to read from), best-first, ties broken
+    on name desc like rank_key. O(N log k) instead of sorting everything for a prefix.
+    above: if given, only items scoring strictly above it are kept.
+    """
+    scored = ((score_fn(it), it) for it in items)
+    if above is not None:
+        scored = (x for x in scored if x[0] > above)
+    best = heapq.nlargest(k, scored, key=lambda x: (x[0], x[1].get("name") or ""))
+    return [it for _, it in best]
@@ -0,0 +1,194 @@
+import math
+import os
+import threading
+
+import numpy as np
+
+from .catalog import get_catalog
+from .ranking import rank_score
+from .weather_tags import score_table
+
+# Composite ranking weights (see RankingEngine.top)
+#   style match: added once if the item has any of the user's preferred styles
+#   popularity:  log-scaled rank_score, normalized to 0..1 over the catalog, times this weight
+STYLE_MATCH_WEIGHT = float(os.environ.get("STYLE_MATCH_WEIGHT", 1.0))
+POPULARITY_WEIGHT = float(os.environ.get("POPULARITY_WEIGHT", 1.0))
+
+
+class _Columns:
+    """Column arrays of one catalog snapshot (row i = ids[i]). Never modified once published."""
+
+    __slots__ = ("ids", "items", "rows", "weather_mask", "popularity", "price",
+                 "styles", "style_matrix", "name_rank")
+
+    @classmethod
+    def build(cls, snapshot):
+        cols = cls()
+        items = sorted(snapshot, key=lambda it: (it.get("name") or "", it["id"]))
+        n = len(items)
+        cols.items = items
+        cols.ids = [it["id"] for it in items]
+        cols.rows = {item_id: i for i, item_id in enumerate(cols.ids)}
+        # Rows are in (name, id) order, so the row number is the name tie-break
+        cols.name_rank = np.arange(n, dtype=np.int64)
+        cols.weather_mask = np.fromiter((it.get("weather_mask") or 0 for it in items), dtype=np.int64, count=n)
+        cols.popularity = np.fromiter((rank_score(it) for it in items), dtype=np.float64, count=n)
+        cols.price = np.fromiter((_price(it) for it in items), dtype=np.float64, count=n)
+
+        styles = sorted({t for it in items for t in it.get("style_tags", ())})
+        cols.styles = {s: j for j, s in enumerate(styles)}
+        cols.style_matrix = np.zeros((n, len(styles)), dtype=bool)
+        r = [i for i, it in enumerate(items) for _ in it.get("style_tags", ())]
+        c = [cols.styles[t] for it in items for t in it.get("style_tags", ())]
+        cols.style_matrix[r, c] = True
+        return cols
+
+    def patched(self, snapshot, changed_ids):
+        """
+        Copy with the changed rows rewritten, or None if a full build is needed
+        (new items, renamed items or unseen styles change the row order / style columns).
+        """
+        updates = []
+        for item_id in changed_ids:
+            row = self.rows.get(item_id)
+            item = snapshot.get(item_id)
+            if row is None or item is None or (item.get("name") or "") != (self.items[row].get("name") or ""):
+                return None
+            if any(t not in self.styles for t in item.get("style_tags", ())):
+                return None
+            updates.append((row, item))
+
+        cols = _Columns()
+        cols.ids, cols.rows, cols.styles, cols.name_rank = self.ids, self.rows, self.styles, self.name_rank
+        cols.items = list(self.items)
+        cols.weather_mask = self.weather_mask.copy()
+        cols.popularity = self.popularity.copy()
+        cols.price = self.price.copy()
+        cols.style_matrix = self.style_matrix.copy()
+        for row, item in updates:
+            cols.items[row] = item
+            cols.weather_mask[row] = item.get("weather_mask") or 0
+            cols.popularity[row] = rank_score(item)
+            cols.price[row] = _price(item)
+            cols.style_matrix[row] = False
+            for t in item.get("style_tags", ()):
+                cols.style_matrix[row, self.styles[t]] = True
+        return cols
+
+
+def _price(item):
+    price = item.get("price")
+    return float(price) if isinstance(price, (int, float)) else math.nan
+
+
+class RankingEngine:
+    """
+    The catalog as NumPy columns (weather tag bitmask, popularity, price, style membership),
+    kept in step with the catalog listener. A request's composite score is one vectorized
+    expression over every item and the best K come from argpartition, so per-request cost is
+    a few array passes instead of a Python loop over item dicts.
+    Score changes patch a copy of the arrays; added / removed / renamed items rebuild them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cols = _Columns.build([])
+        self.builds = 0
+        self.patches = 0
+
+    def on_catalog_change(self, snapshot, changed_ids, removed_ids):
+        with self._lock:
+            cols = None
+            if not removed_ids:
+                cols = self._cols.patched(snapshot, changed_ids)
+            if cols is None:
+                cols = _Columns.build(snapshot)
+                self.builds += 1
+            else:
+                self.patches += 1
+            self._cols = cols
+
+    def scores(self, weather_weights=None, styles=None, popularity_weight=None, style_weight=None):
+        """Composite score per row (weather rules + preferred styles + popularity) -> (columns, scores)."""
+        cols = self._cols
+        popularity_weight = POPULARITY_WEIGHT if popularity_weight is None else popularity_weight
+        style_weight = STYLE_MATCH_WEIGHT if style_weight is None else style_weight
+
+        score = np.zeros(len(cols.ids), dtype=np.float64)
+        if weather_weights:
+            score += np.asarray(score_table(weather_weights), dtype=np.float64)[cols.weather_mask]
+        if styles and style_weight:
+            score += style_weight * self._style_match(cols, styles)
+        if popularity_weight and len(score):
+            pop = np.log1p(np.maximum(cols.popularity, 0))
+            top = pop.max()
+            if top > 0:
+                score += popularity_weight * (pop / top)
+        return cols, score
+
+    def top(self, k, weather_weights=None, styles=None, require_weather=False, require_styles=None,
+            popularity_weight=None, style_weight=None):
+        """
+        Best k items by composite score, ties broken on name desc (like ranking.rank_key).
+        require_weather: only items matching at least one active weather rule
+        require_styles:  only items tagged with one of these styles
+        """
+        cols, score = self.scores(weather_weights, styles, popularity_weight, style_weight)
+        keep = np.ones(len(score), dtype=bool)
+        if require_weather:
+            keep &= np.asarray(score_table(weather_weights or {}))[cols.weather_mask] > 0
+        if require_styles is not None:
+            keep &= self._style_match(cols, require_styles)
+        return [cols.items[i] for i in _top_rows(score, cols.name_rank, keep, k)]
+
+    def style_top(self, style, k):
+        """Most popular k items tagged with style."""
+        return self.top(k, require_styles=[style], popularity_weight=1.0, style_weight=0)
+
+    def metrics(self):
+        cols = self._cols
+        return {
+            "items": len(cols.ids),
+            "styles": len(cols.styles),
+            "bytes": cols.weather_mask.nbytes + cols.popularity.nbytes + cols.price.nbytes + cols.style_matrix.nbytes,
+            "builds": self.builds,
+            "patches": self.patches,
+        }
+
+    @staticmethod
+    def _style_match(cols, styles):
+        idx = [cols.styles[s] for s in set(styles) if s in cols.styles]
+        if not idx:
+            return np.zeros(len(cols.ids), dtype=bool)
+        return cols.style_matrix[:, idx].any(axis=1)
+
+
+def _top_rows(score, name_rank, keep, k):
+    rows = np.flatnonzero(keep)
+    if k <= 0 or not len(rows):
+        return []
+    if len(rows) > k:
+        # O(N) selection of the k best, then only those k are sorted
+        part = np.argpartition(-score[rows], k - 1)[:k]
+        # Items tied with the k-th score may sit outside the partition: take all of them
+        # so the name tie-break picks the same ones a full sort would
+        kth = score[rows[part]].min()
+        rows = np.concatenate([rows[score[rows] > kth], rows[score[rows] == kth]])
+    order = np.lexsort((-name_rank[rows], -score[rows]))[:k]
+    return rows[order].tolist()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_ranking_engine():
+    """Process-wide RankingEngine attached to the item catalog."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = RankingEngine()
+                get_catalog().add_listener(engine.on_catalog_change)
+                _engine = engine
+    return _engine
@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+
+# Refresh of externally fetched caches (weather, wiki trends).
+#
+#   fresh:     is_fresh() says the cached data is within its TTL -> nothing to do
+#   stale:     readers keep being served the cached data while one refresh runs
+#              (revalidate() starts it in the background and returns at once)
+#   in flight: concurrent refresh() calls (scheduler, startup, scripts, requests) join the
+#              running fetch instead of starting their own
+#   failing:   each refresh retries with jittered exponential backoff; after
+#              breaker_threshold failed refreshes the breaker opens and refreshes are skipped
+#              (stale data served, no upstream calls) for breaker_cooldown seconds, then one
+#              trial refresh decides whether it closes again
+#
+# The failure state lives here (error()), not in the stored data: a failed refresh must leave
+# the cache untouched, so is_fresh() keeps reporting it stale and the retries / breaker apply.
+
+
+class _Flight:
+    """One running refresh: followers wait on done, then read ok."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.ok = False
+
+
+class Refresher:
+    """
+    Single-flight, retried, circuit-broken runner for one cache's refresh function.
+
+    fetch_fn()        fetches and stores new data; raises on failure
+    is_fresh()        True while the stored data needs no refresh
+    on_failure(exc)   called once a refresh gave up (must not make the stored data look fresh)
+    """
+
+    def __init__(self, name, fetch_fn, is_fresh, on_failure=None, retries=2, backoff_sec=1.0,
+                 max_backoff_sec=30.0, breaker_threshold=3, breaker_cooldown_sec=300.0):
+        self.name = name
+        self._fetch_fn = fetch_fn
+        self._is_fresh = is_fresh
+        self._on_failure = on_failure
+        self._retries = retries
+        self._backoff_sec = backoff_sec
+        self._max_backoff_sec = max_backoff_sec
+        self._breaker_threshold = breaker_threshold
+        self._breaker_cooldown_sec = breaker_cooldown_sec
+
+        self._lock = threading.Lock()
+        self._inflight = None          # _Flight of the running refresh
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+        self.refreshes = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.skipped_open = 0
+        self.join_timeouts = 0
+        self.last_success_at = None
+        self.last_error = None
+
+    def refresh(self, force=False, timeout=None):
+        """
+        Refreshes unless the data is fresh (or force). If a refresh is already running,
+        waits for it (up to timeout seconds) instead of fetching again.
+        Returns True if fresh data was fetched by this call or the one it joined
+        (False if that refresh failed or was still running after timeout).
+        """
+        with self._lock:
+            inflight = self._inflight
+            if inflight is None:
+                if not force and self._safe_is_fresh():
+                    return False
+                if time.monotonic() < self._open_until:
+                    self.skipped_open += 1
+                    return False
+                inflight = self._inflight = _Flight()
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            if not inflight.done.wait(timeout):
+                with self._lock:
+                    self.join_timeouts += 1
+                return False
+            return inflight.ok
+
+        try:
+            inflight.ok = self._run()
+            return inflight.ok
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight.done.set()
+
+    def revalidate(self):
+        """Stale-while-revalidate: starts a background refresh if one is due, never blocks."""
+        with self._lock:
+            if self._inflight is not None or time.monotonic() < self._open_until:
+                return
+        if self._safe_is_fresh():
+            return
+        threading.Thread(target=self.refresh, name=f"refresh-{self.name}", daemon=True).start()
+
+    def error(self):
+        """Last error while the most recent refresh failed, None once a refresh succeeded."""
+        with self._lock:
+            return self.last_error if self._consecutive_failures else None
+
+    def metrics(self):
+        with self._lock:
+            now = time.monotonic()
+            if now < self._open_until:
+                state = "open"
+            elif self._consecutive_failures >= self._breaker_threshold:
+                state = "half_open"
+            else:
+                state = "closed"
+            return {
+                "state": state,
+                "in_flight": self._inflight is not None,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "consecutive_failures": self._consecutive_failures,
+                "coalesced": self.coalesced,
+                "skipped_open": self.skipped_open,
+                "join_timeouts": self.join_timeouts,
+                "last_success_at": self.last_success_at,
+                "last_error": self.last_error,
+            }
+
+    def _run(self):
+        error = None
+        for attempt in range(self._retries + 1):
+            if attempt:
+                delay = min(self._max_backoff_sec, self._backoff_sec * 2 ** (attempt - 1))
+                time.sleep(delay * random.uniform(0.5, 1.5))
+            try:
+                self._fetch_fn()
+            except Exception as e:
+                error = e
+                print(f"[Refresh] {self.name} attempt {attempt + 1} failed: {e}")
+                continue
+            with self._lock:
+                self.refreshes += 1
+                self._consecutive_failures = 0
+                self._open_until = 0.0
+                self.last_success_at = time.time()
+            return True
+
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            self.last_error = str(error)
+            if self._consecutive_failures >= self._breaker_threshold:
+                self._open_until = time.monotonic() + self._breaker_cooldown_sec
+                print(f"[Refresh] {self.name}: circuit open for {self._breaker_cooldown_sec:.0f}s")
+        if self._on_failure is not None:
+            try:
+                self._on_failure(error)
+            except Exception as e:
+                print(f"[Refresh] {self.name} failure handler failed: {e}")
+        return False
+
+    def _safe_is_fresh(self):
+        try:
+            return self._is_fresh()
+        except Exception:
+            return False
+
+
+_refreshers = {}
+_refreshers_lock = threading.Lock()
+
+
+def register_refresher(refresher):
+    with _refreshers_lock:
+        _refreshers[refresher.name] = refresher
+    return refresher
+
+
+def refresh_metrics():
+    """{name: metrics} of every registered Refresher."""
+    with _refreshers_lock:
+        refreshers = list(_refreshers.values())
+    return {r.name: r.metrics() for r in refreshers}
@@ -0,0 +1,17 @@
+import os
+
+# Popularity scoring settings. No Firestore here: app/stats.py (the live counters) and the
+# offline tools (scripts/aggregate_event_log.py, scripts/bench_ranking_modes.py) share them.
+
+# Weights
+WEIGHTS = {
+    "views": 1,
+    "clicks": 3,
+    "saves": 7
+}
+
+# popularity_score counts the events of the last WINDOW_DAYS days (see the ring in app/stats.py)
+WINDOW_DAYS = 7
+
+# decay_score halves every DECAY_HALF_LIFE_DAYS (RANKING_MODE=decay)
+DECAY_HALF_LIFE_DAYS = float(os.environ.get("DECAY_HALF_LIFE_DAYS", 3.5))
@@ -0,0 +1,156 @@
+import threading
+
+from .catalog import get_catalog
+from .ranking import rank_score
+
+# Names are mostly Japanese (no word breaks), so index character n-grams.
+# Unigrams are kept too so that 1-character queries can be answered.
+NGRAM = 2
+
+# Match tiers used for ranking (higher is better)
+TIER_TAG = 3       # query equals one of the item's style tags
+TIER_NAME = 2      # substring of name
+TIER_CATEGORY = 1  # substring of category
+TIER_STYLE = 0     # substring of a style
+
+
+def _grams(text):
+    grams = set(text)
+    grams.update(text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1))
+    return grams
+
+
+def _query_grams(q):
+    if len(q) < NGRAM:
+        return {q}
+    return {q[i:i + NGRAM] for i in range(len(q) - NGRAM + 1)}
+
+
+def _search_fields(item):
+    """Lowercased texts the search looks into: (name, category, [style tags])."""
+    name = str(item.get("name") or "").lower()
+    category = str(item.get("category") or "").lower()
+    style_texts = [str(s).lower() for s in item.get("style_tags", ())]
+    return name, category, style_texts
+
+
+def match_tier(q, item, is_tag=False):
+    """Best match tier of lowercased query q for item, or None if it does not match."""
+    if is_tag:
+        return TIER_TAG
+    name, category, style_texts = _search_fields(item)
+    if q in name:
+        return TIER_NAME
+    if q in category:
+        return TIER_CATEGORY
+    if any(q in s for s in style_texts):
+        return TIER_STYLE
+    return None
+
+
+class SearchIndex:
+    """
+    Inverted index over the catalog: n-gram postings for name/category/styles
+    and exact postings for style tags. Kept up to date through catalog listener callbacks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}    # gram -> set(item_id)
+        self._tags = {}        # lowercased tag -> set(item_id)
+        self._item_keys = {}   # item_id -> (grams, tags) currently indexed
+
+    def on_catalog_change(self, snapshot, changed_ids, removed_ids):
+        with self._lock:
+            for item_id in removed_ids:
+                self._unindex(item_id)
+            for item_id in changed_ids:
+                self._unindex(item_id)
+                item = snapshot.get(item_id)
+                if item is not None:
+                    self._index(item_id, item)
+
+    def _index(self, item_id, item):
+        name, category, style_texts = _search_fields(item)
+        grams = _grams(name) | _grams(category)
+        for s in style_texts:
+            grams |= _grams(s)
+        tags = set(style_texts)
+
+        for g in grams:
+            self._postings.setdefault(g, set()).add(item_id)
+        for t in tags:
+            self._tags.setdefault(t, set()).add(item_id)
+        self._item_keys[item_id] = (grams, tags)
+
+    def _unindex(self, item_id):
+        keys = self._item_keys.pop(item_id, None)
+        if not keys:
+            return
+        grams, tags = keys
+        for g in grams:
+            ids = self._postings.get(g)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._postings[g]
+        for t in tags:
+            ids = self._tags.get(t)
+            if ids is not None:
+                ids.discard(item_id)
+                if not ids:
+                    del self._tags[t]
+
+    def candidates(self, q):
+        """
+        (ids containing every n-gram of q, ids having q as an exact style tag).
+        The first set is a superset of the real substring matches.
+        """
+        with self._lock:
+            lists = [self._postings.get(g) for g in _query_grams(q)]
+            if any(not ids for ids in lists):
+                return set(), set()
+            lists.sort(key=len)
+            return lists[0].intersection(*lists[1:]), self._tags.get(q, set()).copy()
+
+    def ranked(self, query, snapshot):
+        """
+        [(rank key, item)] matching query, best first: match tier, then popularity (rank_score), then name.
+        Matching is the same case-insensitive substring test on name, category and styles.
+        """
+        q = (query or "").lower()
+        if not q:
+            return []
+
+        found, tag_ids = self.candidates(q)
+        ranked = []
+        for item_id in found:
+            item = snapshot.get(item_id)
+            if item is None:
+                continue
+            tier = match_tier(q, item, is_tag=item_id in tag_ids)
+            if tier is None:
+                continue
+            ranked.append(((tier, rank_score(item), item.get("name") or "", item_id), item))
+
+        ranked.sort(key=lambda x: x[0], reverse=True)
+        return ranked
+
+    def search(self, query, snapshot):
+        return [item for _, item in self.ranked(query, snapshot)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    """Process-wide SearchIndex attached to the item catalog."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = SearchIndex()
+                get_catalog().add_listener(index.on_catalog_change)
+                _index = index
+    return _index
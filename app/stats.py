@@ -1,104 +1,831 @@
-from datetime import datetime, timedelta
+import atexit
+import json
+import os
+import random
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
 from google.cloud import firestore
-from .db import get_db
+from google.cloud.firestore_v1.field_path import FieldPath
+from .db import get_client
+from .catalog import get_catalog
+from .event_buffer import EventBuffer
+from .event_log import EventLog, EVENT_LOG_DIR
+from .scoring import WEIGHTS, WINDOW_DAYS, DECAY_HALF_LIFE_DAYS
+from .uniques import HyperLogLog, UniqueViewers
 
-# Weights
-WEIGHTS = {
-    "views": 1,
-    "clicks": 3,
-    "saves": 7
-}
+# Write-behind buffer settings (see app/event_buffer.py)
+EVENT_FLUSH_SEC = float(os.environ.get("EVENT_FLUSH_SEC", 5))
+EVENT_FLUSH_KEYS = int(os.environ.get("EVENT_FLUSH_KEYS", 500))
+EVENT_BUFFER_MAX_KEYS = int(os.environ.get("EVENT_BUFFER_MAX_KEYS", 10000))
+EVENT_SPOOL_DIR = os.environ.get("EVENT_SPOOL_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "event_spool")
+
+# Append-only raw event log for offline aggregation (see app/event_log.py, scripts/aggregate_event_log.py)
+EVENT_LOG_ENABLED = os.environ.get("EVENT_LOG_ENABLED", "1") != "0"
+EVENT_LOG_SEGMENT_MB = int(os.environ.get("EVENT_LOG_SEGMENT_MB", 64))
+EVENT_LOG_RETENTION_DAYS = int(os.environ.get("EVENT_LOG_RETENTION_DAYS", 0))
+
+# Unique viewers / duplicate-view filter (see app/uniques.py). Memory: up to
+# UNIQUE_MAX_SKETCHES sketches of 2^UNIQUE_HLL_PRECISION bytes, plus VIEW_DEDUP_MAX_KEYS
+# remembered (viewer, item) pairs (~100 bytes each).
+UNIQUE_HLL_PRECISION = int(os.environ.get("UNIQUE_HLL_PRECISION", 11))
+UNIQUE_MAX_SKETCHES = int(os.environ.get("UNIQUE_MAX_SKETCHES", 5000))
+UNIQUE_PERSIST_SEC = float(os.environ.get("UNIQUE_PERSIST_SEC", 60))
+VIEW_DEDUP_TTL_SEC = float(os.environ.get("VIEW_DEDUP_TTL_SEC", 1800))
+VIEW_DEDUP_MAX_KEYS = int(os.environ.get("VIEW_DEDUP_MAX_KEYS", 100000))
+
+# Firestore batches are limited to 500 writes
+MAX_BATCH_WRITES = 500
+
+# Event counters live in item_stats/<item_id>, not on the item: catalog reads stay small and
+# event writes never touch the item document. Only the compact scores (popularity_score,
+# decay_score) are denormalized onto the item, by sync_item_scores() every STATS_SYNC_SEC seconds.
+STATS_COLLECTION = "item_stats"
+STATS_SYNC_SEC = int(os.environ.get("STATS_SYNC_SEC", os.environ.get("STATS_SHARD_AGGREGATE_SEC", 30)))
+
+# Sharded counters for hot items: with STATS_SHARDS=N (>0) events go to one of N
+# item_stats/<id>/counter_shards/<k> documents picked at random, instead of the stats document
+# (which only sustains about one write per second). sync_item_scores() rolls the shards up.
+STATS_SHARDS = int(os.environ.get("STATS_SHARDS", 0))
+SHARD_COLLECTION = "counter_shards"
+
+class BatchWriter:
+    """db.batch() that commits itself every MAX_BATCH_WRITES writes. written: writes committed so far."""
+
+    def __init__(self, db):
+        self._db = db
+        self._batch = db.batch()
+        self._pending = 0
+        self.written = 0
+
+    def update(self, ref, fields):
+        self._batch.update(ref, fields)
+        self._count()
+
+    def set(self, ref, data, merge=True):
+        self._batch.set(ref, data, merge=merge)
+        self._count()
+
+    def delete(self, ref):
+        self._batch.delete(ref)
+        self._count()
+
+    def _count(self):
+        self._pending += 1
+        if self._pending >= MAX_BATCH_WRITES:
+            self.commit()
+
+    def commit(self):
+        if self._pending:
+            self._batch.commit()
+            self.written += self._pending
+        self._batch = self._db.batch()
+        self._pending = 0
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def get_event_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                buf = EventBuffer(write_event_counts, EVENT_SPOOL_DIR,
+                                  flush_sec=EVENT_FLUSH_SEC,
+                                  flush_keys=EVENT_FLUSH_KEYS,
+                                  max_keys=EVENT_BUFFER_MAX_KEYS)
+                buf.start()
+                atexit.register(buf.stop)
+                _buffer = buf
+    return _buffer
+
+_event_log = None
+
+def get_event_log():
+    global _event_log
+    if _event_log is None:
+        with _buffer_lock:
+            if _event_log is None:
+                log = EventLog(EVENT_LOG_DIR,
+                               max_bytes=EVENT_LOG_SEGMENT_MB * 1024 * 1024,
+                               retention_days=EVENT_LOG_RETENTION_DAYS)
+                atexit.register(log.close)
+                _event_log = log
+    return _event_log
+
+_uniques = None
+
+def get_unique_viewers():
+    global _uniques
+    if _uniques is None:
+        with _buffer_lock:
+            if _uniques is None:
+                uv = UniqueViewers(write_unique_sketches,
+                                   precision=UNIQUE_HLL_PRECISION,
+                                   max_sketches=UNIQUE_MAX_SKETCHES,
+                                   dedup_ttl=VIEW_DEDUP_TTL_SEC,
+                                   dedup_max_keys=VIEW_DEDUP_MAX_KEYS,
+                                   persist_sec=UNIQUE_PERSIST_SEC)
+                uv.start()
+                atexit.register(uv.stop)
+                _uniques = uv
+    return _uniques
+
+def record_view(item_id, viewer):
+    """
+    A detail-page view by `viewer` (see uniques.viewer_id). Counts towards the item's unique
+    viewers; repeat views within VIEW_DEDUP_TTL_SEC are dropped instead of recorded.
+    Returns True if the view was recorded.
+    """
+    if not get_unique_viewers().observe(item_id, viewer, date.today().toordinal()):
+        return False
+    record_event(item_id, 'views')
+    return True
 
 def record_event(item_id, event_type, amount=1):
     """
     Increments (or decrements if amount < 0) the count for a specific event type on a specific day.
-    Recalculates the popularity score and cleans up old data.
+    Only enqueues: the write-behind buffer aggregates events and writes them in batches
+    (write_event_counts), so the request does not wait on Firestore.
+    The raw event is also appended to the local event log (EVENT_LOG_ENABLED).
     """
-    db = get_db()
-    item_ref = db.collection('items').document(str(item_id))
-    
-    today = datetime.now().strftime("%Y-%m-%d")
-    
-    # field_path = f"stats.{event_type}.{today}"
-    
+    if EVENT_LOG_ENABLED:
+        get_event_log().append(item_id, event_type, amount)
+    get_event_buffer().add(item_id, event_type, amount, date.today().toordinal())
+
+# --- Daily ring buffer ---
+# Per item_stats document, each event type has RING_DAYS day slots ("ring.<type>.<slot>", slot = day ordinal % RING_DAYS)
+# plus a running WINDOW_DAYS total ("totals.<type>") and the weighted popularity_score.
+# "ring_day.<slot>" records which day a slot currently holds. Firestore cannot increment array
+# elements, so the ring is a map keyed by slot number.
+# RING_DAYS is one more than the window: the extra slot is the one recompute_popularity()
+# zeroes at the start of each day (recomputing totals / popularity_score from the ring), so every
+# event is a pure Increment with no read and no date parsing.
+# If a recompute is missed, a slot can come round again still holding the counts of RING_DAYS days
+# ago. So the first write of a day to a slot (per process) checks ring_day.<slot> in a transaction
+# and clears stale counts before the increments are written (_reset_reused_slots).
+RING_DAYS = WINDOW_DAYS + 1
+
+def _in_window(day, today):
+    return today - WINDOW_DAYS < day <= today
+
+# --- Exponentially decayed score (RANKING_MODE=decay, see app/ranking.py) ---
+# Alongside the window, every event also feeds a decayed score: each event counts WEIGHTS[type],
+# halving every DECAY_HALF_LIFE_DAYS. It is kept as a forward-decayed value: an event at time t
+# adds weight * 2^((t - DECAY_EPOCH) / half_life) to "decay_score". All items share that time base,
+# so stored values rank exactly like current decayed scores and each event adds one Increment
+# ("decay_score") - no per-day maps and no nightly clean-up of its own. Both scores are written in
+# either RANKING_MODE: the popularity summary shows the window totals and the decayed value, and
+# the mode can be switched without a backfill.
+# decay_value() converts back to event units at a given time.
+# The stored numbers grow 2x per half-life, so the time base cannot stay fixed forever. They are
+# bounded by 2^DECAY_MAX_HALF_LIVES, which leaves float64 (max ~2^1024) room for summing any
+# realistic number of events: with the default half-life that is ~8.6 years past DECAY_EPOCH.
+# check_decay_epoch() warns DECAY_REBASE_WARN_DAYS ahead and stops start_background_jobs() once
+# the bound is reached; past it _decay_factor() raises (the event buffer keeps the counts) instead
+# of storing inf. scripts/rebase_decay_epoch.py moves the stored scores to a later DECAY_EPOCH.
+DECAY_EPOCH = float(os.environ.get("DECAY_EPOCH", 1767225600))  # 2026-01-01 UTC
+DECAY_MAX_HALF_LIVES = 900
+DECAY_REBASE_WARN_DAYS = int(os.environ.get("DECAY_REBASE_WARN_DAYS", 90))
+
+def _half_lives(ts):
+    return (ts - DECAY_EPOCH) / (DECAY_HALF_LIFE_DAYS * 86400)
+
+def _decay_factor(ts):
+    half_lives = _half_lives(ts)
+    if half_lives > DECAY_MAX_HALF_LIVES:
+        raise ValueError("decay_score bound reached: rebase DECAY_EPOCH (scripts/rebase_decay_epoch.py)")
+    return 2.0 ** half_lives
+
+def decay_days_left(now=None):
+    """Days until stored decay scores reach their bound (negative once past it)."""
+    now = now if now is not None else time.time()
+    return (DECAY_MAX_HALF_LIVES - _half_lives(now)) * DECAY_HALF_LIFE_DAYS
+
+def check_decay_epoch(now=None):
+    """Startup / daily check of the decay time base: raises past the bound, warns when it is near."""
+    left = decay_days_left(now)
+    if left <= 0:
+        raise RuntimeError("DECAY_EPOCH is too old for decay_score: run scripts/rebase_decay_epoch.py")
+    if left <= DECAY_REBASE_WARN_DAYS:
+        print(f"[Stats] decay_score reaches its bound in {left:.0f} days: run scripts/rebase_decay_epoch.py")
+    return left
+
+def _event_ts(day, today, now):
+    """Event time for a buffered (day-granular) count: now for today, noon for older spool entries."""
+    if day == today:
+        return now
+    return datetime.combine(date.fromordinal(day), datetime.min.time()).timestamp() + 43200
+
+def decay_value(item, now=None):
+    """Decayed score of item at `now` (epoch seconds), in weighted-event units."""
+    now = now if now is not None else time.time()
+    stored = (item.get("decay_score") or 0) + (item.get("decay_score_shards") or 0)
+    return stored / 2.0 ** _half_lives(now)
+
+def event_increments(event_type, day, amount, today=None, now=None):
+    """
+    Field updates for `amount` events of `event_type` on `day` (a date ordinal).
+    Constant size, increments only. Events already outside the window are ignored.
+    """
+    today = today if today is not None else date.today().toordinal()
+    if not amount or event_type not in WEIGHTS or not _in_window(day, today):
+        return {}
+    slot = day % RING_DAYS
+    ts = _event_ts(day, today, now if now is not None else time.time())
+    return {
+        f"ring.{event_type}.{slot}": firestore.Increment(amount),
+        f"ring_day.{slot}": day,
+        f"totals.{event_type}": firestore.Increment(amount),
+        "popularity_score": firestore.Increment(amount * WEIGHTS[event_type]),
+        "decay_score": firestore.Increment(amount * WEIGHTS[event_type] * _decay_factor(ts)),
+    }
+
+def _merge_increments(fields, more):
+    for path, value in more.items():
+        prev = fields.get(path)
+        if isinstance(prev, firestore.Increment) and isinstance(value, firestore.Increment):
+            fields[path] = firestore.Increment(prev.value + value.value)
+        else:
+            fields[path] = value
+
+def _stale_slot_fields(doc, slot_days, with_totals):
+    """
+    Fields that clear ring slots about to be reused for a new day while still holding an older
+    day's counts (the nightly recompute did not run). Those counts are still in totals /
+    popularity_score (only the recompute takes them out), so a stats document (with_totals)
+    also gets them subtracted. slot_days: {slot_key: day} about to be written. -> {} if none.
+    """
+    ring = doc.get("ring") or {}
+    ring_day = doc.get("ring_day") or {}
+    fields = {}
+    for slot_key, day in slot_days.items():
+        if ring_day.get(slot_key) in (None, day):
+            continue
+        for e_type, weight in WEIGHTS.items():
+            count = (ring.get(e_type) or {}).get(slot_key) or 0
+            if not count:
+                continue
+            fields[f"ring.{e_type}.{slot_key}"] = 0
+            if with_totals:
+                _merge_increments(fields, {
+                    f"totals.{e_type}": firestore.Increment(-count),
+                    "popularity_score": firestore.Increment(-count * weight),
+                })
+        fields[f"ring_day.{slot_key}"] = day
+    return fields
+
+# Ring slot days known to be current, per ring holder path (see _reset_reused_slots)
+_slot_days_lock = threading.Lock()
+_slot_days = {}
+
+def _slot_days_of(fields):
+    return {path.split(".", 1)[1]: day for path, day in fields.items() if path.startswith("ring_day.")}
+
+def _reset_reused_slots(db, targets):
+    """
+    targets: [(ring holder ref, event fields, with_totals)] about to be incremented.
+    Runs before the increments are written; the first time a slot is written for a new day
+    (in this process) a transaction clears it if it still holds an older day. Idempotent, so a
+    flush that fails afterwards and is retried does not clear anything twice.
+    """
+    for ref, fields, with_totals in targets:
+        slot_days = _slot_days_of(fields)
+        with _slot_days_lock:
+            known = _slot_days.get(ref.path, {})
+            if all(known.get(k) == d for k, d in slot_days.items()):
+                continue
+
+        @firestore.transactional
+        def reset(transaction):
+            snap = ref.get(field_paths=["ring", "ring_day"], transaction=transaction)
+            stale = _stale_slot_fields((snap.to_dict() or {}) if snap.exists else {}, slot_days, with_totals)
+            if stale:
+                data = nest_fields(stale)
+                data["updated_at"] = firestore.SERVER_TIMESTAMP
+                transaction.set(ref, data, merge=True)
+            return stale
+
+        if reset(db.transaction()):
+            print(f"[Stats] Cleared reused ring slots of {ref.path} (nightly recompute missed?)")
+        with _slot_days_lock:
+            _slot_days.setdefault(ref.path, {}).update(slot_days)
+
+def nest_fields(fields):
+    """{"a.b.c": v} -> {"a": {"b": {"c": v}}} (for set(..., merge=True))"""
+    out = {}
+    for path, value in fields.items():
+        node = out
+        parts = path.split(".")
+        for p in parts[:-1]:
+            node = node.setdefault(p, {})
+        node[parts[-1]] = value
+    return out
+
+def _stats_ref(db, item_id):
+    return db.collection(STATS_COLLECTION).document(item_id)
+
+def write_event_counts(counts):
+    """
+    Flush callback: counts is {(item_id, event_type, day_ordinal): amount}.
+    Each item gets one set(merge=True) of Increments on its item_stats document (no read;
+    the item document is left alone and picks up the new score from sync_item_scores()).
+    """
+    db = get_client()
+    catalog = get_catalog()
+    known = catalog.snapshot()
+    if not catalog.is_loaded():
+        # Can't tell deleted items from unknown ones yet: fail, the buffer keeps the counts
+        raise RuntimeError("item catalog not loaded yet")
+    today = date.today().toordinal()
+    now = time.time()
+
+    by_item = {}
+    for (item_id, event_type, day), amount in counts.items():
+        if item_id not in known:
+            # Deleted item: don't resurrect its stats document
+            continue
+        if isinstance(day, str):
+            # spool written before days were stored as ordinals
+            day = datetime.strptime(day, "%Y-%m-%d").date().toordinal()
+        fields = event_increments(event_type, day, amount, today, now)
+        if fields:
+            _merge_increments(by_item.setdefault(item_id, {}), fields)
+
+    if STATS_SHARDS > 0:
+        _write_shards(db, by_item)
+        return
+
+    _reset_reused_slots(db, [(_stats_ref(db, item_id), fields, True) for item_id, fields in by_item.items()])
+    writer = BatchWriter(db)
+    for item_id, fields in by_item.items():
+        data = nest_fields(fields)
+        data["updated_at"] = firestore.SERVER_TIMESTAMP
+        writer.set(_stats_ref(db, item_id), data)
+    writer.commit()
+
+# --- Sharded counters ---
+
+def _write_shards(db, by_item):
+    """
+    Ring and decay_score increments go to a random shard of each item; totals / popularity_score
+    are left to sync_item_scores(). set(merge=True) creates the shard on first use.
+    """
+    writes = []
+    for item_id, fields in by_item.items():
+        ring_fields = {k: v for k, v in fields.items() if k.startswith(("ring", "decay"))}
+        shard_ref = _stats_ref(db, item_id).collection(SHARD_COLLECTION).document(str(random.randrange(STATS_SHARDS)))
+        writes.append((shard_ref, ring_fields, False))
+    _reset_reused_slots(db, writes)
+    for i in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for shard_ref, ring_fields, _ in writes[i:i + MAX_BATCH_WRITES]:
+            data = nest_fields(ring_fields)
+            data["updated_at"] = firestore.SERVER_TIMESTAMP
+            batch.set(shard_ref, data, merge=True)
+        batch.commit()
+
+def _window_totals(docs, today):
+    """Sum of in-window ring slots over several ring holders (stats document + its shards)."""
+    totals = {e: 0 for e in WEIGHTS}
+    for d in docs:
+        ring = d.get("ring") or {}
+        for slot_key, day in (d.get("ring_day") or {}).items():
+            if day is None or not _in_window(day, today):
+                continue
+            for e_type in WEIGHTS:
+                totals[e_type] += (ring.get(e_type) or {}).get(slot_key) or 0
+    return totals
+
+def _score(totals):
+    return sum((totals.get(e) or 0) * w for e, w in WEIGHTS.items())
+
+def sync_item_scores(db=None):
+    """
+    Periodic job: copies popularity_score / decay_score of every item_stats document changed
+    since the last run onto its item document (the only stats the catalog and ranking read).
+    Items whose counter shards changed first get totals / popularity_score recomputed from
+    the stats ring plus all of their shards. Runs under the job_leases/sync_item_scores lease,
+    which also keeps the watermark (synced_until) of the last finished run.
+    """
+    if not get_catalog().is_loaded():
+        # Deleted and unknown items look the same until the catalog loaded; try next run
+        return
+    db = db or get_client()
+    owner = _lease_owner()
+    lease = _take_lease(db, "sync_item_scores", owner, JOB_LEASE_SEC)
+    if lease is None:
+        return  # another process is syncing
+    state = None
     try:
-        # We need to make sure the bucket exists before incrementing negatively might cause issues
-        # Actually Increment(-1) works fine in Firestore if the field exists.
-        # If it doesn't exist, we might get a negative number from 0 which is also fine for logic.
-        item_ref.update({
-            f"stats.{event_type}.{today}": firestore.Increment(amount)
-        })
-    except Exception:
-        if amount > 0:
-            item_ref.set({
-                "stats": {
-                    event_type: {
-                        today: amount
-                    }
-                }
-            }, merge=True)
-
-    # After recording, recalculate score
-    _update_item_score(item_ref)
-
-def _update_item_score(item_ref):
-    """
-    Reads stats, calculates popularity_score (7-day window), and cleans up old keys.
-    """
-    doc = item_ref.get()
-    if not doc.exists:
+        state = _sync_item_scores(db, owner, lease.get("synced_until"))
+    finally:
+        _release_lease(db, "sync_item_scores", owner, state)
+
+def _sync_item_scores(db, owner, synced_until):
+    """-> the lease state to keep, or None if the run did not finish"""
+    today = date.today().toordinal()
+    # Small overlap so writes racing with this run are picked up next time
+    started = datetime.now(timezone.utc) - timedelta(seconds=5)
+
+    def changed(query):
+        if synced_until is not None:
+            query = query.where("updated_at", ">", synced_until)
+        return query.select(["updated_at"]).stream()
+
+    dirty = {doc.id for doc in changed(db.collection(STATS_COLLECTION))}
+    sharded = {doc.reference.parent.parent.id for doc in changed(db.collection_group(SHARD_COLLECTION))}
+    dirty |= sharded
+
+    known = get_catalog().snapshot()
+    stats_writer = BatchWriter(db)
+    item_writer = db.bulk_writer()
+    # Item deleted since: nothing to sync
+    item_writer.on_write_error(lambda error, _: error.code != 5 and error.attempts < 10)
+    synced = 0
+    ids = sorted(i for i in dirty if i in known)
+    for i in range(0, len(ids), MAX_BATCH_WRITES):
+        if i and not _take_lease(db, "sync_item_scores", owner, JOB_LEASE_SEC):
+            # Lease expired and another process took over; it starts from the old watermark
+            stats_writer.commit()
+            item_writer.close()
+            print(f"Item score sync lease lost after {synced} items, stopping")
+            return None
+        refs = [_stats_ref(db, item_id) for item_id in ids[i:i + MAX_BATCH_WRITES]]
+        for doc in db.get_all(refs):
+            stats = doc.to_dict() or {}
+            if doc.id in sharded:
+                shards = [s.to_dict() or {} for s in doc.reference.collection(SHARD_COLLECTION).stream()]
+                totals = _window_totals([stats] + shards, today)
+                stats["popularity_score"] = _score(totals)
+                stats["decay_score_shards"] = sum(s.get("decay_score") or 0 for s in shards)
+                stats_writer.set(doc.reference, {
+                    "totals": totals,
+                    "popularity_score": stats["popularity_score"],
+                    "decay_score_shards": stats["decay_score_shards"],
+                })
+            elif not doc.exists:
+                continue
+
+            scores = {
+                "popularity_score": stats.get("popularity_score") or 0,
+                "decay_score": (stats.get("decay_score") or 0) + (stats.get("decay_score_shards") or 0),
+            }
+            item = known.get(doc.id) or {}
+            if all(item.get(k) == v for k, v in scores.items()):
+                continue
+            item_writer.update(db.collection('items').document(doc.id), scores)
+            synced += 1
+    stats_writer.commit()
+    item_writer.close()
+
+    if synced:
+        print(f"Item scores synced for {synced} items")
+    return {"synced_until": started}
+
+def _legacy_day_counts(stats):
+    """Old schema: stats.<type>.<YYYY-MM-DD> -> {type: {day_ordinal: count}}"""
+    out = {}
+    for e_type in WEIGHTS:
+        days = out.setdefault(e_type, {})
+        for date_str, count in (stats.get(e_type) or {}).items():
+            try:
+                day = datetime.strptime(date_str, "%Y-%m-%d").date().toordinal()
+            except ValueError:
+                continue
+            days[day] = days.get(day, 0) + (count or 0)
+    return out
+
+def _recomputed_fields(item, shards, today):
+    """
+    Absolute values for one ring holder: expired slots zeroed and, for a stats document,
+    totals / popularity_score recomputed from its ring plus its shards.
+    -> fields that differ from what is stored ({} if already correct)
+    """
+    ring = item.get("ring") or {}
+    fields = {}
+    for slot_key, day in (item.get("ring_day") or {}).items():
+        if day is None or _in_window(day, today):
+            continue
+        for e_type in WEIGHTS:
+            if (ring.get(e_type) or {}).get(slot_key):
+                fields[f"ring.{e_type}.{slot_key}"] = 0
+        fields[f"ring_day.{slot_key}"] = None
+
+    if shards is not None:
+        totals = _window_totals([item] + shards, today)
+        score = _score(totals)
+        if item.get("totals") != totals:
+            fields["totals"] = totals
+        if item.get("popularity_score") != score:
+            fields["popularity_score"] = score
+    return fields
+
+def legacy_stats_increments(item, today=None):
+    """
+    Stats fields still kept on an item document (the old stats.<type>.<date> map, or ring /
+    totals / decay fields from before item_stats) as Increments for its item_stats document.
+    Only in-window days are carried over; totals / popularity_score are rebuilt from them.
+    """
+    today = today if today is not None else date.today().toordinal()
+    fields = {}
+    ring = item.get("ring") or {}
+    for slot_key, day in (item.get("ring_day") or {}).items():
+        if day is None or not _in_window(day, today):
+            continue
+        for e_type in WEIGHTS:
+            count = (ring.get(e_type) or {}).get(slot_key) or 0
+            more = event_increments(e_type, day, count, today)
+            more.pop("decay_score", None)  # already in the item's decay_score
+            _merge_increments(fields, more)
+    for e_type, days in _legacy_day_counts(item.get("stats") or {}).items():
+        for day, count in days.items():
+            _merge_increments(fields, event_increments(e_type, day, count, today))
+    if item.get("decay_score"):
+        _merge_increments(fields, {"decay_score": firestore.Increment(item["decay_score"])})
+    return fields
+
+# Nightly recompute: checkpoint of the current run ({"day", "last_id", "done"})
+RECOMPUTE_PAGE_SIZE = int(os.environ.get("RECOMPUTE_PAGE_SIZE", 300))
+RECOMPUTE_CHECKPOINT_FILE = os.environ.get("RECOMPUTE_CHECKPOINT_FILE") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "instance", "recompute_popularity.checkpoint")
+# Documents changed by an event between our read and our write are re-read this many times
+RECOMPUTE_CONFLICT_RETRIES = 3
+# Only one process (any worker, host or script) runs the recompute at a time: it holds a lease
+# in job_leases/recompute_popularity, renewed after every page; a crashed holder's lease expires
+LEASE_COLLECTION = "job_leases"
+RECOMPUTE_LEASE_SEC = int(os.environ.get("RECOMPUTE_LEASE_SEC", 600))
+# The same for the periodic jobs (sync_item_scores, history compaction / tombstone sweep); they keep
+# their watermark in the lease document, so the next run continues from it whichever process runs it
+JOB_LEASE_SEC = int(os.environ.get("JOB_LEASE_SEC", 300))
+
+def _load_recompute_checkpoint():
+    try:
+        with open(RECOMPUTE_CHECKPOINT_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_recompute_checkpoint(state):
+    os.makedirs(os.path.dirname(RECOMPUTE_CHECKPOINT_FILE), exist_ok=True)
+    tmp = RECOMPUTE_CHECKPOINT_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, RECOMPUTE_CHECKPOINT_FILE)
+
+def _lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+def _take_lease(db, name, owner, ttl):
+    """
+    Takes (or renews) the lease `name` for ttl seconds. -> the lease document (with the state the
+    last holder stored, see _release_lease), or None if someone else holds it.
+    """
+    ref = db.collection(LEASE_COLLECTION).document(name)
+
+    @firestore.transactional
+    def take(transaction):
+        snap = ref.get(transaction=transaction)
+        lease = snap.to_dict() if snap.exists else None
+        now = datetime.now(timezone.utc)
+        if lease and lease.get("owner") != owner and lease.get("expires_at") and lease["expires_at"] > now:
+            return None
+        lease = dict(lease or {}, owner=owner, expires_at=now + timedelta(seconds=ttl))
+        transaction.set(ref, lease)
+        return lease
+
+    return take(db.transaction())
+
+def _release_lease(db, name, owner, state=None):
+    """
+    Gives the lease up if we still hold it. `state` (e.g. a job's watermark) is merged into what the
+    lease document keeps for the next holder; a document with nothing to keep is deleted.
+    """
+    ref = db.collection(LEASE_COLLECTION).document(name)
+
+    @firestore.transactional
+    def release(transaction):
+        snap = ref.get(transaction=transaction)
+        lease = (snap.to_dict() or {}) if snap.exists else {}
+        if lease.get("owner") != owner:
+            return
+        kept = {k: v for k, v in lease.items() if k not in ("owner", "expires_at")}
+        kept.update(state or {})
+        if kept:
+            transaction.set(ref, kept)
+        else:
+            transaction.delete(ref)
+
+    try:
+        release(db.transaction())
+    except Exception as e:
+        print(f"[Lease] Release of {name} failed (expires on its own): {e}")
+
+class _RecomputeWriter:
+    """
+    BulkWriter whose updates only apply if the document is unchanged since it was read.
+    Documents that changed in between (or were deleted) are collected instead of retried blindly.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._writer = db.bulk_writer()
+        self._writer.on_write_error(self._on_error)
+        self._lock = threading.Lock()
+        self.conflicts = []
+        self.written = 0
+        self.failed = 0
+
+    def _on_error(self, error, bulk_writer):
+        if error.code in (5, 9):  # NOT_FOUND, FAILED_PRECONDITION
+            with self._lock:
+                self.conflicts.append(error.operation.reference)
+            return False
+        if error.attempts < 10:
+            return True
+        with self._lock:
+            self.failed += 1
+        print(f"[Recompute] Write failed for {error.operation.reference.path}: {error.message}")
+        return False
+
+    def update(self, doc, fields):
+        self._writer.update(doc.reference, fields,
+                            option=self._db.write_option(last_update_time=doc.update_time))
+        self.written += 1
+
+    def flush(self):
+        self._writer.flush()
+        with self._lock:
+            conflicts, self.conflicts = self.conflicts, []
+        return conflicts
+
+    def close(self):
+        self._writer.close()
+
+def recompute_popularity(db=None, page_size=None, restart=False, force=False):
+    """
+    Nightly job: recomputes totals / popularity_score of every item_stats document from its ring
+    (plus counter shards), so items without recent traffic lose their expired days too, and zeroes
+    expired slots. Changed documents get a new updated_at, so sync_item_scores() copies the score
+    onto the item. Streams item_stats in document-id pages; writes go through a BulkWriter with a
+    last-update-time precondition (an event landing in between makes us re-read that document
+    rather than overwrite it). The last finished page is checkpointed, so a crashed run resumes
+    where it stopped. A run that already finished today is skipped unless force=True.
+    """
+    db = db or get_client()
+    owner = _lease_owner()
+    if not _take_lease(db, "recompute_popularity", owner, RECOMPUTE_LEASE_SEC):
+        print("Popularity recompute is running elsewhere, skipped")
         return
-    
-    item = doc.to_dict()
-    stats = item.get("stats", {})
-    
-    today_dt = datetime.now()
-    valid_days = [(today_dt - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
-    
-    total_score = 0
-    new_stats = {}
-    
-    for e_type, weights in WEIGHTS.items():
-        type_stats = stats.get(e_type, {})
-        new_type_stats = {}
-        type_7d_total = 0
-        
-        for date_str, count in type_stats.items():
-            if date_str in valid_days:
-                new_type_stats[date_str] = count
-                type_7d_total += count
-            # Dates older than 10 days are dropped (cleanup)
-            elif (today_dt - datetime.strptime(date_str, "%Y-%m-%d")).days < 14:
-                # Keep some buffer (14 days) but don't count in score
-                new_type_stats[date_str] = count
-        
-        total_score += type_7d_total * weights
-        new_stats[e_type] = new_type_stats
+    try:
+        _recompute_popularity(db, owner, page_size, restart, force)
+    finally:
+        _release_lease(db, "recompute_popularity", owner)
+
+def _recompute_popularity(db, owner, page_size, restart, force):
+    today = date.today().toordinal()
+    page_size = page_size or RECOMPUTE_PAGE_SIZE
+    stats_col = db.collection(STATS_COLLECTION)
+
+    state = {} if restart else _load_recompute_checkpoint()
+    if state.get("day") != today:
+        state = {"day": today, "last_id": None, "done": False}
+    elif state.get("done") and not force:
+        print("Popularity recompute already done today")
+        return
+    elif state.get("done"):
+        state = {"day": today, "last_id": None, "done": False}
+    if state["last_id"]:
+        print(f"Resuming popularity recompute after {state['last_id']}")
+
+    writer = _RecomputeWriter(db)
+
+    # Shards are only kept for hot items, so they fit in memory: parent id -> [shard dict]
+    shards_by_item = {}
+    for doc in db.collection_group(SHARD_COLLECTION).select(["ring", "ring_day"]).stream():
+        shard = doc.to_dict() or {}
+        shards_by_item.setdefault(doc.reference.parent.parent.id, []).append(shard)
+        fields = _recomputed_fields(shard, None, today)
+        if fields:
+            writer.update(doc, fields)
+    writer.flush()  # shard conflicts are left for the next run
+
+    scanned = updated = 0
+    fields_to_read = ["ring", "ring_day", "totals", "popularity_score"]
+    while True:
+        query = stats_col.order_by(FieldPath.document_id()).limit(page_size)
+        if state["last_id"]:
+            query = query.start_after({FieldPath.document_id(): state["last_id"]})
+        docs = list(query.select(fields_to_read).stream())
+        if not docs:
+            break
+
+        pending = docs
+        for attempt in range(RECOMPUTE_CONFLICT_RETRIES + 1):
+            for doc in pending:
+                if not doc.exists:
+                    continue
+                fields = _recomputed_fields(doc.to_dict() or {}, shards_by_item.get(doc.id, []), today)
+                if fields:
+                    fields["updated_at"] = firestore.SERVER_TIMESTAMP
+                    writer.update(doc, fields)
+                    updated += 1
+            conflicts = writer.flush()
+            if not conflicts or attempt == RECOMPUTE_CONFLICT_RETRIES:
+                break
+            pending = list(db.get_all(conflicts, field_paths=fields_to_read))
 
-    # Update the document with new score and cleaned stats
-    item_ref.update({
-        "popularity_score": total_score,
-        "stats": new_stats
-    })
+        scanned += len(docs)
+        state["last_id"] = docs[-1].id
+        _save_recompute_checkpoint(state)
+        if not _take_lease(db, "recompute_popularity", owner, RECOMPUTE_LEASE_SEC):
+            # Our lease expired and another process took over: it resumes from the checkpoint
+            writer.close()
+            print(f"Popularity recompute lease lost after {state['last_id']}, stopping")
+            return
+
+    writer.close()
+    state["done"] = True
+    _save_recompute_checkpoint(state)
+    print(f"Popularity recompute done: scanned={scanned} updated={updated} failed={writer.failed}")
+
+# --- Unique viewers ---
+# item_stats/<id> keeps "uv_sketch.<day>" (HyperLogLog registers) and "unique_viewers.<day>"
+# (its estimate) for in-window days, plus "unique_viewers_window" (estimate of their union).
+
+@firestore.transactional
+def _merge_unique_sketches(transaction, stats_ref, day_sketches, today):
+    doc = stats_ref.get(field_paths=["uv_sketch"], transaction=transaction)
+    stored = ((doc.to_dict() or {}).get("uv_sketch") or {}) if doc.exists else {}
+
+    fields = {}
+    window = {}
+    for day_key, data in stored.items():
+        day = int(day_key)
+        if not _in_window(day, today):
+            fields[f"uv_sketch.{day_key}"] = firestore.DELETE_FIELD
+            fields[f"unique_viewers.{day_key}"] = firestore.DELETE_FIELD
+            continue
+        window[day] = HyperLogLog.from_bytes(data)
+    for day, sketch in day_sketches.items():
+        if not _in_window(day, today):
+            continue
+        current = window.get(day)
+        if current is None or current.p != sketch.p:
+            window[day] = current = HyperLogLog(sketch.p, sketch.registers)
+        else:
+            current.merge(sketch)
+        fields[f"uv_sketch.{day}"] = current.to_bytes()
+        fields[f"unique_viewers.{day}"] = current.count()
+
+    union = None
+    for sketch in window.values():
+        if union is None:
+            union = HyperLogLog(sketch.p, sketch.registers)
+        elif union.p == sketch.p:
+            union.merge(sketch)
+    fields["unique_viewers_window"] = union.count() if union else 0
+    transaction.set(stats_ref, nest_fields(fields), merge=True)
+
+def write_unique_sketches(sketches):
+    """Persist callback: sketches is {(item_id, day_ordinal): HyperLogLog}; merged into the stored ones."""
+    db = get_client()
+    catalog = get_catalog()
+    known = catalog.snapshot()
+    if not catalog.is_loaded():
+        # Raising keeps the sketches in memory; they are merged again on the next persist
+        raise RuntimeError("item catalog not loaded yet")
+    today = date.today().toordinal()
+
+    by_item = {}
+    for (item_id, day), sketch in sketches.items():
+        if item_id in known:
+            by_item.setdefault(item_id, {})[day] = sketch
+    for item_id, day_sketches in by_item.items():
+        _merge_unique_sketches(db.transaction(), _stats_ref(db, item_id), day_sketches, today)
 
 def get_popularity_summary(item_dict):
     """
-    Returns a string like 'Score: 120 (V:100, C:5, S:1)' for display.
+    Returns {"score", "views", "clicks", "saves"} (7-day totals), "decayed" (decay_value now)
+    and "unique_viewers" (7-day estimate) for display.
+    item_dict is the item's item_stats document (or, before migration, the item itself);
+    documents still on the legacy stats map are summed on the fly.
     """
     score = item_dict.get("popularity_score", 0)
-    stats = item_dict.get("stats", {})
-    
-    today_dt = datetime.now()
-    valid_days = [(today_dt - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+    totals = item_dict.get("totals")
     
-    totals = {}
-    for etype in WEIGHTS.keys():
-        t_stats = stats.get(etype, {})
-        totals[etype] = sum(count for d, count in t_stats.items() if d in valid_days)
+    if totals is None:
+        today = date.today().toordinal()
+        legacy = _legacy_day_counts(item_dict.get("stats") or {})
+        totals = {e: sum(c for d, c in legacy.get(e, {}).items() if _in_window(d, today)) for e in WEIGHTS}
         
     return {
         "score": score,
-        "views": totals["views"],
-        "clicks": totals["clicks"],
-        "saves": totals["saves"]
+        "views": totals.get("views", 0),
+        "clicks": totals.get("clicks", 0),
+        "saves": totals.get("saves", 0),
+        "decayed": round(decay_value(item_dict), 2),
+        "unique_viewers": item_dict.get("unique_viewers_window", 0)
     }
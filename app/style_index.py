@@ -0,0 +1,83 @@
+import threading
+
+from .catalog import get_catalog
+from .ranking import PopularityOrder, merge_desc, rank_key
+
+
+class StyleIndex:
+    """
+    style -> item posting lists, each kept sorted by rank_key.
+    A multi-style feed is the union of the lists, merged so it comes out
+    already ordered by popularity (no per-request scan or sort of the catalog).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}              # style -> PopularityOrder
+        self._all = PopularityOrder()    # every item
+        self._item_keys = {}  # item_id -> (rank_key, tags) currently indexed
+
+    def on_catalog_change(self, snapshot, changed_ids, removed_ids):
+        with self._lock:
+            for item_id in removed_ids | changed_ids:
+                self._unindex(item_id)
+            for item_id in changed_ids:
+                item = snapshot.get(item_id)
+                if item is not None:
+                    self._index(item_id, item)
+
+    def _index(self, item_id, item):
+        key = rank_key(item)
+        tags = tuple(item.get("style_tags", ()))
+        self._all.add(key)
+        for t in tags:
+            self._postings.setdefault(t, PopularityOrder()).add(key)
+        self._item_keys[item_id] = (key, tags)
+
+    def _unindex(self, item_id):
+        entry = self._item_keys.pop(item_id, None)
+        if not entry:
+            return
+        key, tags = entry
+        self._all.discard(key)
+        for t in tags:
+            order = self._postings.get(t)
+            if order is not None:
+                order.discard(key)
+                if not order:
+                    del self._postings[t]
+
+    def styles(self):
+        """Every style currently used by at least one item."""
+        with self._lock:
+            return sorted(self._postings.keys())
+
+    def feed(self, styles=None, limit=None, after=None):
+        """
+        Item ids matching any of styles (all items if styles is empty),
+        ordered by popularity (rank_score) desc, then name desc.
+        after: a rank_key; only items ranked below it are returned (keyset pagination).
+        """
+        with self._lock:
+            if styles:
+                lists = [self._postings[s] for s in set(styles) if s in self._postings]
+            else:
+                lists = [self._all]
+
+            return [key[2] for key in merge_desc(lists, limit=limit, after=after)]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_style_index():
+    """Process-wide StyleIndex attached to the item catalog."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                index = StyleIndex()
+                get_catalog().add_listener(index.on_catalog_change)
+                _index = index
+    return _index
@@ -0,0 +1,217 @@
+import hashlib
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, request, session
+
+VIEWER_COOKIE = "vid"
+
+
+def _hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """
+    Cardinality sketch: 2^p one-byte registers (p=11 -> 2 KB, ~2.3% standard error).
+    Sketches of the same precision merge by taking the register-wise max, so partial sketches
+    from several processes / flushes combine without double counting.
+    """
+
+    def __init__(self, p=11, registers=None):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+
+    def add(self, value):
+        h = _hash64(value)
+        idx = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[idx]:
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError("HyperLogLog precision mismatch")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+
+    def count(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self):
+        return bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(p=int(math.log2(len(data))), registers=data)
+
+
+class TtlSet:
+    """
+    Keys remembered for ttl seconds, at most max_keys of them (oldest evicted first).
+    Keys are stored as 64-bit hashes to keep entries small.
+    """
+
+    def __init__(self, ttl, max_keys):
+        self._ttl = ttl
+        self._max_keys = max_keys
+        self._expires = OrderedDict()   # hash -> expiry (insertion order == expiry order)
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._expires)
+
+    def add_if_absent(self, key, now=None):
+        """True if key was not present (and is now remembered), False for a repeat within ttl."""
+        now = now if now is not None else time.monotonic()
+        h = _hash64(key)
+        while self._expires:
+            oldest, expiry = next(iter(self._expires.items()))
+            if expiry > now:
+                break
+            del self._expires[oldest]
+        if h in self._expires:
+            return False
+        if len(self._expires) >= self._max_keys:
+            self._expires.popitem(last=False)
+            self.evicted += 1
+        self._expires[h] = now + self._ttl
+        return True
+
+
+class UniqueViewers:
+    """
+    Per-item, per-day unique viewer sketches plus a duplicate-view filter.
+
+    observe() says whether a view should be counted at all: a viewer re-opening the same item
+    within dedup_ttl seconds is dropped before it reaches record_event. Every observed view
+    (counted or not) goes into the HyperLogLog of (item, day). A background thread hands the
+    sketches touched since the last run to persist_fn every persist_sec seconds; they are merged
+    into the stored ones, so memory only holds one interval's worth (at most max_sketches).
+    """
+
+    def __init__(self, persist_fn, precision=11, max_sketches=5000,
+                 dedup_ttl=1800, dedup_max_keys=100000, persist_sec=60):
+        self._persist_fn = persist_fn
+        self._precision = precision
+        self._max_sketches = max_sketches
+        self._persist_sec = persist_sec
+        self._lock = threading.Lock()
+        self._persist_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._seen = TtlSet(dedup_ttl, dedup_max_keys)
+        self._sketches = {}   # (item_id, day) -> HyperLogLog
+        self._thread = None
+
+        self.views = 0
+        self.duplicates = 0
+        self.sketches_dropped = 0
+        self.persist_failures = 0
+        self.last_error = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="unique-viewers", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.persist()
+
+    def observe(self, item_id, viewer_id, day):
+        """Records a view by viewer_id. Returns False if it is a repeat view to be dropped."""
+        item_id = str(item_id)
+        with self._lock:
+            self.views += 1
+            key = (item_id, day)
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                if len(self._sketches) >= self._max_sketches:
+                    self.sketches_dropped += 1
+                    self._wake.set()
+                else:
+                    sketch = self._sketches[key] = HyperLogLog(self._precision)
+            if sketch is not None:
+                sketch.add(viewer_id)
+            if not self._seen.add_if_absent((viewer_id, item_id)):
+                self.duplicates += 1
+                return False
+        return True
+
+    def persist(self):
+        with self._persist_lock:
+            with self._lock:
+                sketches, self._sketches = self._sketches, {}
+            if not sketches:
+                return
+            try:
+                self._persist_fn(sketches)
+            except Exception as e:
+                self.persist_failures += 1
+                self.last_error = str(e)
+                print(f"[UniqueViewers] Persist failed, will retry: {e}")
+                with self._lock:
+                    for key, sketch in sketches.items():
+                        current = self._sketches.get(key)
+                        if current is None:
+                            self._sketches[key] = sketch
+                        else:
+                            current.merge(sketch)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "views": self.views,
+                "duplicates_dropped": self.duplicates,
+                "dedup_keys": len(self._seen),
+                "dedup_evicted": self._seen.evicted,
+                "sketches": len(self._sketches),
+                "max_sketches": self._max_sketches,
+                "sketch_bytes": len(self._sketches) * (1 << self._precision),
+                "sketches_dropped": self.sketches_dropped,
+                "persist_failures": self.persist_failures,
+                "last_error": self.last_error,
+            }
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self._persist_sec)
+            self._wake.clear()
+            try:
+                self.persist()
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[UniqueViewers] Unexpected persist error: {e}")
+
+
+def viewer_id():
+    """
+    Stable id of the current viewer: the user id when logged in, else an anonymous
+    random id kept in the VIEWER_COOKIE cookie (issued by set_viewer_cookie).
+    """
+    if session.get("logged_in") and session.get("user_id"):
+        return "u:" + str(session["user_id"])
+    vid = request.cookies.get(VIEWER_COOKIE) or g.get("new_viewer_id")
+    if not vid:
+        vid = g.new_viewer_id = secrets.token_urlsafe(12)
+    return "a:" + vid
+
+
+def set_viewer_cookie(response):
+    """after_request hook: sends the anonymous viewer id issued during this request."""
+    vid = g.get("new_viewer_id")
+    if vid:
+        response.set_cookie(VIEWER_COOKIE, vid, max_age=365 * 24 * 3600, httponly=True, samesite="Lax")
+    return response
@@ -0,0 +1,135 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Per-user data read on most page views (bookmark ids, recent history ids), kept in process.
+# Each worker process has its own cache: writes made through this process update it in place,
+# anything else (another worker, the console) shows up after USER_CACHE_TTL_SEC at the latest.
+USER_CACHE_TTL_SEC = int(os.environ.get("USER_CACHE_TTL_SEC", 300))
+USER_CACHE_MAX_USERS = int(os.environ.get("USER_CACHE_MAX_USERS", 1000))
+
+
+class UserCache:
+    """
+    LRU of users (at most max_users), each holding named sections (e.g. "bookmarks") that
+    expire ttl seconds after they were loaded.
+
+    get() loads a missing / expired section with loader() outside the lock. A section
+    invalidated or updated while its load was in flight is not overwritten by the older result.
+    Values are treated as immutable: update() stores the value returned by fn, so readers
+    never see a value change under them.
+    """
+
+    def __init__(self, ttl=300, max_users=1000):
+        self._ttl = ttl
+        self._max_users = max_users
+        self._lock = threading.Lock()
+        self._users = OrderedDict()   # user_id -> {section: (value, expires_at)}
+        self._tick = 0
+        self._loading = {}            # (user_id, section) -> number of loads in flight
+        self._changed = {}            # (user_id, section) -> tick of the last change during a load
+
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.invalidations = 0
+
+    def get(self, user_id, section, loader):
+        now = time.monotonic()
+        key = (user_id, section)
+        with self._lock:
+            sections = self._users.get(user_id)
+            if sections is not None:
+                self._users.move_to_end(user_id)
+                cached = sections.get(section)
+                if cached is not None and cached[1] > now:
+                    self.hits += 1
+                    return cached[0]
+            self.misses += 1
+            self._loading[key] = self._loading.get(key, 0) + 1
+            started = self._tick
+
+        try:
+            value = loader()
+        finally:
+            with self._lock:
+                stale = self._changed.get(key, -1) > started
+                if self._loading[key] == 1:
+                    del self._loading[key]
+                    self._changed.pop(key, None)
+                else:
+                    self._loading[key] -= 1
+        if not stale:
+            with self._lock:
+                self._store(user_id, section, value, time.monotonic())
+        return value
+
+    def update(self, user_id, section, fn):
+        """Replaces a cached section with fn(value); does nothing if it is not cached (next get() loads it)."""
+        with self._lock:
+            self._mark_changed(user_id, section)
+            sections = self._users.get(user_id)
+            cached = sections.get(section) if sections is not None else None
+            if cached is None or cached[1] <= time.monotonic():
+                return
+            sections[section] = (fn(cached[0]), cached[1])
+
+    def invalidate(self, user_id, section=None):
+        """Drops one section of a user, or all of them."""
+        with self._lock:
+            sections = self._users.get(user_id)
+            names = [section] if section else set(sections or ()) | {k[1] for k in self._loading if k[0] == user_id}
+            for name in names:
+                self._mark_changed(user_id, name)
+            if sections is None:
+                return
+            self.invalidations += 1
+            if section:
+                sections.pop(section, None)
+            else:
+                del self._users[user_id]
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "users": len(self._users),
+                "max_users": self._max_users,
+                "ttl_sec": self._ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "invalidations": self.invalidations,
+            }
+
+    def _mark_changed(self, user_id, section):
+        # Only matters to loads in flight: their (older) result must not be stored
+        key = (user_id, section)
+        if key in self._loading:
+            self._tick += 1
+            self._changed[key] = self._tick
+
+    def _store(self, user_id, section, value, now):
+        sections = self._users.get(user_id)
+        if sections is None:
+            sections = self._users[user_id] = {}
+            while len(self._users) > self._max_users:
+                self._users.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._users.move_to_end(user_id)
+        sections[section] = (value, now + self._ttl)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_user_cache():
+    """Process-wide UserCache."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = UserCache(USER_CACHE_TTL_SEC, USER_CACHE_MAX_USERS)
+    return _cache
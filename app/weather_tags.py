@@ -0,0 +1,49 @@
+import re
+
+# Weather tags of an item, as a bitmask (bit i = WEATHER_TAGS[i]).
+# Computed once from the item's search_text when it is written (see app/item_fields.py),
+# so weather scoring is a table lookup per item instead of keyword scans per request.
+
+WEATHER_TAGS = ("waterproof", "outer", "windproof", "layering", "breathable")
+TAG_BITS = {tag: 1 << i for i, tag in enumerate(WEATHER_TAGS)}
+
+# Matched against lowercased text, so keywords are lowercase
+WEATHER_KEYWORDS = {
+    "waterproof": ["防水", "撥水", "ナイロン", "レイン", "waterproof", "rain"],
+    "outer": ["コート", "ダウン", "ジャケット", "アウター", "ブルゾン", "outer", "jacket"],
+    "windproof": ["防風", "ウィンド", "シェル", "レザー", "wind"],
+    "layering": ["カーディガン", "カーデ", "ベスト", "シャツ", "レイヤ", "layer", "cardigan"],
+    "breathable": ["リネン", "麻", "メッシュ", "透け", "半袖", "エアリー", "linen", "breathable", "cool"],
+}
+
+# One compiled alternation with a named group per tag, tried at every position inside a
+# lookahead so keywords may overlap (same result as `keyword in text` for each keyword).
+_MATCHER = re.compile("(?=" + "|".join(
+    f"(?P<{tag}>" + "|".join(re.escape(k) for k in sorted(WEATHER_KEYWORDS[tag], key=len, reverse=True)) + ")"
+    for tag in WEATHER_TAGS
+) + ")")
+
+
+def weather_mask(text):
+    """Lowercased text -> bitmask of the weather tags whose keywords occur in it."""
+    mask = 0
+    for m in _MATCHER.finditer(text or ""):
+        mask |= TAG_BITS[m.lastgroup]
+    return mask
+
+
+def tags_from_mask(mask):
+    return [tag for tag in WEATHER_TAGS if mask & TAG_BITS[tag]]
+
+
+def score_table(weights):
+    """
+    {tag: weight} -> list indexed by bitmask: the summed weight of the tags in each mask.
+    Built once per request (2^5 entries); scoring an item is then score[item["weather_mask"]].
+    """
+    vector = [weights.get(tag, 0) for tag in WEATHER_TAGS]
+    table = [0] * (1 << len(WEATHER_TAGS))
+    for mask in range(1, len(table)):
+        low = mask & -mask
+        table[mask] = table[mask ^ low] + vector[low.bit_length() - 1]
+    return table
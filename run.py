@@ -1,4 +1,9 @@
-from app import app
+import os
+
+from app import app, start_background_jobs
 
 if __name__ == '__main__':
+    # The debug reloader runs this file twice: jobs start only in the child that serves requests
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_jobs()
     app.run(host="0.0.0.0", port=5000, debug=True)
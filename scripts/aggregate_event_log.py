@@ -0,0 +1,171 @@
+import argparse
+import csv
+import os
+import sys
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.event_log import list_segments, iter_events, EVENT_LOG_DIR
+from app.scoring import WEIGHTS, WINDOW_DAYS, DECAY_HALF_LIFE_DAYS
+
+# Offline aggregation of the local event log (app/event_log.py).
+# Segments are streamed in chunks; each chunk is reduced with NumPy (unique + bincount on a
+# packed (item, day, type) key), so memory grows with the number of distinct keys, not events.
+#
+#   python scripts/aggregate_event_log.py                      # per-item window / decayed scores
+#   python scripts/aggregate_event_log.py --daily --item ID    # per-day counts of one item
+#   python scripts/aggregate_event_log.py --since 2026-01-01 --until 2026-01-31 --out jan.csv
+
+EVENT_TYPES = list(WEIGHTS)
+TYPE_INDEX = {e: i for i, e in enumerate(EVENT_TYPES)}
+WEIGHT_VECTOR = np.array([WEIGHTS[e] for e in EVENT_TYPES], dtype=np.float64)
+
+# Packed key: item index << 22 | day ordinal << 2 | type (day ordinals stay below 2^20 until year 2870)
+DAY_BITS = 20
+TYPE_BITS = 2
+# Local time, to match date.today() used for the Firestore counters
+UTC_OFFSET = datetime.now().astimezone().utcoffset().total_seconds()
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class Aggregator:
+    def __init__(self, as_of_ts, half_life_days, items=None):
+        self.ids = {}            # item_id -> index
+        self.id_list = []
+        self._items = set(items) if items else None
+        self._as_of_ts = as_of_ts
+        self._half_life = half_life_days * 86400
+        self._keys = np.empty(0, dtype=np.int64)
+        self._sums = np.empty(0, dtype=np.float64)
+        self.decayed = np.zeros(0, dtype=np.float64)   # per item index
+        self.events = 0
+
+    def _index(self, item_id):
+        idx = self.ids.get(item_id)
+        if idx is None:
+            idx = self.ids[item_id] = len(self.id_list)
+            self.id_list.append(item_id)
+        return idx
+
+    def add_chunk(self, rows):
+        """rows: [(ts, item_id, event_type, amount)] -> folded into the running reduction."""
+        rows = [r for r in rows if r[2] in TYPE_INDEX and (self._items is None or r[1] in self._items)]
+        if not rows:
+            return
+        self.events += len(rows)
+        ts = np.fromiter((r[0] for r in rows), dtype=np.float64, count=len(rows))
+        item = np.fromiter((self._index(r[1]) for r in rows), dtype=np.int64, count=len(rows))
+        etype = np.fromiter((TYPE_INDEX[r[2]] for r in rows), dtype=np.int64, count=len(rows))
+        amount = np.fromiter((r[3] for r in rows), dtype=np.float64, count=len(rows))
+
+        day = np.floor((ts + UTC_OFFSET) / 86400).astype(np.int64) + EPOCH_ORDINAL
+        keys = (item << (DAY_BITS + TYPE_BITS)) | (day << TYPE_BITS) | etype
+        self._fold(keys, amount)
+
+        # Decayed score at as_of (events after it are ignored)
+        live = ts <= self._as_of_ts
+        contrib = WEIGHT_VECTOR[etype] * amount * np.exp2((ts - self._as_of_ts) / self._half_life)
+        per_item = np.bincount(item[live], weights=contrib[live], minlength=len(self.id_list))
+        if len(self.decayed) < len(per_item):
+            self.decayed = np.pad(self.decayed, (0, len(per_item) - len(self.decayed)))
+        self.decayed[:len(per_item)] += per_item
+
+    def _fold(self, keys, amounts):
+        keys = np.concatenate([self._keys, keys])
+        amounts = np.concatenate([self._sums, amounts])
+        self._keys, inverse = np.unique(keys, return_inverse=True)
+        self._sums = np.bincount(inverse, weights=amounts)
+
+    def counts(self):
+        """-> (item index, day ordinal, type index, count) arrays, one entry per distinct key."""
+        keys = self._keys
+        return (keys >> (DAY_BITS + TYPE_BITS),
+                (keys >> TYPE_BITS) & ((1 << DAY_BITS) - 1),
+                keys & ((1 << TYPE_BITS) - 1),
+                self._sums)
+
+    def daily(self):
+        """-> (item index, day ordinal, counts[n, types]) per (item, day)."""
+        item, day, etype, count = self.counts()
+        item_day, inverse = np.unique((item << DAY_BITS) | day, return_inverse=True)
+        matrix = np.zeros((len(item_day), len(EVENT_TYPES)))
+        np.add.at(matrix, (inverse, etype), count)
+        return item_day >> DAY_BITS, item_day & ((1 << DAY_BITS) - 1), matrix
+
+    def per_item(self, window_start, window_end):
+        """-> (window counts[n_items, types], all-time counts[n_items, types])"""
+        item, day, etype, count = self.counts()
+        n = len(self.id_list)
+        all_time = np.zeros((n, len(EVENT_TYPES)))
+        np.add.at(all_time, (item, etype), count)
+        in_window = (day >= window_start) & (day <= window_end)
+        window = np.zeros((n, len(EVENT_TYPES)))
+        np.add.at(window, (item[in_window], etype[in_window]), count[in_window])
+        return window, all_time
+
+
+def run(args):
+    since = datetime.strptime(args.since, "%Y-%m-%d").date() if args.since else None
+    until = datetime.strptime(args.until, "%Y-%m-%d").date() if args.until else None
+    as_of = datetime.strptime(args.as_of, "%Y-%m-%d").date() if args.as_of else (until or date.today())
+    as_of_ts = datetime.combine(as_of + timedelta(days=1), datetime.min.time()).timestamp()
+
+    paths = list_segments(args.log_dir, since=since, until=until)
+    if not paths:
+        print(f"No event log segments in {args.log_dir}", file=sys.stderr)
+        return
+
+    agg = Aggregator(as_of_ts, args.half_life_days, items=args.item)
+    chunk = []
+    for event in iter_events(paths):
+        chunk.append(event)
+        if len(chunk) >= args.chunk_size:
+            agg.add_chunk(chunk)
+            chunk = []
+    agg.add_chunk(chunk)
+    print(f"{len(paths)} segments, {agg.events} events, {len(agg.id_list)} items", file=sys.stderr)
+
+    out = open(args.out, "w", newline="", encoding="utf-8") if args.out else sys.stdout
+    try:
+        writer = csv.writer(out)
+        if args.daily:
+            items, days, matrix = agg.daily()
+            scores = matrix @ WEIGHT_VECTOR
+            writer.writerow(["item_id", "date"] + EVENT_TYPES + ["score"])
+            for i in range(len(items)):
+                writer.writerow([agg.id_list[items[i]], date.fromordinal(int(days[i])).isoformat()]
+                                + [int(c) for c in matrix[i]] + [int(scores[i])])
+        else:
+            end = as_of.toordinal()
+            window, all_time = agg.per_item(end - args.window_days + 1, end)
+            window_score = window @ WEIGHT_VECTOR
+            order = np.lexsort((-agg.decayed, -window_score))
+            writer.writerow(["item_id"] + EVENT_TYPES + ["popularity_score", "decayed_score"]
+                            + [f"all_{e}" for e in EVENT_TYPES])
+            for i in order[:args.limit] if args.limit else order:
+                writer.writerow([agg.id_list[i]] + [int(c) for c in window[i]]
+                                + [int(window_score[i]), round(float(agg.decayed[i]), 3)]
+                                + [int(c) for c in all_time[i]])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-item / per-day counts and scores from the local event log")
+    parser.add_argument("--log-dir", default=EVENT_LOG_DIR)
+    parser.add_argument("--since", help="First day (YYYY-MM-DD) of segments to read")
+    parser.add_argument("--until", help="Last day (YYYY-MM-DD) of segments to read")
+    parser.add_argument("--as-of", help="Day the window / decayed scores are computed for (default: --until or today)")
+    parser.add_argument("--window-days", type=int, default=WINDOW_DAYS)
+    parser.add_argument("--half-life-days", type=float, default=DECAY_HALF_LIFE_DAYS)
+    parser.add_argument("--item", action="append", help="Only this item id (repeatable)")
+    parser.add_argument("--daily", action="store_true", help="One row per item and day instead of per item")
+    parser.add_argument("--limit", type=int, default=0, help="Top N items only (per-item mode)")
+    parser.add_argument("--chunk-size", type=int, default=200000, help="Events per NumPy reduction")
+    parser.add_argument("--out", help="CSV file (default: stdout)")
+    run(parser.parse_args())
@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.cloud.firestore_v1.field_path import FieldPath
+from app.db import get_client
+from app.item_fields import derived_fields
+
+from checkpoints import load_checkpoint, save_checkpoint, clear_checkpoint, MAX_BATCH_WRITES
+
+CHECKPOINT = "backfill_item_fields"
+
+
+def backfill(batch_size=400, dry_run=False, restart=False):
+    """
+    Writes style_tags / search_text / weather_mask / weather_tags on every item, in document-id order.
+    Progress is checkpointed after each committed batch, so an interrupted run resumes where it stopped.
+    """
+    db = get_client()
+    items_ref = db.collection('items')
+    last_id = None if restart else load_checkpoint(CHECKPOINT)
+    if last_id:
+        print(f"Resuming after {last_id}")
+
+    scanned = updated = 0
+    while True:
+        query = items_ref.order_by(FieldPath.document_id()).limit(batch_size)
+        if last_id:
+            query = query.start_after({FieldPath.document_id(): last_id})
+        docs = list(query.stream())
+        if not docs:
+            break
+
+        batch = db.batch()
+        pending = 0
+        for doc in docs:
+            data = doc.to_dict() or {}
+            fields = derived_fields(data)
+            scanned += 1
+            if all(data.get(k) == v for k, v in fields.items()):
+                continue
+            batch.update(doc.reference, fields)
+            pending += 1
+
+        if pending and not dry_run:
+            batch.commit()
+        updated += pending
+        last_id = docs[-1].id
+        if not dry_run:
+            save_checkpoint(CHECKPOINT, last_id)
+        print(f"scanned={scanned} updated={updated} last={last_id}")
+
+    if not dry_run:
+        clear_checkpoint(CHECKPOINT)
+    print(f"Done. scanned={scanned} updated={updated}{' (dry run)' if dry_run else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill derived item fields (style_tags, search_text, weather tags)")
+    parser.add_argument("--batch-size", type=int, default=400, help=f"Documents per batch (max {MAX_BATCH_WRITES})")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    backfill(batch_size=min(args.batch_size, MAX_BATCH_WRITES), dry_run=args.dry_run, restart=args.restart)
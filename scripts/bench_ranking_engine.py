@@ -0,0 +1,106 @@
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.catalog import CatalogSnapshot
+from app.item_fields import derived_fields
+from app.ranking import top_k
+from app.ranking_engine import RankingEngine
+from app.weather_tags import score_table
+
+# Benchmark for app/ranking_engine.py: per-request time of the weather recommendation
+# (weather rules + preferred styles + popularity, top 10) and of a trend label lookup (top 20),
+# against the catalog size. "loop" is the per-item Python scoring the routes used before,
+# "engine" the NumPy column version.
+#
+#   python scripts/bench_ranking_engine.py --sizes 1000 10000 100000
+
+STYLES = ["カジュアル", "きれいめ", "ストリート", "モード", "アメカジ", "ナチュラル", "フェミニン", "スポーティ",
+          "古着", "韓国", "ミリタリー", "トラッド"]
+WORDS = ["ナイロン", "ダウン", "ジャケット", "コート", "シャツ", "リネン", "メッシュ", "カーディガン", "レザー",
+         "ニット", "デニム", "パンツ", "スカート", "ベスト", "半袖", "wind", "rain", "cool", "basic", "wide"]
+CATEGORIES = ["outer", "tops", "bottoms", "onepiece", "shoes"]
+
+WEATHER_WEIGHTS = {"waterproof": 3, "outer": 3, "windproof": 2, "layering": 2, "breathable": 0}
+USER_STYLES = ["カジュアル", "きれいめ"]
+
+
+def make_items(n, rng):
+    items = {}
+    for i in range(n):
+        item = {
+            "id": f"item{i:06d}",
+            "name": " ".join(rng.sample(WORDS, 2)) + f" {i}",
+            "category": rng.choice(CATEGORIES),
+            "styles": ",".join(rng.sample(STYLES, rng.randint(1, 3))),
+            "price": rng.randint(1000, 30000),
+            "popularity_score": int(rng.paretovariate(1.2) * 10),
+        }
+        item.update(derived_fields(item))
+        items[item["id"]] = item
+    return items
+
+
+def loop_weather(items):
+    table = score_table(WEATHER_WEIGHTS)
+    styles = set(USER_STYLES)
+    top = max(1, max(it["popularity_score"] for it in items))
+
+    def score(it):
+        w = table[it["weather_mask"]]
+        if not w:
+            return 0
+        s = w + (1 if styles.intersection(it["style_tags"]) else 0)
+        return s + it["popularity_score"] / top
+
+    return top_k(items, score, 10, above=0)
+
+
+def loop_trend(items, label):
+    matched = [it for it in items if label in it["style_tags"]]
+    return top_k(matched, lambda it: it["popularity_score"], 20)
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    print(f"{'items':>8} {'build ms':>9} {'weather loop':>13} {'weather engine':>15} {'trend loop':>11} {'trend engine':>13}")
+    for n in args.sizes:
+        items = make_items(n, rng)
+        snapshot = CatalogSnapshot(items, 1)
+        item_list = list(snapshot)
+
+        engine = RankingEngine()
+        start = time.perf_counter()
+        engine.on_catalog_change(snapshot, set(items), set())
+        build_ms = (time.perf_counter() - start) * 1000
+
+        label = STYLES[0]
+        w_loop = timed(lambda: loop_weather(item_list), args.repeat)
+        w_engine = timed(lambda: engine.top(10, weather_weights=WEATHER_WEIGHTS, styles=USER_STYLES,
+                                            require_weather=True), args.repeat)
+        t_loop = timed(lambda: loop_trend(item_list, label), args.repeat)
+        t_engine = timed(lambda: engine.style_top(label, 20), args.repeat)
+        print(f"{n:>8} {build_ms:>9.1f} {w_loop:>10.2f} ms {w_engine:>12.2f} ms {t_loop:>8.2f} ms {t_engine:>10.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-request ranking time: Python loops vs NumPy ranking engine")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=20, help="Requests timed per size (median reported)")
+    parser.add_argument("--seed", type=int, default=7)
+    run(parser.parse_args())
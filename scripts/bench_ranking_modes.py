@@ -0,0 +1,191 @@
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from datetime import date
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.cloud import firestore
+from app.event_log import list_segments, iter_events
+from app.scoring import WEIGHTS, DECAY_HALF_LIFE_DAYS
+from app.stats import event_increments, _recomputed_fields
+
+# Replay benchmark for RANKING_MODE (app/ranking.py): the 7-day window score against the
+# exponentially decayed score, fed with the same event stream.
+#
+# Events come from --events (the local event log written by app/event_log.py: its directory or
+# segment files of JSON lines [epoch_seconds, item_id, event_type, amount]) or from a
+# synthetic stream: Zipf-distributed item popularity with a few items trending up or down
+# each day. Every event is applied to in-memory item_stats documents exactly as
+# write_event_counts() writes it (app/stats.py event_increments: both scores, whatever the mode),
+# and the nightly recompute runs at each midnight. The half-life is DECAY_HALF_LIFE_DAYS.
+#
+# Reported:
+#   stability   per mode: mean / worst overlap of the top-K between consecutive hourly snapshots,
+#               and the mean overlap across midnight (where the window drops a whole day)
+#   writes      shared by both modes: field updates per event, documents written by the nightly
+#               recompute, and stored fields per item
+
+DAY = 86400
+# Days as UTC date ordinals, so the midnight snapshots line up with the recompute
+EPOCH_DAY = date(1970, 1, 1).toordinal()
+
+MODES = {
+    "window": "popularity_score",
+    "decay": "decay_score",
+}
+
+
+def apply_fields(doc, fields):
+    """Applies a Firestore field update ({"a.b": value or Increment}) to a nested dict."""
+    for path, value in fields.items():
+        node = doc
+        parts = path.split(".")
+        for p in parts[:-1]:
+            node = node.setdefault(p, {})
+        if isinstance(value, firestore.Increment):
+            node[parts[-1]] = (node.get(parts[-1]) or 0) + value.value
+        else:
+            node[parts[-1]] = value
+
+
+def count_fields(node):
+    if not isinstance(node, dict):
+        return 1
+    return sum(count_fields(v) for v in node.values())
+
+
+class StoredStats:
+    """item_stats documents as the event writes and the nightly recompute leave them."""
+
+    def __init__(self):
+        self.docs = {}
+        self.events = 0
+        self.field_writes = 0
+        self.nightly_writes = 0
+
+    def add(self, item, event_type, ts, amount=1):
+        day = EPOCH_DAY + int(ts // DAY)
+        fields = event_increments(event_type, day, amount, today=day, now=ts)
+        self.events += 1
+        self.field_writes += len(fields)
+        apply_fields(self.docs.setdefault(item, {}), fields)
+
+    def roll_over(self, today):
+        """Nightly recompute: one write per document whose ring or score changed."""
+        for doc in self.docs.values():
+            fields = _recomputed_fields(doc, [], today)
+            if fields:
+                apply_fields(doc, fields)
+                self.nightly_writes += 1
+
+    def scores(self, field):
+        return {item: doc.get(field) or 0 for item, doc in self.docs.items()}
+
+    def stored_fields(self, item):
+        return count_fields(self.docs.get(item, {}))
+
+
+def synthetic_events(items, days, events_per_day, trending, seed):
+    rng = random.Random(seed)
+    base = [1.0 / (i + 1) ** 1.1 for i in range(items)]
+    types = list(WEIGHTS)
+    type_p = [0.85, 0.12, 0.03]
+    start = (int(time.time()) // DAY - days) * DAY
+    for d in range(days):
+        weights = list(base)
+        for i in rng.sample(range(items), min(trending, items)):
+            weights[i] *= rng.choice([0.1, 5.0, 20.0])
+        # Daily traffic curve: quieter at night
+        for _ in range(events_per_day):
+            hour = min(23, int(rng.triangular(0, 24, 20)))
+            ts = start + d * DAY + hour * 3600 + rng.randrange(3600)
+            yield rng.choices(range(items), weights)[0], rng.choices(types, type_p)[0], ts, 1
+
+
+def load_events(paths):
+    """(item_id, event_type, ts, amount) from event log directories and/or segment files."""
+    segments = []
+    for path in paths:
+        segments.extend(list_segments(path) if os.path.isdir(path) else [path])
+    for ts, item, event_type, amount in iter_events(segments):
+        if event_type in WEIGHTS:
+            yield item, event_type, float(ts), amount
+
+
+def top(scores, k):
+    return {item for item, _ in sorted(scores.items(), key=lambda x: (-x[1], str(x[0])))[:k]}
+
+
+def replay(events, stats, k):
+    events = sorted(events, key=lambda e: e[2])
+    if not events:
+        raise SystemExit("no events")
+    hour = int(events[0][2] // 3600)
+    prev = {name: None for name in MODES}
+    overlaps = {name: [] for name in MODES}
+    midnight = {name: [] for name in MODES}
+    cost = 0.0
+
+    def snapshot(h):
+        if h % 24 == 0:
+            stats.roll_over(EPOCH_DAY + h // 24)
+        for name, field in MODES.items():
+            cur = top(stats.scores(field), k)
+            if prev[name] is not None and cur | prev[name]:
+                overlap = len(cur & prev[name]) / k
+                overlaps[name].append(overlap)
+                if h % 24 == 0:
+                    midnight[name].append(overlap)
+            prev[name] = cur
+
+    for item, event_type, ts, amount in events:
+        while ts >= (hour + 1) * 3600:
+            hour += 1
+            snapshot(hour)
+        t0 = time.perf_counter()
+        stats.add(item, event_type, ts, amount)
+        cost += time.perf_counter() - t0
+    snapshot(hour + 1)
+    return len(events), overlaps, midnight, cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare window and decayed popularity ranking on a replayed event stream")
+    parser.add_argument("--events", nargs="+", help="Event log directory or segment files (app/event_log.py); "
+                                                    "synthetic stream if omitted")
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=21)
+    parser.add_argument("--events-per-day", type=int, default=20000)
+    parser.add_argument("--trending", type=int, default=20, help="Items whose traffic changes each day")
+    parser.add_argument("--top", type=int, default=24, help="K (home feed page size)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.events:
+        events = list(load_events(args.events))
+    else:
+        events = list(synthetic_events(args.items, args.days, args.events_per_day, args.trending, args.seed))
+
+    stats = StoredStats()
+    n, overlaps, midnight, cost = replay(events, stats, args.top)
+    items = {e[0] for e in events}
+
+    print(f"events={n} items={len(items)} top-K={args.top} half-life={DECAY_HALF_LIFE_DAYS}d")
+    print(f"{'mode':>7} {'mean overlap':>13} {'worst':>7} {'midnight':>9}")
+    for name in MODES:
+        o = overlaps[name]
+        mid = midnight[name]
+        print(f"{name:>7} {sum(o) / max(1, len(o)):>13.3f} {min(o, default=math.nan):>7.3f} "
+              f"{sum(mid) / max(1, len(mid)):>9.3f}")
+    stored = sum(stats.stored_fields(i) for i in items) / max(1, len(items))
+    print(f"writes (both modes): fields/event={stats.field_writes / max(1, stats.events):.1f} "
+          f"nightly writes={stats.nightly_writes} fields/item={stored:.1f} us/event={cost / n * 1e6:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import random
+import threading
+import time
+
+# Benchmark for STATS_SHARDS (app/stats.py): throughput of increments on one hot item
+# against the number of counter shards, using a local stand-in for Firestore.
+#
+# The stand-in models the per-document write limit: each document accepts one write per
+# `doc_interval` seconds; a writer that cannot get its turn within `contention_timeout`
+# gets a contention error (as Firestore's ABORTED / "too much contention"). Time is scaled
+# so that 1 simulated second = doc_interval * 1 real second.
+
+# Same layout as app/stats.py: item_stats/<id>, shards in item_stats/<id>/counter_shards/<k>
+STATS_COLLECTION = "item_stats"
+SHARD_COLLECTION = "counter_shards"
+HOT_ITEM = f"{STATS_COLLECTION}/hot"
+
+
+class ContentionError(Exception):
+    pass
+
+
+class LocalDocStore:
+    """In-memory documents with a sustained per-document write rate."""
+
+    def __init__(self, doc_interval, contention_timeout):
+        self._doc_interval = doc_interval
+        self._contention_timeout = contention_timeout
+        self._lock = threading.Lock()
+        self._docs = {}        # path -> {"count": n}
+        self._next_free = {}   # path -> monotonic time the document accepts its next write
+
+    def increment(self, path, amount=1):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_free.get(path, now))
+            if start - now > self._contention_timeout:
+                raise ContentionError(path)
+            self._next_free[path] = start + self._doc_interval
+        # Wait for our turn on the document (outside the store lock)
+        delay = start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        with self._lock:
+            doc = self._docs.setdefault(path, {"count": 0})
+            doc["count"] += amount
+
+    def sum_prefix(self, prefix):
+        with self._lock:
+            return sum(d["count"] for p, d in self._docs.items() if p.startswith(prefix))
+
+
+def run(shards, writers, duration, doc_interval, contention_timeout):
+    store = LocalDocStore(doc_interval, contention_timeout)
+    ok = [0] * writers
+    errors = [0] * writers
+    stop_at = time.monotonic() + duration
+
+    def writer(idx):
+        while time.monotonic() < stop_at:
+            if shards > 0:
+                path = f"{HOT_ITEM}/{SHARD_COLLECTION}/{random.randrange(shards)}"
+            else:
+                path = HOT_ITEM
+            try:
+                store.increment(path)
+                ok[idx] += 1
+            except ContentionError:
+                errors[idx] += 1
+                # client-side backoff before retrying
+                time.sleep(doc_interval * random.uniform(0.5, 1.5))
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    total_ok = sum(ok)
+    aggregated = store.sum_prefix(HOT_ITEM)
+    assert aggregated == total_ok, (aggregated, total_ok)
+    sim_seconds = duration / doc_interval
+    return {
+        "shards": shards,
+        "writes": total_ok,
+        "errors": sum(errors),
+        "writes_per_sim_sec": total_ok / sim_seconds,
+        "error_rate": sum(errors) / max(1, total_ok + sum(errors)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded counter throughput against shard count (local stand-in datastore)")
+    parser.add_argument("--shards", default="0,1,2,5,10,20", help="Comma separated shard counts (0 = item document)")
+    parser.add_argument("--writers", type=int, default=32, help="Concurrent writer threads")
+    parser.add_argument("--duration", type=float, default=2.0, help="Real seconds per run")
+    parser.add_argument("--doc-interval", type=float, default=0.01,
+                        help="Real seconds per document write (stands for Firestore's ~1 write/sec/doc)")
+    parser.add_argument("--contention-timeout", type=float, default=0.05,
+                        help="Max real seconds a write may queue before a contention error")
+    args = parser.parse_args()
+
+    print(f"{'shards':>6} {'writes':>8} {'errors':>8} {'writes/s (sim)':>15} {'error rate':>11}")
+    for n in [int(x) for x in args.shards.split(",")]:
+        r = run(n, args.writers, args.duration, args.doc_interval, args.contention_timeout)
+        print(f"{r['shards']:>6} {r['writes']:>8} {r['errors']:>8} {r['writes_per_sim_sec']:>15.2f} {r['error_rate']:>11.1%}")
+
+
+if __name__ == "__main__":
+    main()
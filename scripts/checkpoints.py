@@ -0,0 +1,42 @@
+import os
+
+# Shared by the resumable backfill / migration scripts: they walk a collection in document-id
+# order, commit in batches and record the last committed id in instance/<name>.checkpoint,
+# so an interrupted run resumes where it stopped.
+#
+#   from checkpoints import load_checkpoint, save_checkpoint, clear_checkpoint, MAX_BATCH_WRITES
+
+INSTANCE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'instance'))
+
+# Firestore batches are limited to 500 writes
+MAX_BATCH_WRITES = 500
+
+
+def checkpoint_file(name):
+    return os.path.join(INSTANCE_DIR, f"{name}.checkpoint")
+
+
+def load_checkpoint(name):
+    """Last committed document id of the named run, or None."""
+    try:
+        with open(checkpoint_file(name), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(name, doc_id):
+    os.makedirs(INSTANCE_DIR, exist_ok=True)
+    path = checkpoint_file(name)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(doc_id)
+    os.replace(tmp, path)
+
+
+def clear_checkpoint(name):
+    """Called once a run completed: the next run starts from the beginning."""
+    try:
+        os.remove(checkpoint_file(name))
+    except FileNotFoundError:
+        pass
@@ -1,5 +1,6 @@
 import argparse
 import json
+import sys
 from pathlib import Path
 from typing import List
 
@@ -7,12 +8,17 @@ import firebase_admin
 from firebase_admin import credentials, firestore
 
 BASE_DIR = Path(__file__).resolve().parents[1]
+# Append project root to path
+sys.path.append(str(BASE_DIR))
+
+from app.item_fields import derived_fields
+from app.open_meteo import DEFAULT_LOCATION
+from app.ranking import top_k
+
 CONFIG_PATH = BASE_DIR / "config" / "serviceAccountKey.json"
 DATA_DIR = BASE_DIR / "github_pages" / "data"
 INSTANCE_DIR = BASE_DIR / "instance"
 
-ITEM_FIELDS = ["name", "price", "image_url", "imageUrl", "shop_url", "detail_url", "category", "styles", "description", "notes"]
-
 
 def init_firestore():
     if not firebase_admin._apps:
@@ -35,29 +41,11 @@ def normalize_styles(value) -> List[str]:
     return sorted(set(styles))
 
 
-def infer_weather_tags(item_dict) -> List[str]:
-    corpus = " ".join(str(item_dict.get(field, "")) for field in ITEM_FIELDS).lower()
-
-    def contains(keywords):
-        return any(word in corpus for word in keywords)
-
-    tags = []
-    if contains(["撥水", "防水", "waterproof", "レイン", "rain"]):
-        tags.append("waterproof")
-    if contains(["防風", "wind", "シェル", "シェル"]):
-        tags.append("windproof")
-    if contains(["コート", "アウター", "ジャケット", "ブルゾン"]):
-        tags.append("outer")
-    if contains(["レイヤ", "layer", "ベスト", "カーデ", "cardigan"]):
-        tags.append("layering")
-    if contains(["メッシュ", "透け", "breathable", "リネン", "linen", "エアリー"]):
-        tags.append("breathable")
-    return sorted(set(tags))
-
-
 def serialize_item(doc):
     data = doc.to_dict() or {}
-    styles = normalize_styles(data.get("styles"))
+    # style_tags is the canonical list written by the admin routes / backfill script;
+    # fall back to parsing the raw field for documents that have not been backfilled.
+    styles = sorted(set(data["style_tags"])) if "style_tags" in data else normalize_styles(data.get("styles"))
     item = {
         "id": doc.id,
         "name": data.get("name", ""),
@@ -65,19 +53,29 @@ def serialize_item(doc):
         "image_url": data.get("image_url") or data.get("imageUrl"),
         "detail_url": data.get("shop_url") or data.get("detail_url") or "#",
         "styles": styles,
-        "weather_tags": infer_weather_tags(data),
+        # Stored at create/edit time by the shared classifier (app/weather_tags.py)
+        "weather_tags": list(data["weather_tags"]) if "weather_tags" in data else derived_fields(data)["weather_tags"],
         "popularity": data.get("popularity_score") or data.get("popularity", 0)
     }
     return item
 
 
+def _rank(item):
+    # Same order as app/ranking.rank_key: popularity desc, then name desc
+    return (item.get("popularity") or 0, item.get("name", ""))
+
+
+def _popularity(item):
+    return item.get("popularity") or 0
+
+
 def fetch_items(db, limit=None):
     docs = db.collection("items").stream()
-    items = [serialize_item(doc) for doc in docs]
-    items.sort(key=lambda x: (x.get("popularity") or 0, x.get("name", "")), reverse=True)
+    items = (serialize_item(doc) for doc in docs)
     if limit:
-        return items[:limit]
-    return items
+        # Heap-based top-K instead of sorting the whole catalog for a prefix
+        return top_k(items, _popularity, limit)
+    return sorted(items, key=_rank, reverse=True)
 
 
 def write_json(path: Path, payload):
@@ -92,6 +90,9 @@ def export_weather_cache():
         print("[warn] weather_cache.json not found; skipping weather export")
         return
     data = json.loads(src.read_text(encoding="utf-8"))
+    if "locations" in data:
+        # Multi-location cache: the static site shows the default location
+        data = data["locations"].get(DEFAULT_LOCATION) or next(iter(data["locations"].values()), {})
     write_json(DATA_DIR / "weather.json", data)
 
 
@@ -0,0 +1,85 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.cloud.firestore_v1.field_path import FieldPath
+from app.db import get_client
+from app.history import to_timestamp, EPOCH
+from app.stats import BatchWriter
+
+from checkpoints import load_checkpoint, save_checkpoint, clear_checkpoint
+
+CHECKPOINT = "migrate_history_timestamps"
+
+
+def legacy_timestamp(val):
+    """Old viewed_at values: ISO strings without an offset were written with the server's local datetime.now()."""
+    if isinstance(val, str):
+        try:
+            parsed = datetime.fromisoformat(val)
+        except ValueError:
+            return None
+        if parsed.tzinfo is None:
+            parsed = parsed.astimezone()
+        return parsed
+    return to_timestamp(val)
+
+
+def migrate(page_size=100, dry_run=False, restart=False):
+    """
+    Rewrites every users/<id>/history viewed_at that is not a Firestore timestamp (ISO strings,
+    missing values) as one, so order_by('viewed_at').limit(N) returns the latest views.
+    Unreadable values become 1970-01-01 (they sort last and are trimmed first).
+    Users are processed in id order and checkpointed, so an interrupted run resumes.
+    """
+    db = get_client()
+    users_ref = db.collection('users')
+    last_id = None if restart else load_checkpoint(CHECKPOINT)
+    if last_id:
+        print(f"Resuming after {last_id}")
+
+    # Dry run: count only
+    writer = None if dry_run else BatchWriter(db)
+    users = fixed = 0
+    while True:
+        query = users_ref.order_by(FieldPath.document_id()).limit(page_size)
+        if last_id:
+            query = query.start_after({FieldPath.document_id(): last_id})
+        user_docs = list(query.select([]).stream())
+        if not user_docs:
+            break
+
+        for u in user_docs:
+            for h in u.reference.collection('history').stream():
+                viewed_at = (h.to_dict() or {}).get('viewed_at')
+                if isinstance(viewed_at, datetime):
+                    continue
+                fixed += 1
+                if writer is not None:
+                    writer.update(h.reference, {"viewed_at": legacy_timestamp(viewed_at) or EPOCH})
+        # Everything of this page is committed before its checkpoint
+        if writer is not None:
+            writer.commit()
+        users += len(user_docs)
+        last_id = user_docs[-1].id
+        if not dry_run:
+            save_checkpoint(CHECKPOINT, last_id)
+        print(f"users={users} fixed={fixed} last={last_id}")
+
+    if not dry_run:
+        clear_checkpoint(CHECKPOINT)
+    print(f"Done. users={users} fixed={fixed}{' (dry run)' if dry_run else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert history viewed_at values to Firestore timestamps")
+    parser.add_argument("--page-size", type=int, default=100, help="Users per page")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    migrate(page_size=args.page_size, dry_run=args.dry_run, restart=args.restart)
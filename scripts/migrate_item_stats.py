@@ -0,0 +1,99 @@
+import argparse
+import os
+import sys
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+from app.db import get_client
+from app.stats import legacy_stats_increments, STATS_COLLECTION, nest_fields
+
+from checkpoints import load_checkpoint, save_checkpoint, clear_checkpoint, MAX_BATCH_WRITES
+
+CHECKPOINT = "migrate_item_stats"
+
+# Fields that move from items/<id> to item_stats/<id> (popularity_score / decay_score stay as the denormalized score;
+# decay_ts is only removed: nothing reads it any more)
+MOVED_FIELDS = ["stats", "ring", "ring_day", "totals", "decay_ts", "decay_score_shards"]
+READ_FIELDS = MOVED_FIELDS + ["decay_score"]
+
+# Two writes per item (stats document + item)
+MAX_BATCH_ITEMS = MAX_BATCH_WRITES // 2
+
+
+def add_moves(db, batch, doc):
+    """Queues the move of one item's stats fields. Returns False if there is nothing to move."""
+    data = doc.to_dict() or {}
+    if not any(k in data for k in MOVED_FIELDS):
+        return False
+    increments = legacy_stats_increments(data)
+    stats = nest_fields(increments)
+    stats["updated_at"] = firestore.SERVER_TIMESTAMP
+    # Increments merge with counts written by the new event path in the meantime
+    batch.set(db.collection(STATS_COLLECTION).document(doc.id), stats, merge=True)
+    # Precondition: if the item changed since we read it, the whole batch fails and is retried
+    batch.update(doc.reference,
+                 {k: firestore.DELETE_FIELD for k in MOVED_FIELDS if k in data},
+                 option=db.write_option(last_update_time=doc.update_time))
+    return True
+
+
+def migrate(batch_size=200, dry_run=False, restart=False):
+    """
+    Moves per-item event counters into item_stats/<id>, in document-id order.
+    Stats and item writes for an item are in the same batch, so an item is never counted twice;
+    progress is checkpointed after each committed batch and an interrupted run resumes where it stopped.
+    Once done, sync_item_scores() writes the score back onto the items.
+    """
+    db = get_client()
+    items_ref = db.collection('items')
+    last_id = None if restart else load_checkpoint(CHECKPOINT)
+    if last_id:
+        print(f"Resuming after {last_id}")
+
+    scanned = moved = 0
+    while True:
+        query = items_ref.order_by(FieldPath.document_id()).limit(batch_size)
+        if last_id:
+            query = query.start_after({FieldPath.document_id(): last_id})
+        docs = list(query.select(READ_FIELDS).stream())
+        if not docs:
+            break
+
+        batch = db.batch()
+        pending = sum(1 for doc in docs if add_moves(db, batch, doc))
+        if pending and not dry_run:
+            try:
+                batch.commit()
+            except Exception as e:
+                # Most likely an item written in between: redo this page one item at a time
+                print(f"Batch failed ({e}), retrying items one by one")
+                refs = [doc.reference for doc in docs]
+                pending = 0
+                for doc in db.get_all(refs, field_paths=READ_FIELDS):
+                    single = db.batch()
+                    if doc.exists and add_moves(db, single, doc):
+                        single.commit()
+                        pending += 1
+        scanned += len(docs)
+        moved += pending
+        last_id = docs[-1].id
+        if not dry_run:
+            save_checkpoint(CHECKPOINT, last_id)
+        print(f"scanned={scanned} moved={moved} last={last_id}")
+
+    if not dry_run:
+        clear_checkpoint(CHECKPOINT)
+    print(f"Done. scanned={scanned} moved={moved}{' (dry run)' if dry_run else ''}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move event counters from items into the item_stats collection")
+    parser.add_argument("--batch-size", type=int, default=200, help=f"Items per batch (max {MAX_BATCH_ITEMS})")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would move")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint")
+    args = parser.parse_args()
+
+    migrate(batch_size=min(args.batch_size, MAX_BATCH_ITEMS), dry_run=args.dry_run, restart=args.restart)
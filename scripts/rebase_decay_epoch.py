@@ -0,0 +1,92 @@
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.cloud.firestore_v1.field_path import FieldPath
+from app.db import get_client
+from app.stats import BatchWriter, DECAY_EPOCH, DECAY_HALF_LIFE_DAYS, STATS_COLLECTION, SHARD_COLLECTION
+
+# Moves every stored forward-decayed score (app/stats.py) from the current DECAY_EPOCH to a later
+# one, before the scores reach their bound: each value is multiplied by 2^-((new - old) / half_life),
+# which keeps the ranking and decay_value() unchanged.
+#
+#   1. stop the app (event writes in flight would still use the old epoch; the event spool keeps
+#      raw counts, so it is replayed correctly after the restart)
+#   2. python scripts/rebase_decay_epoch.py --epoch 2030-01-01
+#   3. set DECAY_EPOCH to the printed value and start the app
+#
+# Each rescaled document is stamped with decay_epoch, so an interrupted run is simply run again.
+
+PAGE_SIZE = 300
+
+
+def parse_epoch(value):
+    """Epoch seconds or a YYYY-MM-DD date (UTC midnight)."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def rescale(db, query, fields, factor, new_epoch, dry_run):
+    """Multiplies `fields` of every document of query by factor. -> (scanned, rescaled)"""
+    writer = None if dry_run else BatchWriter(db)
+    scanned = rescaled = 0
+    last = None
+    while True:
+        page = query.order_by(FieldPath.document_id()).limit(PAGE_SIZE)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.select(fields + ["decay_epoch"]).stream())
+        if not docs:
+            break
+        for doc in docs:
+            data = doc.to_dict() or {}
+            scanned += 1
+            if data.get("decay_epoch") == new_epoch:
+                continue  # done by an earlier run
+            update = {f: data[f] * factor for f in fields if data.get(f)}
+            if not update:
+                continue
+            update["decay_epoch"] = new_epoch
+            rescaled += 1
+            if writer is not None:
+                writer.update(doc.reference, update)
+        last = docs[-1]
+        if writer is not None:
+            writer.commit()
+    return scanned, rescaled
+
+
+def rebase(new_epoch, dry_run=False):
+    if new_epoch <= DECAY_EPOCH:
+        raise SystemExit(f"--epoch must be later than the current DECAY_EPOCH ({DECAY_EPOCH:.0f})")
+    factor = 2.0 ** (-(new_epoch - DECAY_EPOCH) / (DECAY_HALF_LIFE_DAYS * 86400))
+    print(f"DECAY_EPOCH {DECAY_EPOCH:.0f} -> {new_epoch:.0f} (scores x {factor:.6g})")
+
+    db = get_client()
+    targets = [
+        ("item_stats", db.collection(STATS_COLLECTION), ["decay_score", "decay_score_shards"]),
+        ("counter shards", db.collection_group(SHARD_COLLECTION), ["decay_score"]),
+        ("items", db.collection('items'), ["decay_score"]),
+    ]
+    for name, query, fields in targets:
+        scanned, rescaled = rescale(db, query, fields, factor, new_epoch, dry_run)
+        print(f"{name}: scanned={scanned} rescaled={rescaled}{' (dry run)' if dry_run else ''}")
+
+    if not dry_run:
+        print(f"Done. Start the app with DECAY_EPOCH={new_epoch:.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebase the forward-decayed scores onto a later DECAY_EPOCH")
+    parser.add_argument("--epoch", default=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+                        help="New epoch: YYYY-MM-DD (UTC) or epoch seconds (default: today)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+
+    rebase(parse_epoch(args.epoch), dry_run=args.dry_run)
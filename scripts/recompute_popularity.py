@@ -0,0 +1,25 @@
+import argparse
+import os
+import sys
+
+# Append project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.stats import recompute_popularity, RECOMPUTE_PAGE_SIZE
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute popularity_score for every item (same job as the nightly scheduler run)")
+    parser.add_argument("--page-size", type=int, default=RECOMPUTE_PAGE_SIZE, help="Items read per page")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and start from the first item")
+    parser.add_argument("--force", action="store_true", help="Run again even if today's run already finished")
+    args = parser.parse_args()
+
+    try:
+        print("Recomputing popularity scores...")
+        recompute_popularity(page_size=args.page_size, restart=args.restart, force=args.force)
+        print("Done.")
+    except Exception as e:
+        print(f"Error: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Project root on the path (same as the scripts' sys.path.append)
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
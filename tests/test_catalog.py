@@ -0,0 +1,76 @@
+import time
+
+from app.catalog import ItemCatalog
+
+
+class _Doc:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data)
+
+
+class _FlakyCollection:
+    """stream() fails `failures` times, then returns the docs. No on_snapshot support."""
+
+    def __init__(self, docs, failures):
+        self.docs = docs
+        self.failures = failures
+        self.calls = 0
+
+    def stream(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RuntimeError("firestore unavailable")
+        return [_Doc(doc_id, data) for doc_id, data in self.docs.items()]
+
+    def on_snapshot(self, callback):
+        raise RuntimeError("no listener in tests")
+
+
+class _Client:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def collection(self, name):
+        return self._collection
+
+
+def _wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_first_load_failure_is_retried_in_background():
+    col = _FlakyCollection({"a": {"name": "A", "styles": "casual"}}, failures=2)
+    catalog = ItemCatalog(client_factory=lambda: _Client(col), poll_sec=1, use_listener=True)
+    try:
+        snap = catalog.snapshot()
+        assert len(snap) == 0
+        assert not catalog.is_loaded()
+        assert catalog.mode == "loading"
+        assert catalog._thread is not None and catalog._thread.is_alive()
+
+        assert _wait_for(catalog.is_loaded)
+        assert catalog.snapshot().get("a")["name"] == "A"
+        assert catalog.mode == "polling"
+        assert col.calls == 3
+    finally:
+        catalog.stop()
+
+
+def test_successful_first_load_starts_polling():
+    col = _FlakyCollection({"a": {"name": "A"}}, failures=0)
+    catalog = ItemCatalog(client_factory=lambda: _Client(col), poll_sec=60, use_listener=False)
+    try:
+        assert "a" in catalog.snapshot()
+        assert catalog.is_loaded()
+        assert catalog.mode == "polling"
+    finally:
+        catalog.stop()
@@ -0,0 +1,98 @@
+import glob
+import json
+import os
+
+from app.event_buffer import EventBuffer
+
+
+class _FlakyFlush:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, counts):
+        self.calls.append(dict(counts))
+        if len(self.calls) <= self.failures:
+            raise RuntimeError("firestore unavailable")
+
+
+def _spool_files(spool_dir):
+    return sorted(glob.glob(os.path.join(spool_dir, "events-*.log")))
+
+
+def _open_fds():
+    return len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+
+
+def _buffer(flush_fn, spool_dir):
+    # Long flush_sec: the tests drive flush() themselves
+    buf = EventBuffer(flush_fn, str(spool_dir), flush_sec=3600)
+    buf.start()
+    return buf
+
+
+def test_failing_flushes_keep_one_active_spool(tmp_path):
+    flush = _FlakyFlush(failures=3)
+    buf = _buffer(flush, tmp_path)
+    try:
+        buf.add("a", "view", 1, 1)
+        fds = _open_fds()
+        for i in range(3):
+            buf.flush()
+            buf.add("b", "view", 1, 1)
+        # One sealed segment from the first attempt + the active spool, no new files per retry
+        assert len(_spool_files(tmp_path)) == 2
+        assert _open_fds() == fds
+        assert buf.flush_failures == 3
+        # Every retry sends the same sealed counts; later events wait in the active spool
+        assert all(c == {("a", "view", 1): 1} for c in flush.calls)
+
+        buf.flush()
+        assert len(_spool_files(tmp_path)) == 1
+        buf.flush()
+        assert flush.calls[-1] == {("b", "view", 1): 3}
+        assert buf.metrics()["pending_keys"] == 0
+    finally:
+        buf._stop.set()
+        buf._wake.set()
+
+
+def test_replays_segments_of_dead_process(tmp_path):
+    # Above pid_max: never a running process
+    path = tmp_path / "events-999999999-1.log"
+    path.write_text(json.dumps(["a", "view", 1, 2]) + "\n" + '["a", "vi', encoding="utf-8")
+    flush = _FlakyFlush(failures=0)
+    buf = _buffer(flush, tmp_path)
+    try:
+        assert not path.exists()
+        buf.flush()
+        assert flush.calls == [{("a", "view", 1): 2}]
+        assert len(_spool_files(tmp_path)) == 1
+    finally:
+        buf._stop.set()
+        buf._wake.set()
+
+
+class _FullDisk:
+    def write(self, data):
+        raise OSError(28, "No space left on device")
+
+    def flush(self):
+        pass
+
+
+def test_spool_write_error_does_not_fail_add(tmp_path):
+    flush = _FlakyFlush(failures=0)
+    buf = _buffer(flush, tmp_path)
+    try:
+        path, f = buf._spool
+        f.close()
+        buf._spool = (path, _FullDisk())
+
+        assert buf.add("a", "view", 1, 1) is True
+        assert buf.metrics()["spool_errors"] == 1
+        # Still counted in memory and flushed
+        assert buf.metrics()["pending_keys"] == 1
+    finally:
+        buf._stop.set()
+        buf._wake.set()
@@ -0,0 +1,106 @@
+import random
+from types import MappingProxyType
+
+import pytest
+
+from app import app as flask_app
+from app import feed
+from app.feed import card, feed_page, FeedCursorError
+from app.search_index import SearchIndex
+from app.style_index import StyleIndex
+
+
+def _frozen(**fields):
+    # Catalog items are read-only mappings with tuple values (app/catalog.py)
+    return MappingProxyType(fields)
+
+
+def test_style_badge_is_the_same_on_first_page_and_feed_pages():
+    items = [
+        _frozen(id="a", name="A", styles=("カジュアル", "きれいめ"), style_tags=("カジュアル", "きれいめ")),
+        _frozen(id="b", name="B", styles="ストリート, モード"),
+        _frozen(id="c", name="C"),
+    ]
+    template = flask_app.jinja_env.from_string("{{ item|style_label }}")
+    for item in items:
+        assert template.render(item=item) == card(item)["styles"]
+    assert card(items[0])["styles"] == "カジュアル,きれいめ"
+    assert card(items[1])["styles"] == "ストリート,モード"
+    assert card(items[2])["styles"] == ""
+
+
+class _Catalog:
+    def __init__(self, items):
+        self.items = items
+
+    def snapshot(self):
+        return self.items
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    rng = random.Random(11)
+    items = {}
+    for i in range(200):
+        items[str(i)] = {
+            "id": str(i),
+            "name": rng.choice(["ニット", "コート", "ニットコート", "デニム"]),
+            "category": rng.choice(["tops", "outer", "ニット"]),
+            "style_tags": tuple(rng.sample(["カジュアル", "ニット", "モード"], rng.randint(0, 2))),
+            "popularity_score": rng.randint(0, 3),
+        }
+    search, styles = SearchIndex(), StyleIndex()
+    search.on_catalog_change(items, list(items), [])
+    styles.on_catalog_change(items, set(items), set())
+    monkeypatch.setattr(feed, "get_catalog", lambda: _Catalog(items))
+    monkeypatch.setattr(feed, "get_search_index", lambda: search)
+    monkeypatch.setattr(feed, "get_style_index", lambda: styles)
+    return items
+
+
+def _all_pages(limit, **kwargs):
+    ids, cursor = [], None
+    while True:
+        items, cursor = feed_page("secret", cursor=cursor, limit=limit, **kwargs)
+        assert len(items) <= limit
+        ids += [it["id"] for it in items]
+        if cursor is None:
+            return ids
+
+
+def _tier(q, item):
+    if q in item["style_tags"]:
+        return 3
+    if q in item["name"]:
+        return 2
+    if q in item["category"]:
+        return 1
+    return 0 if any(q in s for s in item["style_tags"]) else None
+
+
+def test_feed_pages_concatenate_to_the_full_sort(catalog):
+    for styles in (None, ["モード"], ["カジュアル", "ニット"]):
+        matched = [it for it in catalog.values() if not styles or set(styles) & set(it["style_tags"])]
+        expected = [it["id"] for it in sorted(
+            matched, key=lambda it: (it["popularity_score"], it["name"], it["id"]), reverse=True)]
+        for limit in (1, 7, 24, 500):
+            assert _all_pages(limit, styles=styles) == expected
+
+
+def test_search_pages_concatenate_across_match_tiers(catalog):
+    # "ニット" is a tag, a name and a category substring: pages cross every tier boundary
+    for q in ("ニット", "コート", "t"):
+        scored = [(_tier(q, it), it) for it in catalog.values()]
+        expected = [it["id"] for _, it in sorted(
+            ((t, it) for t, it in scored if t is not None),
+            key=lambda x: (x[0], x[1]["popularity_score"], x[1]["name"], x[1]["id"]), reverse=True)]
+        for limit in (1, 5, 24):
+            assert _all_pages(limit, search_query=q) == expected
+
+
+def test_cursor_of_another_feed_is_rejected(catalog):
+    _, cursor = feed_page("secret", styles=["モード"], limit=1)
+    with pytest.raises(FeedCursorError):
+        feed_page("secret", search_query="ニット", cursor=cursor)
+    with pytest.raises(FeedCursorError):
+        feed_page("other-secret", styles=["モード"], cursor=cursor)
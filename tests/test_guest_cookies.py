@@ -0,0 +1,54 @@
+from flask import g
+
+from app import app as flask_app
+from app import guest_cookies
+from app.guest_cookies import (decode_bookmarks, decode_history, encode_bookmarks, encode_history,
+                               set_guest_bookmarks, GUEST_BOOKMARKS_MAX)
+
+SECRET = "test-secret"
+
+IDS = [
+    "AbCdEfGhIjKlMnOpQrSt",          # Firestore auto id
+    "12345",                          # decimal
+    "0123",                           # leading zero: stored as text
+    "コート-ネイビー-M",                # non-ASCII
+    "x" * 127,                        # longest short-form id
+    "y" * 128,                        # needs the length varint
+    "商品" * 200,                      # 1200 UTF-8 bytes
+]
+
+
+def test_history_round_trips_ids_of_any_length():
+    entries = [(item_id, 1760000000 - i * 3600) for i, item_id in enumerate(IDS)]
+
+    token, kept = encode_history(SECRET, entries)
+
+    assert kept == len(entries)
+    assert decode_history(SECRET, token) == entries
+
+
+def test_bookmarks_round_trip_ids_of_any_length():
+    token, kept = encode_bookmarks(SECRET, IDS)
+
+    assert kept == len(IDS)
+    assert decode_bookmarks(SECRET, token) == IDS
+
+
+def test_oversized_bookmarks_keep_the_newest_and_say_so():
+    item_ids = [f"{i:03d}-" + "長い商品ID" * 10 for i in range(GUEST_BOOKMARKS_MAX)]
+
+    token, kept = encode_bookmarks(SECRET, item_ids)
+
+    assert 0 < kept < len(item_ids)
+    assert len(token) <= guest_cookies.GUEST_COOKIE_MAX_BYTES
+    assert decode_bookmarks(SECRET, token) == item_ids[-kept:]
+
+    before = guest_cookies.cookie_metrics()
+    with flask_app.test_request_context():
+        resp = flask_app.response_class()
+        assert set_guest_bookmarks(resp, item_ids) == kept
+        # The rest of the request sees what the cookie holds
+        assert g.guest_cookies[guest_cookies.BOOKMARKS_COOKIE] == item_ids[-kept:]
+    after = guest_cookies.cookie_metrics()
+    assert after["bookmarks_truncated"] == before["bookmarks_truncated"] + 1
+    assert after["entries_dropped"] == before["entries_dropped"] + len(item_ids) - kept
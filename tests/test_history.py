@@ -0,0 +1,193 @@
+import sys
+
+from app.history import _trim
+from app import stats
+
+# app/__init__.py defines a history() view, which shadows the module attribute on the package
+history = sys.modules["app.history"]
+
+
+class _Ref:
+    def __init__(self, store, doc_id):
+        self.store = store
+        self.id = doc_id
+
+
+class _Doc:
+    def __init__(self, ref):
+        self.reference = ref
+
+
+class _Count:
+    def __init__(self, value):
+        self.value = value
+
+
+class _Query:
+    """order_by/limit/select/stream/count over a dict of docs, like Firestore: ordering on a
+    field leaves out the documents that don't have it."""
+
+    def __init__(self, store, field=None, limit=None):
+        self.store = store
+        self._field = field
+        self._limit = limit
+
+    def order_by(self, field):
+        return _Query(self.store, field, self._limit)
+
+    def limit(self, n):
+        return _Query(self.store, self._field, n)
+
+    def select(self, fields):
+        return self
+
+    def _ids(self):
+        ids = list(self.store)
+        if self._field:
+            ids = sorted((i for i in ids if self._field in self.store[i]), key=lambda i: self.store[i][self._field])
+        return ids[:self._limit] if self._limit is not None else ids
+
+    def stream(self):
+        return [_Doc(_Ref(self.store, i)) for i in self._ids()]
+
+    def count(self):
+        n = len(self._ids())
+        return type("Agg", (), {"get": lambda _self: [[_Count(n)]]})()
+
+
+class _Batch:
+    def __init__(self):
+        self.deletes = []
+
+    def delete(self, ref):
+        self.deletes.append(ref)
+
+    def commit(self):
+        for ref in self.deletes:
+            ref.store.pop(ref.id, None)
+
+
+class _Db:
+    def batch(self):
+        return _Batch()
+
+
+def test_trim_keeps_newest_and_ignores_entries_without_viewed_at():
+    docs = {f"v{i}": {"viewed_at": i} for i in range(10)}
+    docs.update({"legacy1": {}, "legacy2": {}})
+
+    deleted = _trim(_Db(), _Query(docs), keep=4)
+
+    assert deleted == 6
+    assert sorted(k for k in docs if k.startswith("v")) == ["v6", "v7", "v8", "v9"]
+    assert "legacy1" in docs and "legacy2" in docs
+
+
+def test_trim_pages_by_batch_limit(monkeypatch):
+    monkeypatch.setattr(history, "MAX_BATCH_WRITES", 3)
+    monkeypatch.setattr(stats, "MAX_BATCH_WRITES", 3)
+    docs = {f"v{i:02d}": {"viewed_at": i} for i in range(20)}
+
+    assert _trim(_Db(), _Query(docs), keep=5) == 15
+    assert sorted(docs) == [f"v{i:02d}" for i in range(15, 20)]
+
+
+class _Leases:
+    """_take_lease/_release_lease over a dict; `holder` is another process holding the lease."""
+
+    def __init__(self, holder=None, lose_after=None):
+        self.docs = {}
+        self.holder = holder
+        self.lose_after = lose_after
+        self.takes = 0
+
+    def take(self, db, name, owner, ttl):
+        self.takes += 1
+        if self.holder or (self.lose_after is not None and self.takes > self.lose_after):
+            return None
+        return dict(self.docs.get(name, {}), owner=owner)
+
+    def release(self, db, name, owner, state=None):
+        self.docs[name] = dict(self.docs.get(name, {}), **(state or {}))
+
+
+class _HistoryDb:
+    def __init__(self, users, recent_users):
+        self.users = users
+        self.recent_users = recent_users
+        self.recent_since = []
+
+    def collection(self, name):
+        db = self
+
+        class _Users:
+            def select(self, fields):
+                return self
+
+            def stream(self):
+                return [type("U", (), {"id": u})() for u in db.users]
+
+            def document(self, user_id):
+                return type("D", (), {"collection": lambda _self, _name: user_id})()
+
+        return _Users()
+
+    def collection_group(self, name):
+        db = self
+
+        class _Group:
+            def where(self, field, op, value):
+                db.recent_since.append(value)
+                return self
+
+            def select(self, fields):
+                return self
+
+            def stream(self):
+                return [type("H", (), {"reference": type("R", (), {"parent": type("P", (), {
+                    "parent": type("U", (), {"id": u})()})()})()})() for u in db.recent_users]
+
+        return _Group()
+
+
+def _patch_leases(monkeypatch, leases, trimmed):
+    monkeypatch.setattr(history, "_take_lease", leases.take)
+    monkeypatch.setattr(history, "_release_lease", leases.release)
+    monkeypatch.setattr(history, "_trim", lambda db, user_id, keep: trimmed.append(user_id) or 0)
+
+
+def test_compact_history_keeps_its_watermark_in_the_lease(monkeypatch):
+    leases, trimmed = _Leases(), []
+    _patch_leases(monkeypatch, leases, trimmed)
+    db = _HistoryDb(users=["u1", "u2"], recent_users=["u2"])
+
+    history.compact_history(db)
+    assert trimmed == ["u1", "u2"]
+    watermark = leases.docs["compact_history"]["compacted_until"]
+
+    # The next run (in any process) only looks at users with views after the watermark
+    history.compact_history(db)
+    assert trimmed == ["u1", "u2", "u2"]
+    assert db.recent_since == [watermark]
+
+
+def test_compact_history_skips_while_another_process_holds_the_lease(monkeypatch):
+    leases, trimmed = _Leases(holder="other"), []
+    _patch_leases(monkeypatch, leases, trimmed)
+
+    history.compact_history(_HistoryDb(users=["u1"], recent_users=[]))
+
+    assert trimmed == []
+    assert "compact_history" not in leases.docs
+
+
+def test_compact_history_lost_lease_keeps_the_old_watermark(monkeypatch):
+    leases, trimmed = _Leases(lose_after=2), []
+    leases.docs["compact_history"] = {"compacted_until": "old"}
+    _patch_leases(monkeypatch, leases, trimmed)
+
+    # Take + the renewal after the first user succeed, the one after the second fails
+    history.compact_history(_HistoryDb(users=[], recent_users=["u1", "u2", "u3"]))
+
+    assert len(trimmed) == 2
+    assert leases.docs["compact_history"] == {"compacted_until": "old"}
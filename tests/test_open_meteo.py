@@ -0,0 +1,129 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import app as mystyle
+from app import open_meteo
+from app.file_cache import JsonFileCache
+
+LOCATIONS = [
+    {"key": "sapporo", "name": "Sapporo", "lat": 43.064, "lon": 141.347},
+    {"key": "tokyo", "name": "Tokyo", "lat": 35.69, "lon": 139.692},
+    {"key": "naha", "name": "Naha", "lat": 26.212, "lon": 127.681},
+]
+
+
+class _StubOpenMeteo(HTTPServer):
+    """Answers like the forecast API: one object per coordinate, a list for several."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.requests = []        # latitude lists, one per request
+        self.fail_lats = set()    # requests containing one of these latitudes get a 500
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/v1/forecast"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        lats = query["latitude"][0].split(",")
+        self.server.requests.append(lats)
+        if self.server.fail_lats.intersection(lats):
+            self.send_response(500)
+            self.end_headers()
+            return
+        results = [{
+            "current": {"temperature_2m": float(lat)},
+            "daily": {"temperature_2m_max": [30.0], "temperature_2m_min": [20.0],
+                      "precipitation_probability_max": [10], "windspeed_10m_max": [5.0]},
+        } for lat in lats]
+        body = json.dumps(results if len(results) > 1 else results[0]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = _StubOpenMeteo()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(open_meteo, "OPEN_METEO_URL", server.url)
+    monkeypatch.setattr(open_meteo, "MAX_LOCATIONS_PER_REQUEST", 2)
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_locations_are_batched_per_request(stub):
+    out = open_meteo.fetch_weather(LOCATIONS)
+
+    # 3 locations, 2 per request: a list response and a single-object response
+    assert stub.requests == [["43.064", "35.69"], ["26.212"]]
+    assert set(out) == {"sapporo", "tokyo", "naha"}
+    assert out["tokyo"]["current_temp"] == 35.69
+    assert out["naha"]["location"]["name"] == "Naha"
+    assert out["naha"]["today_max"] == 30.0
+
+
+def test_partial_failure_keeps_fetched_locations(stub):
+    stub.fail_lats = {"26.212"}
+
+    with pytest.raises(open_meteo.WeatherFetchError) as exc:
+        open_meteo.fetch_weather(LOCATIONS)
+
+    assert set(exc.value.results) == {"sapporo", "tokyo"}
+    assert "1 of 3 locations failed" in str(exc.value)
+
+
+@pytest.fixture
+def weather_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(mystyle, "weather_file", JsonFileCache(str(tmp_path / "weather_cache.json")))
+    monkeypatch.setattr(mystyle, "LOCATIONS", {loc["key"]: loc for loc in LOCATIONS})
+    return mystyle.weather_file
+
+
+def test_partial_failure_saves_fetched_and_falls_back_for_the_rest(stub, weather_cache):
+    # Naha has data from an earlier run (expired), so it falls back to it
+    weather_cache.save({"locations": {"naha": {"ok": True, "current_temp": 25.0, "fetched_at": 0}}})
+    stub.fail_lats = {"26.212"}
+
+    with pytest.raises(open_meteo.WeatherFetchError) as exc:
+        mystyle._fetch_weather_cache()
+    mystyle._weather_failed(exc.value)
+
+    entries = weather_cache.load()["locations"]
+    assert entries["tokyo"]["ok"] and not entries["tokyo"].get("stale")
+    assert entries["naha"]["stale"] and entries["naha"]["current_temp"] == 25.0
+
+    # The retry only asks for the location that is still due
+    stub.requests.clear()
+    stub.fail_lats = set()
+    mystyle._fetch_weather_cache()
+    assert stub.requests == [["26.212"]]
+    assert not weather_cache.load()["locations"]["naha"].get("stale")
+
+
+def test_fallback_without_previous_data(stub, weather_cache):
+    stub.fail_lats = {"43.064", "26.212"}
+
+    with pytest.raises(open_meteo.WeatherFetchError) as exc:
+        mystyle._fetch_weather_cache()
+    mystyle._weather_failed(exc.value)
+
+    entries = weather_cache.load()["locations"]
+    assert set(entries) == {"sapporo", "tokyo", "naha"}
+    assert all(e["ok"] is False and "error" in e for e in entries.values())
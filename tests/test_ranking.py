@@ -0,0 +1,22 @@
+import random
+
+from app.ranking import top_k
+
+
+def test_top_k_matches_a_full_sort_with_name_tie_break():
+    rng = random.Random(7)
+    # Few distinct scores and names: plenty of ties at the cut-off
+    items = [{"id": str(i), "name": rng.choice("abcde"), "score": rng.randint(0, 5)} for i in range(300)]
+    by_sort = sorted(items, key=lambda it: (it["score"], it["name"]), reverse=True)
+    for k in (1, 10, 57, 300, 400):
+        got = top_k(items, lambda it: it["score"], k)
+        assert [(it["score"], it["name"]) for it in got] == [(it["score"], it["name"]) for it in by_sort[:k]]
+
+
+def test_top_k_above_drops_items_at_or_below_the_threshold():
+    items = [{"id": str(i), "name": str(i), "score": i % 4} for i in range(20)]
+
+    got = top_k(items, lambda it: it["score"], 100, above=1)
+
+    assert len(got) == 10
+    assert all(it["score"] > 1 for it in got)
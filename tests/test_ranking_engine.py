@@ -0,0 +1,84 @@
+import random
+
+import numpy as np
+
+from app.catalog import CatalogSnapshot
+from app.ranking_engine import RankingEngine, _top_rows
+from app.weather_tags import TAG_BITS, WEATHER_TAGS
+
+STYLES = ["カジュアル", "きれいめ", "ストリート", "モード"]
+WEATHER_WEIGHTS = {"waterproof": 3, "outer": 3, "windproof": 2, "layering": 2}
+
+
+def _random_item(rng, item_id):
+    return {
+        "id": item_id,
+        "name": rng.choice(["A", "B", "C"]),
+        "style_tags": tuple(rng.sample(STYLES, rng.randint(0, 2))),
+        "weather_mask": rng.randrange(1 << len(WEATHER_TAGS)),
+        "popularity_score": rng.randint(0, 3),
+    }
+
+
+def _sorted_ids(items, score):
+    """Full sort: score desc, then name desc, then id desc."""
+    return [it["id"] for it in sorted(items, key=lambda it: (score(it), it.get("name") or "", it["id"]), reverse=True)]
+
+
+def test_top_rows_matches_a_full_sort_with_ties_at_the_cut_off():
+    rng = np.random.default_rng(22)
+    for _ in range(200):
+        n = int(rng.integers(1, 60))
+        score = rng.integers(0, 4, n).astype(np.float64)   # few values: ties straddle the k-th row
+        name_rank = np.arange(n)
+        keep = rng.random(n) < 0.8
+        expected = sorted(np.flatnonzero(keep), key=lambda i: (score[i], name_rank[i]), reverse=True)
+        for k in (1, 2, 5, n, n + 3):
+            assert _top_rows(score, name_rank, keep, k) == [int(i) for i in expected[:k]]
+
+
+def test_engine_top_matches_sorted():
+    rng = random.Random(22)
+    items = {str(i): _random_item(rng, str(i)) for i in range(300)}
+    engine = RankingEngine()
+    engine.on_catalog_change(CatalogSnapshot(dict(items), 1), set(items), set())
+
+    def weather(it):
+        return sum(w for tag, w in WEATHER_WEIGHTS.items() if it["weather_mask"] & TAG_BITS[tag])
+
+    for round_ in range(3):
+        catalog = list(items.values())
+        for k in (1, 10, 37, 400):
+            # Integer scores (no popularity term): many exact ties at the k-th item
+            got = engine.top(k, WEATHER_WEIGHTS, styles=["モード"], popularity_weight=0)
+            expected = _sorted_ids(catalog, lambda it: weather(it) + ("モード" in it["style_tags"]))
+            assert [it["id"] for it in got] == expected[:k]
+
+            got = engine.top(k, WEATHER_WEIGHTS, require_weather=True, popularity_weight=0)
+            expected = _sorted_ids([it for it in catalog if weather(it) > 0], weather)
+            assert [it["id"] for it in got] == expected[:k]
+
+            got = engine.style_top("きれいめ", k)
+            expected = _sorted_ids([it for it in catalog if "きれいめ" in it["style_tags"]],
+                                   lambda it: it["popularity_score"])
+            assert [it["id"] for it in got] == expected[:k]
+
+            # Composite score with the popularity term, ranked on the engine's own scores
+            cols, score = engine.scores(WEATHER_WEIGHTS, styles=["カジュアル"])
+            by_id = dict(zip(cols.ids, score.tolist()))
+            got = engine.top(k, WEATHER_WEIGHTS, styles=["カジュアル"])
+            assert [it["id"] for it in got] == _sorted_ids(catalog, lambda it: by_id[it["id"]])[:k]
+
+        # Score-only changes patch the columns, new / removed items rebuild them
+        changed = set(rng.sample(list(items), 30))
+        for item_id in changed:
+            items[item_id] = dict(items[item_id], popularity_score=rng.randint(0, 3),
+                                  weather_mask=rng.randrange(1 << len(WEATHER_TAGS)))
+        engine.on_catalog_change(CatalogSnapshot(dict(items), 2 * round_ + 2), changed, set())
+        if round_ == 1:
+            removed = set(rng.sample(list(items), 10))
+            for item_id in removed:
+                del items[item_id]
+            items["new"] = _random_item(rng, "new")
+            engine.on_catalog_change(CatalogSnapshot(dict(items), 2 * round_ + 3), {"new"}, removed)
+    assert engine.patches >= 2 and engine.builds >= 2
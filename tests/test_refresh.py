@@ -0,0 +1,82 @@
+import threading
+import time
+
+from app.refresh import Refresher
+
+
+def test_follower_timeout_is_not_reported_as_success():
+    started, release = threading.Event(), threading.Event()
+
+    def slow_fetch():
+        started.set()
+        release.wait(5)
+
+    r = Refresher("slow", slow_fetch, is_fresh=lambda: False, retries=0)
+    leader = threading.Thread(target=r.refresh)
+    leader.start()
+    try:
+        assert started.wait(5)
+        assert r.refresh(timeout=0.05) is False
+        assert r.metrics()["join_timeouts"] == 1
+    finally:
+        release.set()
+        leader.join(5)
+    assert r.metrics()["refreshes"] == 1
+
+
+def test_follower_gets_the_result_of_the_refresh_it_joined():
+    started, release = threading.Event(), threading.Event()
+
+    def failing_fetch():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("upstream down")
+
+    r = Refresher("failing", failing_fetch, is_fresh=lambda: False, retries=0)
+    leader = threading.Thread(target=r.refresh)
+    leader.start()
+    assert started.wait(5)
+    results = []
+    follower = threading.Thread(target=lambda: results.append(r.refresh(timeout=5)))
+    follower.start()
+    while r.metrics()["coalesced"] == 0:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == [False]
+    assert r.error() == "upstream down"
+
+
+def test_failures_keep_the_data_stale_and_open_the_breaker():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        raise RuntimeError("upstream down")
+
+    # Failure state is kept by the Refresher: is_fresh() is never made true by a failure
+    r = Refresher("wiki", fetch, is_fresh=lambda: False, retries=0,
+                  breaker_threshold=2, breaker_cooldown_sec=60)
+    assert r.refresh() is False
+    assert r.refresh() is False
+    assert r.metrics()["state"] == "open"
+    assert r.refresh() is False
+    assert len(calls) == 2
+    assert r.metrics()["skipped_open"] == 1
+    assert r.error() == "upstream down"
+
+
+def test_success_clears_the_error():
+    outcomes = [RuntimeError("once"), None]
+
+    def fetch():
+        e = outcomes.pop(0)
+        if e:
+            raise e
+
+    r = Refresher("weather", fetch, is_fresh=lambda: False, retries=0)
+    assert r.refresh() is False
+    assert r.error() == "once"
+    assert r.refresh() is True
+    assert r.error() is None
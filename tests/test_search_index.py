@@ -0,0 +1,67 @@
+import random
+
+from app.search_index import SearchIndex
+
+CHARS = "コートニットデニムabcAB 黒白"
+TAGS = ["カジュアル", "きれいめ", "ストリート", "モード", "a", "Ab"]
+
+
+def _random_item(rng, item_id):
+    return {
+        "id": item_id,
+        "name": "".join(rng.choice(CHARS) for _ in range(rng.randint(0, 8))),
+        "category": rng.choice(["outer", "tops", "コート", ""]),
+        "style_tags": tuple(rng.sample(TAGS, rng.randint(0, 2))),
+        "popularity_score": rng.randint(0, 3),
+    }
+
+
+def _brute_force(query, items):
+    """Substring scan over every item, ranked by tier, popularity, name, id."""
+    q = query.lower()
+    out = []
+    for item in items.values():
+        name, category = item["name"].lower(), item["category"].lower()
+        styles = [s.lower() for s in item["style_tags"]]
+        if q in styles:
+            tier = 3
+        elif q in name:
+            tier = 2
+        elif q in category:
+            tier = 1
+        elif any(q in s for s in styles):
+            tier = 0
+        else:
+            continue
+        out.append((tier, item["popularity_score"], item["name"], item["id"]))
+    return [key[3] for key in sorted(out, reverse=True)]
+
+
+def _queries(rng, items):
+    for item in rng.sample(list(items.values()), 20):
+        text = item["name"] or item["category"]
+        if text:
+            i = rng.randrange(len(text))
+            yield text[i:i + rng.randint(1, 4)]
+    yield from TAGS
+    yield from ("ab", "AB", "コ", "ート", "zz", "黒白黒")
+    for _ in range(20):
+        yield "".join(rng.choice(CHARS) for _ in range(rng.randint(1, 3)))
+
+
+def test_search_matches_a_substring_scan():
+    rng = random.Random(3)
+    items = {str(i): _random_item(rng, str(i)) for i in range(300)}
+    index = SearchIndex()
+    index.on_catalog_change(items, list(items), [])
+
+    for round_ in range(3):
+        for q in _queries(rng, items):
+            assert [it["id"] for it in index.search(q, items)] == _brute_force(q, items), q
+        # Edits and deletions go through the same listener as catalog updates
+        changed = rng.sample(list(items), 40)
+        for item_id in changed[:30]:
+            items[item_id] = _random_item(rng, item_id)
+        for item_id in changed[30:]:
+            del items[item_id]
+        index.on_catalog_change(items, changed[:30], changed[30:])
@@ -0,0 +1,77 @@
+import pytest
+
+from app import stats
+
+
+def test_decay_bound_is_enforced():
+    day = 86400
+    bound = stats.DECAY_EPOCH + stats.DECAY_MAX_HALF_LIVES * stats.DECAY_HALF_LIFE_DAYS * day
+
+    assert stats.decay_days_left(bound - 10 * day) == pytest.approx(10)
+    assert stats._decay_factor(bound - day) < 2.0 ** stats.DECAY_MAX_HALF_LIVES
+    with pytest.raises(ValueError):
+        stats._decay_factor(bound + day)
+
+    assert stats.check_decay_epoch(bound - 400 * day) == pytest.approx(400)
+    with pytest.raises(RuntimeError):
+        stats.check_decay_epoch(bound + day)
+
+
+def test_decay_value_round_trips():
+    now = stats.DECAY_EPOCH + 30 * 86400
+    item = {"decay_score": 7 * stats._decay_factor(now)}
+    assert stats.decay_value(item, now) == pytest.approx(7)
+
+
+def _apply(doc, fields):
+    """A Firestore field update ({"a.b": value or Increment}) applied to a nested dict."""
+    for path, value in fields.items():
+        node = doc
+        parts = path.split(".")
+        for p in parts[:-1]:
+            node = node.setdefault(p, {})
+        if isinstance(value, stats.firestore.Increment):
+            node[parts[-1]] = (node.get(parts[-1]) or 0) + value.value
+        else:
+            node[parts[-1]] = value
+
+
+def _write_events(doc, today, counts):
+    """What write_event_counts writes for one item: reused slots cleared first, then the increments."""
+    fields = {}
+    for e_type, n in counts.items():
+        stats._merge_increments(fields, stats.event_increments(e_type, today, n, today, now=0))
+    _apply(doc, stats._stale_slot_fields(doc, stats._slot_days_of(fields), True))
+    _apply(doc, fields)
+
+
+def test_missed_recompute_does_not_leak_old_counts_into_a_reused_slot():
+    first = 740000
+    days = range(first, first + 3 * stats.RING_DAYS)
+    skipped = first + stats.RING_DAYS + 2  # the nightly recompute of this day never ran
+    early = {day: {"views": day % 5 + 1} for day in days}           # before the recompute (00:00:30)
+    late = {day: {"views": day % 3, "saves": day % 2 + 1} for day in days}
+    doc = {}
+    for today in days:
+        _write_events(doc, today, early[today])
+        if today != skipped:
+            _apply(doc, stats._recomputed_fields(doc, [], today))
+        _write_events(doc, today, late[today])
+
+        # Brute force: the events of the in-window days
+        expected = {e: sum(early[d].get(e, 0) + late[d].get(e, 0) for d in days
+                           if d <= today and stats._in_window(d, today)) for e in stats.WEIGHTS}
+        assert stats._window_totals([doc], today) == expected
+        if today == skipped:
+            # Until the next write reuses its slot, the expired day is still in totals
+            expired = today - stats.WINDOW_DAYS
+            expected = {e: n + early[expired].get(e, 0) + late[expired].get(e, 0) for e, n in expected.items()}
+        assert doc["totals"] == expected
+        assert doc["popularity_score"] == stats._score(expected)
+
+
+def test_slot_still_current_is_not_cleared():
+    doc = {"ring": {"views": {"3": 4}}, "ring_day": {"3": 740003}}
+    assert stats._stale_slot_fields(doc, {"3": 740003}, True) == {}
+    # Cleared by the recompute (ring_day None): nothing left to subtract
+    assert stats._stale_slot_fields({"ring_day": {"3": None}}, {"3": 740011}, True) == {}
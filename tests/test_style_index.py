@@ -0,0 +1,42 @@
+import random
+
+from app.style_index import StyleIndex
+
+STYLES = ["カジュアル", "きれいめ", "ストリート", "モード", "古着"]
+
+
+def _random_item(rng, item_id):
+    return {
+        "id": item_id,
+        "name": rng.choice(["A", "B", "コート", ""]),
+        "style_tags": tuple(rng.sample(STYLES, rng.randint(0, 3))),
+        "popularity_score": rng.randint(0, 4),
+    }
+
+
+def _brute_force(items, styles):
+    """Every matching item, fully sorted: popularity desc, name desc, id desc."""
+    matched = [it for it in items.values() if not styles or set(styles) & set(it["style_tags"])]
+    matched.sort(key=lambda it: (it["popularity_score"], it["name"], it["id"]), reverse=True)
+    return [it["id"] for it in matched]
+
+
+def test_feed_merge_matches_a_full_sort():
+    rng = random.Random(5)
+    items = {str(i): _random_item(rng, str(i)) for i in range(400)}
+    index = StyleIndex()
+    index.on_catalog_change(items, set(items), set())
+
+    for round_ in range(3):
+        for styles in ([], ["モード"], ["カジュアル", "古着"], STYLES, ["カジュアル", "カジュアル"], ["unknown"]):
+            expected = _brute_force(items, styles)
+            assert index.feed(styles) == expected
+            assert index.feed(styles, limit=7) == expected[:7]
+        # Score / style changes and deletions move items between and within the posting lists
+        changed = set(rng.sample(list(items), 50))
+        removed = set(rng.sample(sorted(changed), 10))
+        for item_id in changed - removed:
+            items[item_id] = _random_item(rng, item_id)
+        for item_id in removed:
+            del items[item_id]
+        index.on_catalog_change(items, changed - removed, removed)
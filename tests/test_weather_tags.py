@@ -0,0 +1,39 @@
+import random
+
+from app.weather_tags import (TAG_BITS, WEATHER_KEYWORDS, WEATHER_TAGS, score_table, tags_from_mask,
+                              weather_mask)
+
+KEYWORDS = [k for tag in WEATHER_TAGS for k in WEATHER_KEYWORDS[tag]]
+
+
+def _keyword_scan(text):
+    """The per-item scan weather_mask replaced: `keyword in text` for every keyword."""
+    mask = 0
+    for tag in WEATHER_TAGS:
+        if any(k in text for k in WEATHER_KEYWORDS[tag]):
+            mask |= TAG_BITS[tag]
+    return mask
+
+
+def _texts(rng):
+    yield ""
+    yield from KEYWORDS
+    # Keywords glued together, cut in half and overlapping ("レインジャケット", "layercool", ...)
+    for _ in range(3000):
+        parts = []
+        for _ in range(rng.randint(1, 4)):
+            k = rng.choice(KEYWORDS)
+            parts.append(rng.choice([k, k[:len(k) // 2], k[len(k) // 2:], rng.choice("あ x-")]))
+        yield "".join(parts)
+
+
+def test_weather_mask_matches_the_keyword_scan():
+    for text in _texts(random.Random(21)):
+        assert weather_mask(text) == _keyword_scan(text), text
+
+
+def test_score_table_matches_summing_the_tags():
+    weights = {"waterproof": 3, "outer": 3, "windproof": 2, "layering": -1}
+    table = score_table(weights)
+    for mask in range(1 << len(WEATHER_TAGS)):
+        assert table[mask] == sum(weights.get(t, 0) for t in tags_from_mask(mask))